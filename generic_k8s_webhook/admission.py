@@ -0,0 +1,414 @@
+import base64
+import functools
+import logging
+import time
+from typing import Mapping
+from urllib.parse import parse_qs
+
+import jsonpatch
+
+from generic_k8s_webhook import codec
+from generic_k8s_webhook.coalescing import RequestCoalescer
+from generic_k8s_webhook.config_loader import ConfigLoader
+from generic_k8s_webhook.deadline import DeadlineExceeded, deadline, parse_duration
+from generic_k8s_webhook.decision_cache import CacheKey, Decision, DecisionCache
+from generic_k8s_webhook.limiter import AdaptiveConcurrencyLimiter
+from generic_k8s_webhook.logs import AccessLogger
+from generic_k8s_webhook.metrics import SIZE_BUCKETS, MetricsRegistry
+from generic_k8s_webhook.path_analysis import PathTrie, get_admission_review_paths, get_referenced_paths
+from generic_k8s_webhook.webhook import Webhook
+
+# The body of the response to an admission request. The placeholders are the uid, whether the request
+# is allowed and the optional fields, like the patch
+RESPONSE_TEMPLATE = (
+    b'{"apiVersion":"admission.k8s.io/v1","kind":"AdmissionReview","response":{"uid":%b,"allowed":%b%b}}'
+)
+
+
+class HttpResponse:
+    def __init__(self, status: int, body: bytes = b"", headers: dict[str, str] | None = None) -> None:
+        """The answer to an http request, independent of the server engine that sends it
+
+        Args:
+            status (int): The http status code
+            body (bytes, optional): The content of the response. Defaults to b"".
+            headers (dict[str, str] | None, optional): Extra headers for the response. The
+            Content-Length is always added by the server. Defaults to None.
+        """
+        self.status = status
+        self.body = body
+        self.headers = headers or {}
+
+
+class AdmissionProcessor:  # pylint: disable=too-many-instance-attributes
+    HEALTHZ = "/healthz"
+    METRICS = "/metrics"
+    # The label used for the requests whose path is not defined, so a client can't create
+    # an unbounded number of time series
+    UNKNOWN_PATH = "unknown"
+    DEADLINE_POLICIES = ["fail-open", "fail-closed"]
+    # Seconds that a rejected client should wait before trying again
+    RETRY_AFTER = 1
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        config_loader: ConfigLoader,
+        metrics: MetricsRegistry | None = None,
+        default_timeout: float | None = None,
+        on_deadline: str = "fail-open",
+        limiter: AdaptiveConcurrencyLimiter | None = None,
+        access_logger: AccessLogger | None = None,
+        projected_decoding: bool = False,
+        max_body_bytes: int | None = None,
+        decision_cache: DecisionCache | None = None,
+        coalescer: RequestCoalescer | None = None,
+        skip_unchanged_updates: bool = False,
+    ) -> None:
+        """Processes the requests received by the server. It doesn't know anything about
+        how these requests are received or sent back, so it can be shared by all the server engines.
+        It's safe to call its methods from several threads at the same time.
+
+        Args:
+            config_loader (ConfigLoader): The object that provides the current webhook configuration
+            metrics (MetricsRegistry | None, optional): Where the metrics of the requests are registered.
+            They are exposed at the /metrics path. If None, a new registry is created. Defaults to None.
+            default_timeout (float | None, optional): Max time, in seconds, to evaluate a request
+            when the apiserver doesn't send its own timeout in the url. If None, there's no limit. Defaults to None.
+            on_deadline (str, optional): The response when the evaluation exceeds its deadline.
+            "fail-open" accepts the request without any patch, "fail-closed" rejects it. Defaults to "fail-open".
+            limiter (AdaptiveConcurrencyLimiter | None, optional): If set, the requests over its limit
+            are rejected with a 503 instead of being processed. Defaults to None.
+            access_logger (AccessLogger | None, optional): If set, it logs a record with the outcome of
+            each admission request. Defaults to None.
+            projected_decoding (bool, optional): Only decode the fields of the requests that the webhooks
+            of its path can read or patch. The rest of the body is skipped without creating any python
+            object. Defaults to False.
+            max_body_bytes (int | None, optional): Max size of the body of an admission request. The bigger
+            ones are rejected with a 413 before reading them. If None, there's no limit. Defaults to None.
+            decision_cache (DecisionCache | None, optional): If set, the decisions are cached, so the same
+            object isn't evaluated again while the config doesn't change. Defaults to None.
+            coalescer (RequestCoalescer | None, optional): If set, the identical requests processed at the same
+            time share a single evaluation. Defaults to None.
+            skip_unchanged_updates (bool, optional): Allow the UPDATE requests without evaluating the webhooks
+            when none of the fields they reference has changed, since the old object was already admitted
+            by them. If the decision is cached, the cached one is used instead. Defaults to False.
+        """
+        if on_deadline not in self.DEADLINE_POLICIES:
+            raise ValueError(f"Invalid deadline policy {on_deadline}. Must be one of {self.DEADLINE_POLICIES}")
+        self.config_loader = config_loader
+        self.default_timeout = default_timeout
+        self.on_deadline = on_deadline
+        self.limiter = limiter
+        self.access_logger = access_logger
+        self.projected_decoding = projected_decoding
+        self.max_body_bytes = max_body_bytes
+        self.decision_cache = decision_cache
+        self.coalescer = coalescer
+        self.skip_unchanged_updates = skip_unchanged_updates
+        # The routes for which the paths of the body were computed and, for each url path, these paths
+        self._body_paths_cache: tuple[Mapping | None, dict[str, PathTrie]] = (None, {})
+        # The same for the paths of the object referenced by the webhooks, or None if they can't be analysed
+        self._object_paths_cache: tuple[Mapping | None, dict[str, PathTrie | None]] = (None, {})
+        self.metrics = metrics or MetricsRegistry()
+        self.requests_total = self.metrics.counter(
+            "generic_webhook_requests_total", "Number of admission requests processed", ("path", "decision")
+        )
+        self.request_duration = self.metrics.histogram(
+            "generic_webhook_request_duration_seconds",
+            "Time spent processing an admission request",
+            ("path", "decision"),
+        )
+        self.webhook_duration = self.metrics.histogram(
+            "generic_webhook_webhook_duration_seconds",
+            "Time spent evaluating a single webhook",
+            ("path", "webhook", "decision"),
+        )
+        self.body_bytes = self.metrics.histogram(
+            "generic_webhook_request_body_bytes", "Size of the body of the admission requests", ("path",), SIZE_BUCKETS
+        )
+        self.patch_bytes = self.metrics.histogram(
+            "generic_webhook_patch_bytes", "Size of the JSON patch sent back to the apiserver", ("path",), SIZE_BUCKETS
+        )
+        self.requests_in_flight = self.metrics.gauge(
+            "generic_webhook_requests_in_flight", "Number of admission requests being processed"
+        )
+        self.deadline_exceeded = self.metrics.counter(
+            "generic_webhook_deadline_exceeded_total",
+            "Number of times a webhook was interrupted because the request exceeded its deadline",
+            ("path", "webhook"),
+        )
+        self.requests_rejected = self.metrics.counter(
+            "generic_webhook_requests_rejected_total",
+            "Number of admission requests rejected without being processed because the server is overloaded",
+            ("reason",),
+        )
+        self.unchanged_updates = self.metrics.counter(
+            "generic_webhook_unchanged_updates_total",
+            "Number of UPDATE requests allowed without evaluating the webhooks, since the fields they reference "
+            + "didn't change",
+            ("path",),
+        )
+        self.bodies_rejected = self.metrics.counter(
+            "generic_webhook_request_bodies_rejected_total",
+            "Number of admission requests rejected before reading their body, because of its size",
+            ("reason",),
+        )
+        # Updated by the server engines, which are the ones that allocate the memory for the bodies
+        self.body_buffer_bytes = self.metrics.gauge(
+            "generic_webhook_request_body_buffer_bytes",
+            "Memory, in bytes, allocated to read the bodies of the admission requests",
+        )
+
+    def process_get(self, path: str) -> HttpResponse:
+        if path == self.HEALTHZ:
+            return self._healthz()
+        if path == self.METRICS:
+            return HttpResponse(
+                200, self.metrics.render().encode("utf-8"), {"Content-Type": MetricsRegistry.CONTENT_TYPE}
+            )
+        return HttpResponse(400)
+
+    def process_post(self, path: str, raw_body: bytes | memoryview, client: str, query: str = "") -> HttpResponse:
+        if self.limiter and not self.limiter.try_acquire():
+            return self.overloaded_response("concurrency_limit")
+        start_time = time.perf_counter()
+        self.requests_in_flight.inc()
+        # Filled while the request is processed. It's used for the metrics and the access log
+        access_record = {"path": self.UNKNOWN_PATH, "client": client, "decision": "error", "webhooks": []}
+        try:
+            with deadline(self._get_timeout(query)):
+                return self._process_post(path, raw_body, access_record)
+        finally:
+            latency = time.perf_counter() - start_time
+            path_label, decision = access_record["path"], access_record["decision"]
+            self.requests_in_flight.dec()
+            self.requests_total.inc((path_label, decision))
+            self.request_duration.observe(latency, (path_label, decision))
+            if self.limiter:
+                self.limiter.release(latency, dropped=decision == "deadline_exceeded")
+            if self.access_logger:
+                access_record["latencySeconds"] = round(latency, 6)
+                self.access_logger.log(access_record)
+
+    def overloaded_response(self, reason: str) -> HttpResponse:
+        """The response for a request that is rejected without being processed, so the server
+        doesn't accumulate more work than it can do. The apiserver applies the `failurePolicy`
+        of the webhook to it.
+
+        Args:
+            reason (str): Why the request is rejected. Used to label the metrics
+        """
+        self.requests_rejected.inc((reason,))
+        return HttpResponse(503, headers={"Retry-After": str(self.RETRY_AFTER)})
+
+    def check_body_length(self, content_length: str | None, chunked: bool = False) -> HttpResponse | None:
+        """Validates the length of the body of an admission request, before the server reads it,
+        so a wrong or malicious Content-Length can't make the server allocate an unbounded amount of memory
+
+        Args:
+            content_length (str | None): The value of the Content-Length header. None if it's missing
+            chunked (bool, optional): Whether the body is sent using a Transfer-Encoding. Defaults to False.
+
+        Returns:
+            HttpResponse | None: The response that rejects the request, or None if the body can be read.
+            After rejecting a request, the server must close the connection, since the body isn't read.
+        """
+        # Without a Content-Length, we don't know where the body ends
+        if chunked or content_length is None:
+            self.bodies_rejected.inc(("length_required",))
+            return HttpResponse(411)
+        if not content_length.isdigit():
+            self.bodies_rejected.inc(("invalid_length",))
+            return HttpResponse(400)
+        if self.max_body_bytes is not None and int(content_length) > self.max_body_bytes:
+            self.bodies_rejected.inc(("too_large",))
+            logging.warning(f"Rejecting a request of {content_length} bytes. The limit is {self.max_body_bytes}")
+            return HttpResponse(413)
+        return None
+
+    def _process_post(self, path: str, raw_body: bytes | memoryview, access_record: dict) -> HttpResponse:
+        """Generates the response for an admission request
+
+        Args:
+            path (str): The path of the url
+            raw_body (bytes | memoryview): The body of the request. It can be a view of a buffer that
+            the server reuses for the next requests, so it must not be referenced after returning
+            access_record (dict): It's updated with the path, uid, evaluated webhooks, decision and
+            size of the patch of the request
+        """
+        # Get the config only once, so the whole request is processed using the same one,
+        # even if it's reloaded by another thread in the meantime
+        generation, _, routes = self.config_loader.get_snapshot()
+        webhooks = routes.get(path)
+
+        # The path in the url is not defined in this server
+        if webhooks is None:
+            logging.error(f"Wrong path {path} Not defined")
+            access_record["decision"] = "invalid_path"
+            return HttpResponse(400)
+        access_record["path"] = path
+
+        self.body_bytes.observe(len(raw_body), (path,))
+        request = self._get_body_request(raw_body, routes, path)
+        uid = request["uid"]
+        access_record["uid"] = uid
+        decision_key = None
+        if self.decision_cache:
+            decision_key = self.decision_cache.get_key(generation, path, webhooks, request["object"])
+            decision = self.decision_cache.get(decision_key)
+            if decision:
+                return self._decision_response(uid, path, decision, access_record)
+        elif self.coalescer:
+            decision_key = self.coalescer.keys.get_key(generation, path, webhooks, request["object"])
+        if self.skip_unchanged_updates and self._is_unchanged_update(routes, path, request):
+            self.unchanged_updates.inc((path,))
+            return self._decision_response(uid, path, (True, b"", []), access_record)
+
+        evaluate = functools.partial(self._evaluate, path, webhooks, request["object"], access_record, decision_key)
+        try:
+            decision = self.coalescer.evaluate(decision_key, evaluate) if self.coalescer else evaluate()
+        except DeadlineExceeded:
+            access_record["decision"] = "deadline_exceeded"
+            # The webhook that was interrupted is the last one evaluated
+            return self._deadline_exceeded_response(uid, path, access_record["webhooks"][-1])
+        return self._decision_response(uid, path, decision, access_record)
+
+    def _evaluate(  # pylint: disable=too-many-arguments
+        self,
+        path: str,
+        webhooks: tuple[Webhook, ...],
+        obj: dict,
+        access_record: dict,
+        decision_key: CacheKey | None,
+    ) -> Decision:
+        """Evaluates the webhooks and caches their decision, if there's a decision cache"""
+        accept, raw_patch = self._run_webhooks(path, webhooks, obj, access_record)
+        decision = (accept, raw_patch, list(access_record["webhooks"]))
+        if self.decision_cache:
+            self.decision_cache.put(decision_key, decision)
+        return decision
+
+    def _run_webhooks(
+        self, path: str, webhooks: tuple[Webhook, ...], obj: dict, access_record: dict
+    ) -> tuple[bool, bytes]:
+        """Calls in order all the webhooks that have the target path. They all must set accept=True to
+        accept the request. The patches are concatenated and applied for the next call to "process_manifest"
+
+        Returns:
+            tuple[bool, bytes]: Whether the request is accepted and the encoded JSON patch, empty if there's none
+        """
+        final_patch = jsonpatch.JsonPatch([])
+        for webhook in webhooks:
+            webhook_start_time = time.perf_counter()
+            # The call to the current webhook needs a json object that has been updated by the previous patches.
+            # Applying a patch copies the whole object, so it's skipped when there's nothing to apply
+            patched_object = final_patch.apply(obj) if final_patch else obj
+            access_record["webhooks"].append(webhook.name)
+            accept, patch = webhook.process_manifest(patched_object)
+            final_patch = jsonpatch.JsonPatch(list(final_patch) + list(patch))
+            self.webhook_duration.observe(
+                time.perf_counter() - webhook_start_time, (path, webhook.name, self._get_decision(accept))
+            )
+            if not accept:
+                break
+        return accept, codec.dumps(final_patch.patch) if final_patch else b""
+
+    def _decision_response(self, uid: str, path: str, decision: Decision, access_record: dict) -> HttpResponse:
+        """The response to the request `uid`, once the webhooks have decided whether to accept it"""
+        accept, raw_patch, webhook_names = decision
+        self.patch_bytes.observe(len(raw_patch), (path,))
+        access_record["webhooks"] = webhook_names
+        access_record["patchBytes"] = len(raw_patch)
+        access_record["decision"] = self._get_decision(accept)
+        return HttpResponse(200, self._generate_response(uid, accept, raw_patch))
+
+    @staticmethod
+    def _get_decision(accept: bool) -> str:
+        return "allowed" if accept else "denied"
+
+    def _get_timeout(self, query: str) -> float | None:
+        """Returns the timeout of the current request. The apiserver sends it in the `timeout`
+        parameter of the url, using the `timeoutSeconds` of the webhook configuration
+        """
+        list_timeouts = parse_qs(query).get("timeout")
+        if not list_timeouts:
+            return self.default_timeout
+        try:
+            return parse_duration(list_timeouts[0])
+        except ValueError as e:
+            logging.warning(f"Ignoring the timeout of the request: {e}")
+            return self.default_timeout
+
+    def _deadline_exceeded_response(self, uid: str, path: str, webhook_name: str) -> HttpResponse:
+        """The response when a webhook is interrupted because the request has exceeded its deadline.
+        Any patch generated until this point is discarded.
+        """
+        self.deadline_exceeded.inc((path, webhook_name))
+        message = f"The webhook {webhook_name} exceeded its deadline"
+        logging.warning(f"{message} when processing the request {uid}")
+        accept = self.on_deadline == "fail-open"
+        if accept:
+            extra_fields = {"warnings": [message]}
+        else:
+            extra_fields = {"status": {"message": message}}
+        return HttpResponse(200, self._generate_response(uid, accept, b"", extra_fields))
+
+    def _generate_response(self, uid: str, accept: bool, raw_patch: bytes, extra_fields: dict | None = None) -> bytes:
+        """Generates the body of the response from a pre-built template, so only the fields that change
+        between requests are encoded
+
+        Args:
+            uid (str): The uid of the request
+            accept (bool): Whether the request is allowed
+            raw_patch (bytes): The JSON patch to apply to the object. Empty if there's no patch
+            extra_fields (dict | None, optional): Other fields to add to the "response". Defaults to None.
+        """
+        optional_fields = b""
+        if raw_patch:
+            optional_fields += b',"patchType":"JSONPatch","patch":"' + base64.b64encode(raw_patch) + b'"'
+        if extra_fields:
+            # Remove the braces of the encoded dict, so its fields are added to the response
+            optional_fields += b"," + codec.dumps(extra_fields)[1:-1]
+        return RESPONSE_TEMPLATE % (codec.dumps(uid), b"true" if accept else b"false", optional_fields)
+
+    def _healthz(self) -> HttpResponse:
+        return HttpResponse(200, "I'm alive\n".encode("utf-8"))
+
+    def _get_body_request(
+        self, raw_body: bytes | memoryview, routes: Mapping[str, tuple[Webhook, ...]], path: str
+    ) -> dict:
+        """Returns the "request" field of the body of the current request"""
+        if self.projected_decoding:
+            body = self._get_body_paths(routes, path).decode(raw_body)
+        else:
+            body = codec.loads(raw_body)
+        request = body["request"]
+        return request
+
+    def _is_unchanged_update(self, routes: Mapping[str, tuple[Webhook, ...]], path: str, request: dict) -> bool:
+        """Whether the request updates an object without changing any of the fields that the webhooks of
+        `path` read or patch, so their decision can't be different from the one for the old object
+        """
+        if request.get("operation") != "UPDATE" or request.get("oldObject") is None:
+            return False
+        cached_routes, object_paths = self._object_paths_cache
+        if cached_routes is not routes:
+            object_paths = {}
+            self._object_paths_cache = (routes, object_paths)
+        if path not in object_paths:
+            object_paths[path] = get_referenced_paths(routes[path])
+        referenced_paths = object_paths[path]
+        if referenced_paths is None:
+            return False
+        return referenced_paths.project(request["object"]) == referenced_paths.project(request["oldObject"])
+
+    def _get_body_paths(self, routes: Mapping[str, tuple[Webhook, ...]], path: str) -> PathTrie:
+        """Returns the paths of the body used by the webhooks of `path`. They are computed once for each config"""
+        cached_routes, body_paths = self._body_paths_cache
+        if cached_routes is not routes:
+            body_paths = {}
+            self._body_paths_cache = (routes, body_paths)
+        if path not in body_paths:
+            body_paths[path] = get_admission_review_paths(routes[path], self.skip_unchanged_updates)
+            logging.info(f"Only decoding {body_paths[path].get_paths()} from the requests to {path}")
+        return body_paths[path]
@@ -0,0 +1,361 @@
+import asyncio
+import http
+import logging
+import socket
+import ssl
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from generic_k8s_webhook import http2
+from generic_k8s_webhook.admission import AdmissionProcessor, HttpResponse
+from generic_k8s_webhook.unix_socket import bind_unix_socket, get_client_address, remove_unix_socket
+
+
+class BadRequest(Exception):
+    pass
+
+
+class AsyncioHTTPServer:  # pylint: disable=too-many-instance-attributes
+    MAX_HEADERS = 100
+    # Max time, in seconds, that a client can take to send a request once the connection is established
+    REQUEST_TIMEOUT = 30
+    # The bodies up to this size, in bytes, are read into buffers that are reused by the next requests.
+    # The bigger ones get a buffer of their own, released after answering the request
+    BODY_BUFFER_SIZE = 1 << 20
+    # The responses sent without reading the body of the request, so the connection can't be reused
+    UNREAD_BODY_STATUSES = (400, 411, 413)
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        server_address: tuple[str, int] | str,
+        processor: AdmissionProcessor,
+        ssl_context: ssl.SSLContext | None,
+        max_workers: int,
+        reuse_port: bool = False,
+        keep_alive_timeout: float = 15,
+        max_requests_per_connection: int = 1000,
+        max_queue_size: int = 128,
+        drain_timeout: float | None = None,
+        enable_http2: bool = False,
+        max_concurrent_streams: int = 100,
+        unix_socket_mode: int = 0o660,
+    ) -> None:
+        """An http server that handles all the connections in an asyncio event loop. Reading
+        the requests and writing the responses is done in the event loop, but the evaluation
+        of the webhooks is CPU bound, so it's delegated to a pool of threads to not block the loop.
+        It exposes the same `serve_forever`, `shutdown` and `server_close` methods as the
+        servers from the `http.server` module.
+
+        Args:
+            server_address (tuple[str, int] | str): The address and port where the server listens to,
+            or the path of a Unix domain socket
+            processor (AdmissionProcessor): The object that generates the response for each request
+            ssl_context (ssl.SSLContext | None): The TLS configuration. If None, the server is http, not https
+            max_workers (int): Number of threads used to evaluate the webhooks
+            reuse_port (bool, optional): Sets SO_REUSEPORT, so several processes can listen
+            to the same port. Defaults to False.
+            keep_alive_timeout (float, optional): Max time, in seconds, that a connection can stay
+            idle waiting for the next request. Defaults to 15.
+            max_requests_per_connection (int, optional): The server closes a connection after
+            answering this number of requests. Defaults to 1000.
+            max_queue_size (int, optional): Max number of requests waiting for a free thread. The requests
+            received when this limit is reached are rejected with a 503. Defaults to 128.
+            drain_timeout (float | None, optional): Max time, in seconds, that `shutdown` waits for the
+            connections in the middle of a request. If None, there's no limit. Defaults to None.
+            enable_http2 (bool, optional): Accepts HTTP/2 connections, negotiated with ALPN (the `ssl_context`
+            must offer the "h2" protocol) or without TLS. It needs the `h2` package. Defaults to False.
+            max_concurrent_streams (int, optional): Max number of requests that a client can send at the
+            same time through an HTTP/2 connection. Defaults to 100.
+            unix_socket_mode (int, optional): The permissions of the Unix domain socket, when `server_address`
+            is a path. Defaults to 0o660.
+        """
+        if enable_http2 and not http2.is_available():
+            raise ValueError("HTTP/2 needs the h2 package, which is not installed")
+        self.processor = processor
+        self.ssl_context = ssl_context
+        self.keep_alive_timeout = keep_alive_timeout
+        self.max_requests_per_connection = max_requests_per_connection
+        self.max_workers = max_workers
+        self.max_queue_size = max_queue_size
+        self.max_pending_requests = max_workers + max_queue_size
+        self.drain_timeout = drain_timeout
+        self.enable_http2 = enable_http2
+        self.max_concurrent_streams = max_concurrent_streams
+        # Buffers of the previous requests, reused to read the next bodies. Only used from the event loop
+        self._body_buffers: list[bytearray] = []
+        # Requests sent to the pool of threads that haven't finished yet. It's only modified from the event loop
+        self._pending_requests = 0
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="webhook-eval")
+        # The socket is bound here, like `http.server.HTTPServer` does, so the port is reserved
+        # as soon as the server is created
+        self.unix_socket = server_address if isinstance(server_address, str) else None
+        if self.unix_socket:
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                bind_unix_socket(self.socket, self.unix_socket, unix_socket_mode)
+                # Like `socket.create_server`, so another server sees that the socket is in use
+                self.socket.listen()
+            except (OSError, ValueError):
+                self.socket.close()
+                raise
+        else:
+            self.socket = socket.create_server(server_address, reuse_port=reuse_port)
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._shutdown_request: asyncio.Event | None = None
+        # Connections waiting for the next request. They are closed when the server stops
+        self.idle_writers: set[asyncio.StreamWriter] = set()
+        # The task and the writer of each open connection
+        self._connections: dict[asyncio.Task, asyncio.StreamWriter] = {}
+        self.closing = False
+        self._running = threading.Event()
+        self._not_accepting = threading.Event()
+        self._stopped = threading.Event()
+
+    def serve_forever(self) -> None:
+        try:
+            asyncio.run(self._serve())
+        finally:
+            self._not_accepting.set()
+            self._stopped.set()
+
+    async def _serve(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._shutdown_request = asyncio.Event()
+        server = await asyncio.start_server(self._handle_connection, sock=self.socket, ssl=self.ssl_context)
+        self._running.set()
+        await self._shutdown_request.wait()
+
+        self.closing = True
+        server.close()
+        self._not_accepting.set()
+        # The connections in the middle of a request finish it, but the idle ones are closed now. They are
+        # aborted, since a TLS connection would otherwise wait for the client to confirm the close
+        for writer in list(self.idle_writers):
+            writer.transport.abort()
+        await server.wait_closed()
+        # Wait for all the connections to finish: the idle ones right away and the ones in the middle
+        # of a request after answering it. The ones still open after `drain_timeout` are cancelled here,
+        # so their tasks have finished when the loop is closed
+        connections = list(self._connections)
+        if connections:
+            _, pending = await asyncio.wait(connections, timeout=self.drain_timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.wait(pending)
+
+    def shutdown(self) -> None:
+        """Stops accepting new connections and waits until the listener is closed. The `serve_forever`
+        loop finishes once the connections in the middle of a request have answered it (or after
+        `drain_timeout`). It must be called from a different thread than the one running `serve_forever`
+        """
+        self._running.wait()
+        if self._stopped.is_set():
+            return
+        self._loop.call_soon_threadsafe(self._shutdown_request.set)
+        self._not_accepting.wait()
+
+    def start_draining(self) -> None:
+        """From now on, the connections are closed after answering their current request"""
+        self.closing = True
+
+    def server_close(self) -> None:
+        self.socket.close()
+        if self.unix_socket:
+            remove_unix_socket(self.unix_socket)
+        self.executor.shutdown()
+
+    def get_queue_depth(self) -> int:
+        """Number of requests waiting for a free thread"""
+        return max(0, self._pending_requests - self.max_workers)
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        client = self._get_client(writer)
+        task = asyncio.current_task()
+        self._connections[task] = writer
+        try:
+            if self._negotiated_http2(writer):
+                await http2.Http2Connection(self, reader, writer, client).serve()
+            else:
+                await self._serve_http1(reader, writer, client)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logging.error(e, exc_info=True)
+        except asyncio.CancelledError:
+            # The server has stopped before the request was answered. The task finishes normally,
+            # since the callback of `asyncio.start_server` logs an error for each cancelled connection
+            logging.warning(f"Closing the connection from {client} in the middle of a request")
+        finally:
+            self._connections.pop(task, None)
+            writer.close()
+
+    async def _serve_http1(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, client: tuple) -> None:
+        """Answers the HTTP/1.1 requests of the connection, one after the other, until it must be closed"""
+        for n_request in range(1, self.max_requests_per_connection + 1):
+            # The first request must come right after opening the connection. The next ones
+            # can wait as long as the keep alive timeout
+            timeout = self.REQUEST_TIMEOUT if n_request == 1 else self.keep_alive_timeout
+            self.idle_writers.add(writer)
+            try:
+                request_head = await asyncio.wait_for(self._read_request_head(reader), timeout)
+            except BadRequest as e:
+                logging.error(f"Bad request from {client}: {e}")
+                await self._write_response(writer, HttpResponse(400), keep_alive=False)
+                return
+            except TimeoutError:
+                return
+            finally:
+                self.idle_writers.discard(writer)
+            # The client closed the connection
+            if request_head is None:
+                return
+            method, target, version, headers = request_head
+            if self.enable_http2 and n_request == 1 and (method, target, version) == ("PRI", "*", "HTTP/2.0"):
+                # A client that uses HTTP/2 without TLS. What has been read so far is the start of its preface
+                await http2.Http2Connection(self, reader, writer, client).serve(http2.PREFACE_HEAD)
+                return
+
+            keep_alive = (
+                version == "HTTP/1.1"
+                and headers.get("connection", "").lower() != "close"
+                and n_request < self.max_requests_per_connection
+            )
+            response = await self._process_request(reader, method, target, headers, client)
+            keep_alive = keep_alive and not self.closing and response.status not in self.UNREAD_BODY_STATUSES
+            await self._write_response(writer, response, keep_alive)
+            if not keep_alive:
+                return
+
+    def _get_client(self, writer: asyncio.StreamWriter) -> tuple:
+        if self.unix_socket:
+            return get_client_address(self.unix_socket)
+        return writer.get_extra_info("peername")
+
+    def _negotiated_http2(self, writer: asyncio.StreamWriter) -> bool:
+        """The clients that use TLS choose HTTP/2 during the handshake, with ALPN"""
+        if not self.enable_http2:
+            return False
+        ssl_object = writer.get_extra_info("ssl_object")
+        return ssl_object is not None and ssl_object.selected_alpn_protocol() == http2.ALPN_PROTOCOL
+
+    async def _process_request(  # pylint: disable=too-many-arguments
+        self, reader: asyncio.StreamReader, method: str, target: str, headers: dict[str, str], client: tuple
+    ) -> HttpResponse:
+        if method != "POST":
+            return await self.dispatch(method, target, b"", client)
+        error_response = self.processor.check_body_length(headers.get("content-length"), "transfer-encoding" in headers)
+        if error_response:
+            return error_response
+        content_length = int(headers["content-length"])
+        buffer = self._take_body_buffer(content_length)
+        try:
+            raw_body = await asyncio.wait_for(self._read_body(reader, buffer, content_length), self.REQUEST_TIMEOUT)
+            return await self.dispatch(method, target, raw_body, client)
+        finally:
+            self._release_body_buffer(buffer)
+
+    async def dispatch(
+        self, method: str, target: str, raw_body: bytes | bytearray | memoryview, client: tuple
+    ) -> HttpResponse:
+        """Generates the response of a request whose body has already been read. It's shared by
+        the HTTP/1.1 and the HTTP/2 connections
+
+        Args:
+            method (str): The http method
+            target (str): The path and the query of the url
+            raw_body (bytes | bytearray | memoryview): The body of the request. Empty for the GET requests
+            client (tuple): The address of the client
+        """
+        parsed_url = urlparse(target)
+        path = parsed_url.path
+        if method == "GET":
+            # Rendering the metrics can take a while, so it's not done in the event loop
+            return await self._loop.run_in_executor(self.executor, self.processor.process_get, path)
+        if method == "POST":
+            # The pool of threads has an unbounded queue, so we don't let it grow more than the limit
+            if self._pending_requests >= self.max_pending_requests:
+                return self.processor.overloaded_response("queue_full")
+            self._pending_requests += 1
+            try:
+                return await self._loop.run_in_executor(
+                    self.executor, self.processor.process_post, path, raw_body, client[0], parsed_url.query
+                )
+            finally:
+                self._pending_requests -= 1
+        return HttpResponse(501)
+
+    def _take_body_buffer(self, size: int) -> bytearray:
+        """Returns a buffer of at least `size` bytes, reusing one of a previous request if possible"""
+        buffer = self._body_buffers.pop() if self._body_buffers else bytearray()
+        if len(buffer) < size:
+            # The size is rounded up to a power of two, so it doesn't grow with every bigger request
+            new_size = size if size > self.BODY_BUFFER_SIZE else max(4096, 1 << (size - 1).bit_length())
+            self.processor.body_buffer_bytes.inc(amount=new_size - len(buffer))
+            buffer = bytearray(new_size)
+        return buffer
+
+    def _release_body_buffer(self, buffer: bytearray) -> None:
+        """Keeps the buffer for the next requests, unless it's too big or there are enough buffers already"""
+        if len(buffer) <= self.BODY_BUFFER_SIZE and len(self._body_buffers) < self.max_workers:
+            self._body_buffers.append(buffer)
+        else:
+            self.processor.body_buffer_bytes.dec(amount=len(buffer))
+
+    @staticmethod
+    async def _read_body(reader: asyncio.StreamReader, buffer: bytearray, content_length: int) -> memoryview:
+        """Reads the body of the request into `buffer`. The stream only holds a small chunk of it
+        at a time, instead of the whole body like `readexactly` does
+
+        Returns:
+            memoryview: The part of `buffer` that contains the body
+        """
+        body = memoryview(buffer)[:content_length]
+        n_read = 0
+        while n_read < content_length:
+            chunk = await reader.read(content_length - n_read)
+            if not chunk:
+                raise ConnectionError(f"The connection was closed after receiving {n_read} bytes of the body")
+            body[n_read : n_read + len(chunk)] = chunk
+            n_read += len(chunk)
+        return body
+
+    async def _read_request_head(self, reader: asyncio.StreamReader) -> tuple[str, str, str, dict[str, str]] | None:
+        """Reads the request line and the headers of an http request
+
+        Returns:
+            tuple[str, str, str, dict[str, str]] | None: the method, the target, the http version
+            and the headers. The name of the headers is always lowercase. None if the connection
+            is closed before receiving anything.
+        """
+        raw_request_line = await reader.readline()
+        if not raw_request_line:
+            return None
+        request_line = raw_request_line.decode("iso-8859-1").rstrip("\r\n")
+        words = request_line.split()
+        if len(words) != 3 or not words[2].startswith("HTTP/"):
+            raise BadRequest(f"Invalid request line {request_line!r}")
+        method, target, version = words
+
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode("iso-8859-1").rstrip("\r\n")
+            if not line:
+                break
+            if len(headers) >= self.MAX_HEADERS:
+                raise BadRequest("Too many headers")
+            name, sep, value = line.partition(":")
+            if not sep:
+                raise BadRequest(f"Invalid header {line!r}")
+            headers[name.strip().lower()] = value.strip()
+        return method, target, version, headers
+
+    async def _write_response(self, writer: asyncio.StreamWriter, response: HttpResponse, keep_alive: bool) -> None:
+        status = http.HTTPStatus(response.status)
+        head = f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+        for name, value in response.headers.items():
+            head += f"{name}: {value}\r\n"
+        head += f"Content-Length: {len(response.body)}\r\n"
+        if not keep_alive:
+            head += "Connection: close\r\n"
+        writer.write(head.encode("iso-8859-1") + b"\r\n" + response.body)
+        await writer.drain()
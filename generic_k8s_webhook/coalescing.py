@@ -0,0 +1,66 @@
+import threading
+from typing import Callable
+
+from generic_k8s_webhook.deadline import get_time_left
+from generic_k8s_webhook.decision_cache import CacheKey, Decision, DecisionKeys
+from generic_k8s_webhook.metrics import MetricsRegistry
+
+
+class _Flight:
+    def __init__(self) -> None:
+        """An evaluation in progress. It's done once the leader has finished, even if it failed"""
+        self.done = threading.Event()
+        self.decision: Decision | None = None
+
+
+class RequestCoalescer:
+    def __init__(self, keys: DecisionKeys, metrics: MetricsRegistry | None = None) -> None:
+        """Coalesces the identical admission requests that are processed at the same time, like the ones
+        of the pods created when a Deployment scales up. The first one (the leader) evaluates the webhooks
+        and the rest wait for its decision, instead of evaluating the same object again. Each request
+        still sends its own response, with its own uid.
+
+        Args:
+            keys (DecisionKeys): Computes the key of each request. The requests with the same key get
+            the same decision
+            metrics (MetricsRegistry | None, optional): Where the coalesced requests are registered.
+            If None, a new registry is created. Defaults to None.
+        """
+        self.keys = keys
+        self._flights: dict[CacheKey, _Flight] = {}
+        self._lock = threading.Lock()
+        metrics = metrics or MetricsRegistry()
+        self.requests = metrics.counter(
+            "generic_webhook_request_coalescing_total",
+            "Number of admission requests that were evaluated (leader), that got the decision of an identical "
+            + "request in flight (coalesced) or that had to be evaluated after waiting for it (fallback)",
+            ("result",),
+        )
+
+    def evaluate(self, key: CacheKey, func: Callable[[], Decision]) -> Decision:
+        """Returns the decision of the request `key`. It's computed by `func`, unless an identical request
+        is already being evaluated. In that case, it waits for its decision until the deadline of the current
+        request. If the leader fails or it doesn't finish in time, `func` is called anyway.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            is_leader = flight is None
+            if is_leader:
+                flight = self._flights[key] = _Flight()
+
+        if is_leader:
+            self.requests.inc(("leader",))
+            try:
+                flight.decision = func()
+                return flight.decision
+            finally:
+                with self._lock:
+                    del self._flights[key]
+                flight.done.set()
+
+        if flight.done.wait(get_time_left()) and flight.decision is not None:
+            self.requests.inc(("coalesced",))
+            return flight.decision
+        # When the deadline has already passed, this evaluation stops right away, like any other one
+        self.requests.inc(("fallback",))
+        return func()
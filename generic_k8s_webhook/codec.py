@@ -0,0 +1,64 @@
+import json
+import re
+from typing import Any
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# The JSON library used to decode the requests and encode the responses. orjson is several times faster
+# than the standard library with big manifests, but it's optional, so we fall back to `json` when it's missing
+BACKEND = "orjson" if orjson else "json"
+
+
+# orjson decodes the integers that don't fit in 64 bits as floats, losing precision. They have at least
+# 19 digits, so the documents with such a long run of digits are decoded with `json` instead
+_LONG_NUMBER = re.compile(r"[0-9]{19}")
+_LONG_DIGITS = b"0" * 19
+# Maps the digits to "0" and the rest of the bytes to a space, so the long runs of digits can be found with `find`,
+# which is much faster than a regex
+_DIGITS_TABLE = bytes(ord("0") if chr(i) in "0123456789" else ord(" ") for i in range(256))
+# The bytes documents are scanned in chunks of this size, so the translated copy is small
+_CHUNK_SIZE = 1 << 16
+
+
+def loads(data: bytes | memoryview | str) -> Any:
+    if orjson and not _has_long_numbers(data):
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # orjson is stricter than `json` in some corner cases, like invalid surrogates in the strings
+            pass
+    if isinstance(data, memoryview):
+        # `json` doesn't accept memoryviews, only bytes and str
+        data = data.tobytes()
+    return json.loads(data)
+
+
+def dumps(obj: Any, sort_keys: bool = False) -> bytes:
+    """Encodes `obj` as compact JSON (without whitespaces). With `sort_keys`, the keys of the dicts are
+    sorted, so two equal objects are always encoded the same way
+    """
+    if orjson:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS if sort_keys else None)
+        except TypeError:
+            # For example, dicts whose keys are not strings, which `json` converts to strings
+            pass
+    return json.dumps(obj, separators=(",", ":"), sort_keys=sort_keys).encode("utf-8")
+
+
+def _has_long_numbers(data: bytes | memoryview | str) -> bool:
+    """True if `data` has a run of digits that could be an integer bigger than 64 bits. The digits
+    can also be part of a string, which only means that the document is decoded by the slower `json`
+    """
+    if isinstance(data, str):
+        return _LONG_NUMBER.search(data) is not None
+    view = memoryview(data)
+    for start in range(0, len(view), _CHUNK_SIZE):
+        # The chunks overlap, so the digits split between two of them are also found
+        chunk = view[max(0, start - len(_LONG_DIGITS) + 1) : start + _CHUNK_SIZE].tobytes()
+        if chunk.translate(_DIGITS_TABLE).find(_LONG_DIGITS) != -1:
+            return True
+    return False
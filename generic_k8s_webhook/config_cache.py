@@ -0,0 +1,152 @@
+import functools
+import hashlib
+import logging
+import os
+import pickle
+import sys
+import tempfile
+
+from generic_k8s_webhook import __version__
+from generic_k8s_webhook.config_parser.entrypoint import GenericWebhookConfigManifest
+from generic_k8s_webhook.metrics import MetricsRegistry
+
+# Changed when the layout of the files of the cache changes
+FORMAT_VERSION = 1
+MAGIC = b"GKWCACHE"
+ENTRY_SUFFIX = ".pickle"
+# Max number of configs kept in the directory. The oldest ones are removed first
+MAX_ENTRIES = 8
+
+
+@functools.cache
+def get_code_fingerprint() -> str:
+    """Identifies the code that compiled a config: the version of the package and of Python, and the files of
+    the package. The files are part of it because the version isn't bumped by every change in a development tree,
+    and a compiled config must never be loaded by a code that defines its classes in a different way
+    """
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    digest = hashlib.sha256(f"{FORMAT_VERSION}:{__version__}:{sys.version}".encode())
+    for root, dirs, files in os.walk(package_dir):
+        dirs.sort()
+        for file in sorted(files):
+            if file.endswith(".py"):
+                path = os.path.join(root, file)
+                stat = os.stat(path)
+                digest.update(f"{os.path.relpath(path, package_dir)}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return digest.hexdigest()
+
+
+class CompiledConfigCache:
+    def __init__(self, directory: str, metrics: MetricsRegistry | None = None) -> None:
+        """An on-disk cache of the compiled configs, so a server that starts (for example, a new pod added
+        by the HPA) doesn't parse again a config that another one has already parsed. Parsing a config builds
+        the grammar of the expressions and all its operators, while loading a compiled one is a fraction of that.
+
+        Each entry is a pickled GenericWebhookConfigManifest, indexed by the digest of the raw config and by
+        the fingerprint of the code (see `get_code_fingerprint`), so an upgrade never loads the configs compiled
+        by a previous version. A file that is corrupt, truncated or can't be unpickled is ignored and removed,
+        and the config is parsed as if it weren't cached.
+
+        Loading a pickle can run arbitrary code, so the directory must only be writable by the user that runs
+        the server. The files owned by other users are ignored.
+
+        Args:
+            directory (str): Where the compiled configs are stored. It's created if it doesn't exist
+            metrics (MetricsRegistry | None, optional): Where the hits and misses are registered.
+            If None, a new registry is created. Defaults to None.
+        """
+        self.directory = directory
+        metrics = metrics or MetricsRegistry()
+        self.lookups = metrics.counter(
+            "generic_webhook_config_cache_lookups_total",
+            "Number of configs looked up in the on-disk cache of compiled configs, by result: found (hit), "
+            + "not found (miss) or found but ignored because it's corrupt (invalid)",
+            ("result",),
+        )
+
+    def get(self, raw_manifest: bytes) -> GenericWebhookConfigManifest | None:
+        """Returns the compiled config of `raw_manifest`, or None if it isn't in the cache"""
+        path = self._get_path(raw_manifest)
+        try:
+            with open(path, "rb") as f:
+                if os.fstat(f.fileno()).st_uid != os.getuid():
+                    raise ValueError("the file is owned by another user")
+                data = f.read()
+        except FileNotFoundError:
+            self.lookups.inc(("miss",))
+            return None
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring the compiled config {path}: {e}")
+            self.lookups.inc(("invalid",))
+            return None
+        try:
+            manifest = self._decode(data)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            # Unpickling a damaged file can raise almost any exception
+            logging.warning(f"Removing the compiled config {path}, which is corrupt: {type(e).__name__}: {e}")
+            self.lookups.inc(("invalid",))
+            self._remove(path)
+            return None
+        self.lookups.inc(("hit",))
+        return manifest
+
+    def put(self, raw_manifest: bytes, manifest: GenericWebhookConfigManifest) -> None:
+        """Stores the compiled config of `raw_manifest`. A failure is only logged, since the cache is optional"""
+        try:
+            payload = pickle.dumps(manifest, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logging.warning(f"Cannot cache the compiled config: {type(e).__name__}: {e}")
+            return
+        path = self._get_path(raw_manifest)
+        try:
+            os.makedirs(self.directory, mode=0o700, exist_ok=True)
+            # The file is written with another name and renamed, so a concurrent reader (like another worker)
+            # never sees it half written
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(MAGIC + hashlib.sha256(payload).digest() + payload)
+                os.replace(tmp_path, path)
+            except BaseException:
+                self._remove(tmp_path)
+                raise
+            self._prune()
+        except OSError as e:
+            logging.warning(f"Cannot cache the compiled config in {self.directory}: {e}")
+
+    def _get_path(self, raw_manifest: bytes) -> str:
+        key = hashlib.sha256(get_code_fingerprint().encode() + hashlib.sha256(raw_manifest).digest()).hexdigest()
+        return os.path.join(self.directory, key + ENTRY_SUFFIX)
+
+    @staticmethod
+    def _decode(data: bytes) -> GenericWebhookConfigManifest:
+        header_size = len(MAGIC) + hashlib.sha256().digest_size
+        if len(data) < header_size or not data.startswith(MAGIC):
+            raise ValueError("invalid header")
+        # The checksum detects the truncated and damaged files before unpickling them
+        payload = data[header_size:]
+        if hashlib.sha256(payload).digest() != data[len(MAGIC) : header_size]:
+            raise ValueError("invalid checksum")
+        manifest = pickle.loads(payload)
+        if not isinstance(manifest, GenericWebhookConfigManifest):
+            raise ValueError(f"unexpected type {type(manifest).__name__}")
+        return manifest
+
+    def _prune(self) -> None:
+        """Removes the oldest entries, including the ones compiled by other versions, beyond MAX_ENTRIES"""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(ENTRY_SUFFIX):
+                try:
+                    entries.append((entry.stat().st_mtime_ns, entry.path))
+                except FileNotFoundError:
+                    pass
+        for _, path in sorted(entries, reverse=True)[MAX_ENTRIES:]:
+            self._remove(path)
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,241 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+import types
+from typing import Mapping, NamedTuple
+
+import yaml
+
+from generic_k8s_webhook import inotify
+from generic_k8s_webhook.config_cache import CompiledConfigCache
+from generic_k8s_webhook.config_parser.entrypoint import GenericWebhookConfigManifest
+from generic_k8s_webhook.metrics import MetricsRegistry
+from generic_k8s_webhook.webhook import Webhook
+
+# A file modified less than this number of seconds before it was checked could be modified again without
+# changing its size nor its modification time, if the file system has a coarse clock. So its content is checked
+RACY_INTERVAL = 2
+# Seconds without new events before reloading a watched config file. Updating a ConfigMap generates several events
+DEBOUNCE_DELAY = 0.1
+
+
+class ConfigSnapshot(NamedTuple):
+    """A version of the config. It's never modified: a new config is published as a new snapshot, so a request
+    that gets a snapshot uses the same config until it finishes, even if it's reloaded in the meantime
+    """
+
+    # Incremented by each new config, so the results computed with an old one can be discarded
+    generation: int
+    manifest: GenericWebhookConfigManifest | None
+    # Read-only mapping from each path to the webhooks that listen to it, in the order they must be called
+    routes: Mapping[str, tuple[Webhook, ...]]
+
+
+class ConfigLoader(threading.Thread):  # pylint: disable=too-many-instance-attributes
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        generic_webhook_config_file: str,
+        refresh_period: float,
+        metrics: MetricsRegistry | None = None,
+        watch: bool = False,
+        cache_dir: str | None = None,
+    ) -> None:
+        """A class to reload a webhook configuration in a separate thread
+
+        Args:
+            generic_webhook_config_file (str): The file that contains the
+            configuration of the webhook
+            refresh_period (float): The time it waits to refresh again the
+            configuration
+            metrics (MetricsRegistry | None, optional): Where the metrics about the
+            config reloads are registered. If None, a new registry is created. Defaults to None.
+            watch (bool, optional): Reload the configuration as soon as the file changes, using inotify,
+            instead of checking it every `refresh_period`. If inotify isn't available, the file is checked
+            every `refresh_period` anyway. Defaults to False.
+            cache_dir (str | None, optional): Directory of the on-disk cache of the compiled configs, so a config
+            that has already been parsed, by this server or by another one, is loaded without parsing it again.
+            If None, the configs aren't cached. Defaults to None.
+        """
+        super().__init__()
+        self.generic_webhook_config_file = generic_webhook_config_file
+        self.refresh_period = refresh_period
+        self.watch = watch
+        self._watcher: inotify.FileWatcher | None = None
+        metrics = metrics or MetricsRegistry()
+        self.config_cache = CompiledConfigCache(cache_dir, metrics) if cache_dir else None
+        self.reload_duration = metrics.histogram(
+            "generic_webhook_config_reload_duration_seconds", "Time spent loading the webhook config file"
+        )
+        self.reload_failures = metrics.counter(
+            "generic_webhook_config_reload_failures_total", "Number of times the webhook config file couldn't be loaded"
+        )
+        self.reload_checks = metrics.counter(
+            "generic_webhook_config_reload_checks_total",
+            "Number of times the webhook config file was checked, by result: not modified according to its stat "
+            + "(unchanged), modified but with the same content (same_content) or reloaded",
+            ("result",),
+        )
+        self.webhooks_loaded = metrics.counter(
+            "generic_webhook_config_webhooks_loaded_total",
+            "Number of webhooks loaded from the config file, by whether they were reused from the previous config "
+            + "because they didn't change (reused) or parsed",
+            ("result",),
+        )
+        # Only the thread that loads the config replaces it. The readers get it without any lock, since
+        # replacing a reference is atomic
+        self.snapshot = ConfigSnapshot(0, None, types.MappingProxyType({}))
+        metrics.gauge(
+            "generic_webhook_config_generation",
+            "Generation of the config in use. It's incremented each time a new config is loaded",
+            callback=lambda: self.snapshot.generation,
+        )
+        # The result of the last attempt to load the config. The last valid config is used
+        # while it fails, but the server is not ready (see `is_last_load_ok`)
+        self.last_load_time: float | None = None
+        self.last_load_error: str | None = None
+        # The stat signature and the digest of the content of the file when it was last loaded, so it's
+        # only parsed again when it changes
+        self._file_signature: tuple | None = None
+        self._file_digest: bytes | None = None
+        self._racy_signature = False
+        self._reload_manifest()
+        self.stop_flag = False
+        self.cond = threading.Condition()
+        self.stop_event = threading.Event()
+
+    def _reload_manifest(self) -> None:
+        """Loads the config file again, but only if it has changed since the last time. Parsing a config
+        builds all its operators, which is much more expensive than checking the file
+        """
+        try:
+            signature, mtime = self._get_file_signature()
+            if signature == self._file_signature and not self._racy_signature:
+                self.reload_checks.inc(("unchanged",))
+                self.last_load_time = time.time()
+                return
+            with open(self.generic_webhook_config_file, "rb") as f:
+                raw_manifest = f.read()
+        except Exception as e:
+            self._set_load_error(e)
+            raise
+        digest = hashlib.sha256(raw_manifest).digest()
+        # A ConfigMap that is updated replaces the whole file, even if its content is the same
+        self._file_signature = signature
+        self._racy_signature = time.time() - mtime < RACY_INTERVAL
+        if digest == self._file_digest:
+            self.reload_checks.inc(("same_content",))
+            self.last_load_time = time.time()
+            return
+        # Even if it's not valid, it isn't parsed again until it changes
+        self._file_digest = digest
+        self._load_manifest(raw_manifest)
+        self.reload_checks.inc(("reloaded",))
+
+    def _load_manifest(self, raw_manifest: bytes) -> None:
+        start_time = time.perf_counter()
+        try:
+            manifest = self.config_cache.get(raw_manifest) if self.config_cache else None
+            is_cached = manifest is not None
+            if not is_cached:
+                # Only the webhooks that have changed are parsed again
+                manifest = GenericWebhookConfigManifest(yaml.safe_load(raw_manifest), self.snapshot.manifest)
+            routes = self._build_routes(manifest.list_webhook_config)
+        except Exception as e:
+            self._set_load_error(e)
+            raise
+        self.reload_duration.observe(time.perf_counter() - start_time)
+        if is_cached:
+            logging.info(f"Loaded the config {self.generic_webhook_config_file} from the compiled config cache")
+        else:
+            self.webhooks_loaded.inc(("reused",), amount=manifest.n_reused_webhooks)
+            self.webhooks_loaded.inc(("parsed",), amount=manifest.n_parsed_webhooks)
+            logging.info(
+                f"Loaded the config {self.generic_webhook_config_file}: {manifest.n_parsed_webhooks} webhooks parsed "
+                + f"and {manifest.n_reused_webhooks} reused"
+            )
+        self.last_load_time = time.time()
+        self.last_load_error = None
+        self.snapshot = ConfigSnapshot(self.snapshot.generation + 1, manifest, routes)
+        # It's stored once the new config is in use, so writing it doesn't delay it
+        if self.config_cache and not is_cached:
+            self.config_cache.put(raw_manifest, manifest)
+
+    def _set_load_error(self, e: Exception) -> None:
+        self.reload_failures.inc()
+        self.last_load_time = time.time()
+        self.last_load_error = f"{type(e).__name__}: {e}"
+
+    def _get_file_signature(self) -> tuple[tuple, float]:
+        """Identifies the version of the config file without reading it. A ConfigMap mounted in a pod is a
+        symlink to a file in a directory that is replaced by a new one when the ConfigMap is updated, so the
+        path that the symlink resolves to is part of the signature
+
+        Returns:
+            tuple[tuple, float]: The signature and the modification time of the file
+        """
+        real_path = os.path.realpath(self.generic_webhook_config_file)
+        stat = os.stat(real_path)
+        return (real_path, stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns), stat.st_mtime
+
+    @staticmethod
+    def _build_routes(webhooks: list[Webhook]) -> Mapping[str, tuple[Webhook, ...]]:
+        """Groups the webhooks by the path where they listen to. The webhooks that share a path
+        keep the order they have in the config file, which is the order they must be called
+        """
+        routes: dict[str, list[Webhook]] = {}
+        for webhook in webhooks:
+            routes.setdefault(webhook.path, []).append(webhook)
+        return types.MappingProxyType({path: tuple(list_webhooks) for path, list_webhooks in routes.items()})
+
+    def run(self) -> None:
+        if self.watch:
+            try:
+                self._watcher = inotify.FileWatcher(self.generic_webhook_config_file)
+            except OSError as e:
+                logging.warning(f"Cannot watch the config file, checking it every {self.refresh_period}s instead: {e}")
+        if self._watcher is None:
+            while not self.stop_event.wait(self.refresh_period):
+                self._check_manifest()
+            return
+        try:
+            # The file could have changed before the watcher was created
+            self._check_manifest()
+            while not self.stop_event.is_set() and self._watcher.wait(DEBOUNCE_DELAY):
+                self._check_manifest()
+        finally:
+            self._watcher.close()
+
+    def _check_manifest(self) -> None:
+        try:
+            self._reload_manifest()
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logging.error(e, exc_info=True)
+
+    def get_snapshot(self) -> ConfigSnapshot:
+        """Returns the current config. A request must get it only once, so it's processed using a single config"""
+        return self.snapshot
+
+    @property
+    def generation(self) -> int:
+        return self.snapshot.generation
+
+    def get_webhooks(self) -> list[Webhook]:
+        # The list is never modified once created, only replaced by a new one when the config
+        # is reloaded. That's why it's safe to return it and iterate over it
+        return self.snapshot.manifest.list_webhook_config
+
+    def get_routes(self) -> Mapping[str, tuple[Webhook, ...]]:
+        """Returns a read-only mapping from each path to the webhooks that listen to it.
+        Like the list of webhooks, it's replaced (not modified) when the config is reloaded
+        """
+        return self.snapshot.routes
+
+    def is_last_load_ok(self) -> bool:
+        return self.last_load_error is None
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        if self._watcher:
+            self._watcher.interrupt()
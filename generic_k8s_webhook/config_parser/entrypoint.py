@@ -1,7 +1,9 @@
 import copy
+import hashlib
+from typing import Callable
 
 import generic_k8s_webhook.config_parser.operator_parser as op_parser
-from generic_k8s_webhook import utils
+from generic_k8s_webhook import codec, utils
 from generic_k8s_webhook.config_parser import expr_parser
 from generic_k8s_webhook.config_parser.action_parser import ActionParserV1
 from generic_k8s_webhook.config_parser.jsonpatch_parser import JsonPatchParserV1, JsonPatchParserV2
@@ -13,7 +15,7 @@ class GenericWebhookConfigManifest:
     EXPECTED_APIGROUP = "generic-webhook"
     EXPECTED_KIND = "GenericWebhookConfig"
 
-    def __init__(self, raw_config: dict) -> None:
+    def __init__(self, raw_config: dict, previous: "GenericWebhookConfigManifest | None" = None) -> None:
         """Parses a raw_config (the configuration of the webhook in yaml format) and
         generates objects that the core of the app can manage and understand.
         This object is smart enough to parse differently the raw_config according to
@@ -33,6 +35,9 @@ class GenericWebhookConfigManifest:
         Args:
             raw_config (dict): The configuration of the webhook extracted from the config
             yaml file.
+            previous (GenericWebhookConfigManifest | None, optional): The manifest of a previous version of
+            the same config. Its webhooks whose raw config hasn't changed are reused instead of being parsed
+            again. Defaults to None.
 
         Raises:
             ValueError: if the `raw_config` is invalid
@@ -58,17 +63,59 @@ class GenericWebhookConfigManifest:
         # Select the correct parsing method according to the api version, since different api versions
         # expect different schemas
         if self.apiversion == "v1alpha1":
-            self.list_webhook_config = self._parse_v1alpha1(raw_list_webhook_config)
+            get_webhook_parser = self._get_webhook_parser_v1alpha1
         elif self.apiversion == "v1beta1":
-            self.list_webhook_config = self._parse_v1beta1(raw_list_webhook_config)
+            get_webhook_parser = self._get_webhook_parser_v1beta1
         else:
             raise ValueError(f"The api version {self.apiversion} is not supported")
+        # The fingerprint of the raw config of each webhook, so the next version of the config can reuse them
+        self.webhook_fingerprints: list[bytes | None] = []
+        # How many webhooks were taken from `previous` and how many were parsed
+        self.n_reused_webhooks = 0
+        self.n_parsed_webhooks = 0
+        self.list_webhook_config = self._parse_webhooks(raw_list_webhook_config, get_webhook_parser, previous)
 
         if len(raw_config) > 0:
             raise ValueError(f"Invalid fields at the manifest level: {raw_config}")
 
-    def _parse_v1alpha1(self, raw_list_webhook_config: dict) -> list[Webhook]:
-        webhook_parser = WebhookParserV1(
+    def _parse_webhooks(
+        self,
+        raw_list_webhook_config: list,
+        get_webhook_parser: Callable[[], WebhookParserV1],
+        previous: "GenericWebhookConfigManifest | None",
+    ) -> list[Webhook]:
+        reusable_webhooks = {}
+        if previous is not None and previous.apiversion == self.apiversion:
+            reusable_webhooks = dict(zip(previous.webhook_fingerprints, previous.list_webhook_config))
+            reusable_webhooks.pop(None, None)
+        # Building a parser is expensive (the one of the expressions compiles a grammar), so it's only
+        # done when there's something to parse
+        webhook_parser = None
+        list_webhook_config = []
+        for i, raw_webhook_config in enumerate(raw_list_webhook_config):
+            fingerprint = self._get_fingerprint(raw_webhook_config)
+            webhook = reusable_webhooks.get(fingerprint)
+            if webhook is None:
+                webhook_parser = webhook_parser or get_webhook_parser()
+                webhook = webhook_parser.parse(raw_webhook_config, f"webhooks.{i}")
+                self.n_parsed_webhooks += 1
+            else:
+                self.n_reused_webhooks += 1
+            list_webhook_config.append(webhook)
+            self.webhook_fingerprints.append(fingerprint)
+        return list_webhook_config
+
+    @staticmethod
+    def _get_fingerprint(raw_webhook_config: dict) -> bytes | None:
+        """A digest of the raw config of a webhook. None if it can't be computed, so the webhook is never reused"""
+        try:
+            return hashlib.sha256(codec.dumps(raw_webhook_config, sort_keys=True)).digest()
+        except TypeError:
+            # The yaml contains a type that isn't valid in json, like a date
+            return None
+
+    def _get_webhook_parser_v1alpha1(self) -> WebhookParserV1:
+        return WebhookParserV1(
             action_parser=ActionParserV1(
                 meta_op_parser=op_parser.MetaOperatorParser(
                     list_op_parser_classes=[
@@ -88,13 +135,8 @@ class GenericWebhookConfigManifest:
                 json_patch_parser=JsonPatchParserV1(),
             )
         )
-        list_webhook_config = [
-            webhook_parser.parse(raw_webhook_config, f"webhooks.{i}")
-            for i, raw_webhook_config in enumerate(raw_list_webhook_config)
-        ]
-        return list_webhook_config
 
-    def _parse_v1beta1(self, raw_list_webhook_config: dict) -> list[Webhook]:
+    def _get_webhook_parser_v1beta1(self) -> WebhookParserV1:
         meta_op_parser = op_parser.MetaOperatorParser(
             list_op_parser_classes=[
                 op_parser.AndParser,
@@ -115,14 +157,9 @@ class GenericWebhookConfigManifest:
             ],
             raw_str_parser=expr_parser.RawStringParserV1(),
         )
-        webhook_parser = WebhookParserV1(
+        return WebhookParserV1(
             action_parser=ActionParserV1(
                 meta_op_parser=meta_op_parser,
                 json_patch_parser=JsonPatchParserV2(meta_op_parser),
             )
         )
-        list_webhook_config = [
-            webhook_parser.parse(raw_webhook_config, f"webhooks.{i}")
-            for i, raw_webhook_config in enumerate(raw_list_webhook_config)
-        ]
-        return list_webhook_config
@@ -26,6 +26,7 @@ class WebhookParserV1(IWebhookParser):
     ```yaml
     name: <name>
     path: /<path>
+    timeoutSeconds: <seconds> # Optional
     actions:
         - <action>
         - <action>
@@ -36,6 +37,9 @@ class WebhookParserV1(IWebhookParser):
     def parse(self, raw_config: dict, path_wh: str) -> Webhook:
         name = utils.must_pop(raw_config, "name", f"The webhook {path_wh} must have a name")
         path = utils.must_pop(raw_config, "path", f"The webhook {path_wh} must have a path")
+        timeout = raw_config.pop("timeoutSeconds", None)
+        if timeout is not None and not (isinstance(timeout, (int, float)) and timeout > 0):
+            raise ValueError(f"The timeoutSeconds of the webhook {path_wh} must be a positive number")
 
         raw_list_action_configs = utils.must_pop(
             raw_config, "actions", f"The webhook {name} must have a actions defined"
@@ -48,4 +52,4 @@ class WebhookParserV1(IWebhookParser):
         if len(raw_config) > 0:
             raise ValueError(f"Invalid fields in webhook {path_wh}: {raw_config}")
 
-        return Webhook(name, path, list_actions)
+        return Webhook(name, path, list_actions, timeout)
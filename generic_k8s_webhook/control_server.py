@@ -0,0 +1,136 @@
+import http.server
+import json
+import logging
+import sys
+import threading
+import time
+import traceback
+from typing import Callable
+from urllib.parse import urlparse
+
+from generic_k8s_webhook.config_loader import ConfigLoader
+from generic_k8s_webhook.metrics import MetricsRegistry
+
+TEXT_CONTENT_TYPE = "text/plain; charset=utf-8"
+
+
+class ControlHandler(http.server.BaseHTTPRequestHandler):
+    CONTROL_SERVER: "ControlServer | None" = None
+
+    def do_GET(self):
+        try:
+            status, content_type, body = self.CONTROL_SERVER.process_get(urlparse(self.path).path)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logging.error(e, exc_info=True)
+            status, content_type, body = 500, TEXT_CONTENT_TYPE, b""
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        # The probes are done every few seconds, so they are only logged when debugging
+        logging.debug(f"{self.address_string()} - {format % args}")
+
+
+class ControlServer(threading.Thread):
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        port: int,
+        config_loader: ConfigLoader,
+        metrics: MetricsRegistry,
+        get_not_ready_reasons: Callable[[], list[str]],
+        reuse_port: bool = False,
+    ) -> None:
+        """An http server, independent of the one that receives the admission requests, for the
+        liveness and readiness probes and for diagnostics. It has its own listener and threads, so it
+        keeps answering when the admission requests are backed up.
+
+        Args:
+            port (int): Port where the server listens to
+            config_loader (ConfigLoader): The object that provides the current webhook configuration
+            metrics (MetricsRegistry): The metrics exposed at the /metrics path
+            get_not_ready_reasons (Callable[[], list[str]]): Returns why the server is not ready
+            to receive admission requests. An empty list means the server is ready
+            reuse_port (bool, optional): Sets SO_REUSEPORT, so several processes can listen
+            to the same port. Defaults to False.
+        """
+        super().__init__(name="control-server", daemon=True)
+        self.config_loader = config_loader
+        self.metrics = metrics
+        self.get_not_ready_reasons = get_not_ready_reasons
+        self.endpoints: dict[str, Callable[[], tuple[int, str, bytes]]] = {
+            "/livez": self._livez,
+            "/healthz": self._livez,
+            "/readyz": self._readyz,
+            "/metrics": self._metrics,
+            "/debug/config": self._debug_config,
+            "/debug/threads": self._debug_threads,
+        }
+
+        class Handler(ControlHandler):
+            CONTROL_SERVER = self
+
+        class ControlHTTPServer(http.server.ThreadingHTTPServer):
+            allow_reuse_port = reuse_port
+            # A probe stuck in a slow connection doesn't prevent the process from finishing
+            daemon_threads = True
+
+        self.httpd = ControlHTTPServer(("0.0.0.0", port), Handler)
+
+    def process_get(self, path: str) -> tuple[int, str, bytes]:
+        """Generates the response for a GET request
+
+        Returns:
+            tuple[int, str, bytes]: The status code, the content type and the body of the response
+        """
+        endpoint = self.endpoints.get(path)
+        if endpoint is None:
+            return 404, TEXT_CONTENT_TYPE, b""
+        return endpoint()
+
+    def _livez(self) -> tuple[int, str, bytes]:
+        return 200, TEXT_CONTENT_TYPE, "I'm alive\n".encode("utf-8")
+
+    def _readyz(self) -> tuple[int, str, bytes]:
+        reasons = self.get_not_ready_reasons()
+        if reasons:
+            return 503, TEXT_CONTENT_TYPE, "".join(f"{reason}\n" for reason in reasons).encode("utf-8")
+        return 200, TEXT_CONTENT_TYPE, "ready\n".encode("utf-8")
+
+    def _metrics(self) -> tuple[int, str, bytes]:
+        return 200, MetricsRegistry.CONTENT_TYPE, self.metrics.render().encode("utf-8")
+
+    def _debug_config(self) -> tuple[int, str, bytes]:
+        """Shows the result of the last attempt to load the config and the webhooks of each path"""
+        # The generation and the routes must come from the same config
+        snapshot = self.config_loader.get_snapshot()
+        last_load_time = self.config_loader.last_load_time
+        if last_load_time is not None:
+            last_load_time = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(last_load_time))
+        config_status = {
+            "file": str(self.config_loader.generic_webhook_config_file),
+            "lastLoadTime": last_load_time,
+            "lastLoadError": self.config_loader.last_load_error,
+            "generation": snapshot.generation,
+            "routes": {path: [webhook.name for webhook in webhooks] for path, webhooks in snapshot.routes.items()},
+        }
+        return 200, "application/json", json.dumps(config_status, indent=2).encode("utf-8")
+
+    def _debug_threads(self) -> tuple[int, str, bytes]:
+        """Shows the current stack trace of all the threads, to find out what's blocking the server"""
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        lines = []
+        for thread_id, frame in sys._current_frames().items():  # pylint: disable=protected-access
+            lines.append(f"Thread {thread_names.get(thread_id, thread_id)}:\n")
+            lines += traceback.format_stack(frame)
+            lines.append("\n")
+        return 200, TEXT_CONTENT_TYPE, "".join(lines).encode("utf-8")
+
+    def run(self) -> None:
+        self.httpd.serve_forever()
+        self.httpd.server_close()
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
@@ -0,0 +1,68 @@
+import contextlib
+import contextvars
+import re
+import time
+from typing import Iterator
+
+# The monotonic time at which the evaluation of the current request must stop. None if there's no deadline.
+# It's a context variable, so each thread (or asyncio task) evaluating a request has its own deadline
+_deadline: contextvars.ContextVar[float | None] = contextvars.ContextVar("deadline", default=None)
+
+# Format used by the K8S apiserver (a Go duration) in the `timeout` parameter of the url. For example, "10s" or "1m0s"
+_DURATION_REGEX = re.compile(r"(\d+(?:\.\d*)?)(ms|us|µs|ns|h|m|s)")
+_DURATION_UNITS = {"h": 3600, "m": 60, "s": 1, "ms": 1e-3, "us": 1e-6, "µs": 1e-6, "ns": 1e-9}
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+@contextlib.contextmanager
+def deadline(timeout: float | None) -> Iterator[None]:
+    """Sets a deadline for the code executed inside this context. If there's already a deadline,
+    the earliest one is kept, so an inner context can only reduce the time left.
+
+    Args:
+        timeout (float | None): Number of seconds, from now, until the deadline. If None, the current
+        deadline (if any) is not modified.
+    """
+    if timeout is None:
+        yield
+        return
+    new_deadline = time.monotonic() + timeout
+    current_deadline = _deadline.get()
+    if current_deadline is not None:
+        new_deadline = min(new_deadline, current_deadline)
+    token = _deadline.set(new_deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def check_deadline() -> None:
+    """Raises DeadlineExceeded if the deadline of the current context has passed. It's called
+    from the loops that evaluate a webhook, so a request nobody is waiting for stops as soon as possible.
+    """
+    current_deadline = _deadline.get()
+    if current_deadline is not None and time.monotonic() > current_deadline:
+        raise DeadlineExceeded()
+
+
+def get_time_left() -> float | None:
+    """Returns the number of seconds until the deadline of the current context, or None if there's no deadline"""
+    current_deadline = _deadline.get()
+    if current_deadline is None:
+        return None
+    return max(current_deadline - time.monotonic(), 0.0)
+
+
+def parse_duration(duration: str) -> float:
+    """Converts a Go duration, like "10s" or "1m30s", to a number of seconds
+
+    Raises:
+        ValueError: if `duration` is not a valid duration
+    """
+    if not duration or _DURATION_REGEX.sub("", duration) != "":
+        raise ValueError(f"Invalid duration {duration!r}")
+    return sum(float(value) * _DURATION_UNITS[unit] for value, unit in _DURATION_REGEX.findall(duration))
@@ -0,0 +1,172 @@
+import collections
+import hashlib
+import threading
+import time
+from typing import Any, Iterable
+
+from generic_k8s_webhook import codec
+from generic_k8s_webhook.metrics import MetricsRegistry
+from generic_k8s_webhook.path_analysis import PathTrie, get_referenced_paths
+from generic_k8s_webhook.utils import convert_dot_string_path_to_list
+from generic_k8s_webhook.webhook import Webhook
+
+# The fields of an object that change with every write, even if nothing else does
+DEFAULT_IGNORED_FIELDS = ("metadata.resourceVersion", "metadata.managedFields")
+
+# The outcome of an admission request: whether it's allowed, the encoded JSON patch (empty if there's none)
+# and the names of the webhooks evaluated
+Decision = tuple[bool, bytes, list[str]]
+# The generation of the config, the path of the url and the digest of the object
+CacheKey = tuple[int, str, bytes]
+
+
+class DecisionCache:  # pylint: disable=too-many-instance-attributes
+    def __init__(
+        self,
+        max_entries: int,
+        ttl: float,
+        ignored_fields: Iterable[str] = DEFAULT_IGNORED_FIELDS,
+        metrics: MetricsRegistry | None = None,
+    ) -> None:
+        """A bounded LRU cache of the decisions of the admission requests, so an object that is sent again
+        (for example, by a controller that retries or reapplies it) isn't evaluated again.
+
+        The decision only depends on the webhooks and on the object under review, so the entries are
+        indexed by the keys of DecisionKeys, and two objects that only differ in fields that the webhooks
+        don't read share the same entry. All the entries are discarded when a new config is loaded.
+
+        Args:
+            max_entries (int): Max number of decisions kept. The least recently used ones are evicted first
+            ttl (float): Time, in seconds, that a decision is kept
+            ignored_fields (Iterable[str], optional): Fields of the object, in dot notation, that are left
+            out of the digest when the webhooks can't be analysed. They must not change the decision.
+            Defaults to DEFAULT_IGNORED_FIELDS.
+            metrics (MetricsRegistry | None, optional): Where the hits, misses and evictions are registered.
+            If None, a new registry is created. Defaults to None.
+        """
+        if max_entries < 1:
+            raise ValueError(f"The decision cache must have at least 1 entry, but got {max_entries}")
+        if ttl <= 0:
+            raise ValueError(f"The TTL of the decision cache must be positive, but got {ttl}")
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.keys = DecisionKeys(ignored_fields)
+        # key -> (expiration time, decision), from the least to the most recently used
+        self._entries: collections.OrderedDict[CacheKey, tuple[float, Decision]] = collections.OrderedDict()
+        # The generation of the config of the current entries
+        self._generation = 0
+        self._lock = threading.Lock()
+        metrics = metrics or MetricsRegistry()
+        self.lookups = metrics.counter(
+            "generic_webhook_decision_cache_lookups_total",
+            "Number of admission requests looked up in the decision cache",
+            ("result",),
+        )
+        self.evictions = metrics.counter(
+            "generic_webhook_decision_cache_evictions_total",
+            "Number of decisions removed from the cache",
+            ("reason",),
+        )
+        metrics.gauge(
+            "generic_webhook_decision_cache_entries",
+            "Number of decisions in the cache",
+            callback=lambda: len(self._entries),
+        )
+
+    def get_key(self, generation: int, path: str, webhooks: Iterable[Webhook], obj: Any) -> CacheKey:
+        """Returns the key of the decision for `obj`, evaluated by `webhooks` (the ones of `path`)
+        with the config `generation`
+        """
+        with self._lock:
+            self._check_generation(generation)
+        return self.keys.get_key(generation, path, webhooks, obj)
+
+    def get(self, key: CacheKey) -> Decision | None:
+        with self._lock:
+            self._check_generation(key[0])
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                del self._entries[key]
+                self.evictions.inc(("expired",))
+                entry = None
+            if entry is None:
+                self.lookups.inc(("miss",))
+                return None
+            self._entries.move_to_end(key)
+            self.lookups.inc(("hit",))
+            return entry[1]
+
+    def put(self, key: CacheKey, decision: Decision) -> None:
+        with self._lock:
+            self._check_generation(key[0])
+            # The decision was computed with a config that has already been replaced
+            if key[0] != self._generation:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, decision)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions.inc(("capacity",))
+
+    def _check_generation(self, generation: int) -> None:
+        """Discards everything computed with an older config. Must be called while holding the lock"""
+        if generation <= self._generation:
+            return
+        if self._entries:
+            self.evictions.inc(("config_reload",), amount=len(self._entries))
+            self._entries.clear()
+        self._generation = generation
+
+
+class DecisionKeys:
+    def __init__(self, ignored_fields: Iterable[str] = DEFAULT_IGNORED_FIELDS) -> None:
+        """Computes the keys that identify the decision of an admission request, so the requests that get
+        the same decision can share it. The key is the path of the url, the generation of the config and
+        a digest of the object. When the webhooks only reference some paths of the object, the digest only
+        covers these paths. Otherwise, it covers the whole object except `ignored_fields`.
+
+        Args:
+            ignored_fields (Iterable[str], optional): Fields of the object, in dot notation, that are left
+            out of the digest when the webhooks can't be analysed. They must not change the decision.
+            Defaults to DEFAULT_IGNORED_FIELDS.
+        """
+        self.ignored_fields = [convert_dot_string_path_to_list(field) for field in ignored_fields]
+        # The generation of the config and the paths referenced by the webhooks of each path of the url,
+        # or None if they can't be analysed
+        self._generation = 0
+        self._referenced_paths: dict[str, PathTrie | None] = {}
+        self._lock = threading.Lock()
+
+    def get_key(self, generation: int, path: str, webhooks: Iterable[Webhook], obj: Any) -> CacheKey:
+        """Returns the key of the decision for `obj`, evaluated by `webhooks` (the ones of `path`)
+        with the config `generation`
+        """
+        with self._lock:
+            if generation > self._generation:
+                self._referenced_paths = {}
+                self._generation = generation
+            if path not in self._referenced_paths:
+                self._referenced_paths[path] = get_referenced_paths(webhooks)
+            referenced_paths = self._referenced_paths[path]
+        if referenced_paths is not None:
+            obj = referenced_paths.project(obj)
+        else:
+            obj = self._remove_ignored_fields(obj)
+        return generation, path, hashlib.blake2b(codec.dumps(obj, sort_keys=True), digest_size=16).digest()
+
+    def _remove_ignored_fields(self, obj: Any) -> Any:
+        """Returns `obj` without the ignored fields. Only the dicts that contain them are copied"""
+        for field in self.ignored_fields:
+            obj = _remove_field(obj, field)
+        return obj
+
+
+def _remove_field(obj: Any, field: list[str]) -> Any:
+    if not isinstance(obj, dict) or field[0] not in obj:
+        return obj
+    copy = dict(obj)
+    if len(field) == 1:
+        del copy[field[0]]
+    else:
+        copy[field[0]] = _remove_field(obj[field[0]], field[1:])
+    return copy
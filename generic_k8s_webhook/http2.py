@@ -0,0 +1,265 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import TYPE_CHECKING
+
+from generic_k8s_webhook.admission import HttpResponse
+
+try:
+    import h2.config
+    import h2.connection
+    import h2.errors
+    import h2.events
+    import h2.exceptions
+    import h2.settings
+except ImportError:
+    h2 = None
+
+if TYPE_CHECKING:
+    from generic_k8s_webhook.async_server import AsyncioHTTPServer
+
+# The protocol negotiated with ALPN when the client and the server support HTTP/2
+ALPN_PROTOCOL = "h2"
+# The clients that use HTTP/2 without TLS start the connection with this preface. Its first part looks
+# like an HTTP/1.1 request with the PRI method and no headers
+PREFACE_HEAD = b"PRI * HTTP/2.0\r\n\r\n"
+# Size, in bytes, of the flow control windows of each stream and of the whole connection. The bodies of the
+# admission requests are usually bigger than the default ones (64KiB), so bigger windows save round trips
+INITIAL_WINDOW_SIZE = 1 << 20
+CONNECTION_WINDOW_SIZE = 16 << 20
+
+
+def is_available() -> bool:
+    """HTTP/2 is only supported when the optional `h2` package is installed"""
+    return h2 is not None
+
+
+class Http2Stream:
+    def __init__(self, headers: dict[str, str]) -> None:
+        """An HTTP/2 request, whose body is received in several data frames"""
+        self.headers = headers
+        self.body = bytearray()
+        self.task: asyncio.Task | None = None
+
+
+class Http2Connection:  # pylint: disable=too-many-instance-attributes
+    def __init__(
+        self,
+        server: AsyncioHTTPServer,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        client: tuple,
+    ) -> None:
+        """Serves an HTTP/2 connection, where the client sends several requests at the same time,
+        each one in its own stream. The requests are read in the event loop and each one is evaluated
+        by the server in its own task, so a slow request doesn't block the rest of the connection.
+
+        Args:
+            server (AsyncioHTTPServer): The server that accepted the connection and generates the responses
+            reader (asyncio.StreamReader): Where the frames are read from
+            writer (asyncio.StreamWriter): Where the frames are written to
+            client (tuple): The address of the client
+        """
+        if h2 is None:
+            raise RuntimeError("HTTP/2 needs the h2 package")
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        self.client = client
+        self.conn = h2.connection.H2Connection(h2.config.H2Configuration(client_side=False, header_encoding="utf-8"))
+        self.streams: dict[int, Http2Stream] = {}
+        self.n_requests = 0
+        self.closed = False
+        # Set, and replaced by a new one, every time the client gives us more room to send data
+        self._window_updated = asyncio.Event()
+
+    async def serve(self, initial_data: bytes = b"") -> None:
+        """Processes the frames of the connection until it's closed
+
+        Args:
+            initial_data (bytes, optional): Data already read from the connection, like the start
+            of the preface. Defaults to b"".
+        """
+        self.conn.local_settings = self._get_local_settings(self.server.max_concurrent_streams)
+        self.conn.initiate_connection()
+        # h2 treats a stream over the limit as an error of the whole connection, which would also cancel
+        # the streams in flight. So the limit is only advertised to the client and enforced by us instead
+        self.conn.local_settings = self._get_local_settings()
+        # The window of the connection can't be set in the settings, so it's opened with a window update
+        self.conn.increment_flow_control_window(CONNECTION_WINDOW_SIZE - self.conn.inbound_flow_control_window)
+        await self._flush()
+        data = initial_data
+        try:
+            while True:
+                if data:
+                    try:
+                        events = self.conn.receive_data(data)
+                    except h2.exceptions.ProtocolError as e:
+                        # h2 has already queued the GOAWAY frame that explains the error
+                        logging.error(f"HTTP/2 protocol error from {self.client}: {e}")
+                        await self._flush()
+                        return
+                    for event in events:
+                        self._handle_event(event)
+                    await self._flush()
+                if not self.streams and self._must_close():
+                    await self._close()
+                    return
+                data = await self._read()
+                if not data:
+                    return
+        finally:
+            # The client has closed the connection, so the requests still in flight can't be answered
+            for stream in self.streams.values():
+                if stream.task:
+                    stream.task.cancel()
+                self._release_stream(stream)
+            self.streams.clear()
+
+    async def _close(self) -> None:
+        """Tells the client that it must open a new connection for its next requests and closes this one"""
+        if self.closed:
+            return
+        self.closed = True
+        self.conn.close_connection()
+        await self._flush()
+        self.writer.close()
+
+    async def _read(self) -> bytes:
+        """Reads the next frames. The connection is idle while there are no streams in flight, so
+        it can be closed when the keep alive timeout expires or the server stops
+        """
+        if self.streams:
+            return await self.reader.read(65536)
+        self.server.idle_writers.add(self.writer)
+        try:
+            return await asyncio.wait_for(self.reader.read(65536), self.server.keep_alive_timeout)
+        except TimeoutError:
+            return b""
+        finally:
+            self.server.idle_writers.discard(self.writer)
+
+    def _must_close(self) -> bool:
+        return self.server.closing or self.n_requests >= self.server.max_requests_per_connection
+
+    def _handle_event(self, event: h2.events.Event) -> None:
+        if isinstance(event, h2.events.RequestReceived):
+            self._handle_request_received(event)
+        elif isinstance(event, h2.events.DataReceived):
+            self._handle_data_received(event)
+        elif isinstance(event, h2.events.StreamEnded):
+            stream = self.streams.get(event.stream_id)
+            if stream:
+                stream.task = asyncio.create_task(self._process_stream(event.stream_id, stream))
+        elif isinstance(event, h2.events.StreamReset):
+            stream = self.streams.pop(event.stream_id, None)
+            if stream:
+                self._release_stream(stream)
+            self._notify_window_update()
+        elif isinstance(event, (h2.events.WindowUpdated, h2.events.RemoteSettingsChanged)):
+            self._notify_window_update()
+
+    def _handle_request_received(self, event: h2.events.RequestReceived) -> None:
+        if len(self.streams) >= self.server.max_concurrent_streams:
+            # Only this stream is refused. The client knows it hasn't been processed, so it can retry it
+            self.conn.reset_stream(event.stream_id, h2.errors.ErrorCodes.REFUSED_STREAM)
+            return
+        headers = dict(event.headers)
+        self.n_requests += 1
+        stream = Http2Stream(headers)
+        self.streams[event.stream_id] = stream
+        if headers.get(":method") == "POST" and "content-length" in headers:
+            # Rejected before receiving its body. Unlike HTTP/1.1, the Content-Length is optional
+            error_response = self.server.processor.check_body_length(headers["content-length"])
+            if error_response:
+                self._reject_stream(event.stream_id, error_response)
+
+    def _handle_data_received(self, event: h2.events.DataReceived) -> None:
+        # The data is acknowledged right away, since the size of the body is already limited.
+        # This gives the client more room to send the rest of it
+        self.conn.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+        stream = self.streams.get(event.stream_id)
+        if stream is None:
+            return
+        stream.body += event.data
+        self.server.processor.body_buffer_bytes.inc(amount=len(event.data))
+        error_response = self.server.processor.check_body_length(str(len(stream.body)))
+        if error_response:
+            self._reject_stream(event.stream_id, error_response)
+
+    def _reject_stream(self, stream_id: int, response: HttpResponse) -> None:
+        """Answers the request without waiting for the rest of its body, which the client stops sending"""
+        self._release_stream(self.streams.pop(stream_id))
+        self.conn.send_headers(stream_id, self._get_response_headers(response), end_stream=True)
+        try:
+            # Asks the client to stop sending the body. This isn't an error, since it already has the response
+            self.conn.reset_stream(stream_id, h2.errors.ErrorCodes.NO_ERROR)
+        except h2.exceptions.StreamClosedError:
+            # The client had already sent the whole body, so the stream was closed by the response
+            pass
+
+    def _release_stream(self, stream: Http2Stream) -> None:
+        self.server.processor.body_buffer_bytes.dec(amount=len(stream.body))
+        stream.body = bytearray()
+
+    async def _process_stream(self, stream_id: int, stream: Http2Stream) -> None:
+        try:
+            response = await self.server.dispatch(
+                stream.headers.get(":method", ""), stream.headers.get(":path", "/"), stream.body, self.client
+            )
+            self.conn.send_headers(stream_id, self._get_response_headers(response), end_stream=not response.body)
+            await self._flush()
+            if response.body:
+                await self._send_body(stream_id, response.body)
+        except h2.exceptions.StreamClosedError:
+            # The client reset the stream before receiving the whole response
+            pass
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logging.error(e, exc_info=True)
+        finally:
+            if self.streams.get(stream_id) is stream:
+                del self.streams[stream_id]
+                self._release_stream(stream)
+        if not self.streams and self._must_close():
+            # The loop that reads the frames is waiting for the next ones, so the connection is closed here
+            await self._close()
+
+    async def _send_body(self, stream_id: int, body: bytes) -> None:
+        """Sends the body in data frames, waiting for the client to open the flow control window when needed"""
+        while body:
+            window = self.conn.local_flow_control_window(stream_id)
+            if window <= 0:
+                await self._window_updated.wait()
+                continue
+            chunk_size = min(window, len(body), self.conn.max_outbound_frame_size)
+            self.conn.send_data(stream_id, body[:chunk_size], end_stream=chunk_size == len(body))
+            body = body[chunk_size:]
+            await self._flush()
+
+    def _notify_window_update(self) -> None:
+        self._window_updated.set()
+        self._window_updated = asyncio.Event()
+
+    @staticmethod
+    def _get_local_settings(max_concurrent_streams: int | None = None) -> h2.settings.Settings:
+        initial_values = {
+            h2.settings.SettingCodes.INITIAL_WINDOW_SIZE: INITIAL_WINDOW_SIZE,
+            h2.settings.SettingCodes.MAX_HEADER_LIST_SIZE: h2.connection.H2Connection.DEFAULT_MAX_HEADER_LIST_SIZE,
+        }
+        if max_concurrent_streams is not None:
+            initial_values[h2.settings.SettingCodes.MAX_CONCURRENT_STREAMS] = max_concurrent_streams
+        return h2.settings.Settings(client=False, initial_values=initial_values)
+
+    @staticmethod
+    def _get_response_headers(response: HttpResponse) -> list[tuple[str, str]]:
+        headers = [(":status", str(response.status)), ("content-length", str(len(response.body)))]
+        # The names of the headers must be lowercase in HTTP/2
+        headers += [(name.lower(), value) for name, value in response.headers.items()]
+        return headers
+
+    async def _flush(self) -> None:
+        data = self.conn.data_to_send()
+        if data:
+            self.writer.write(data)
+            await self.writer.drain()
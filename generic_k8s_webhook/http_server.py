@@ -1,144 +1,350 @@
-import base64
 import http.server
-import json
 import logging
+import queue
+import select
+import socket
 import ssl
 import threading
+import time
 from urllib.parse import urlparse
 
-import jsonpatch
-import yaml
-
-from generic_k8s_webhook.config_parser.entrypoint import GenericWebhookConfigManifest
-from generic_k8s_webhook.webhook import Webhook
-
-
-class ConfigLoader(threading.Thread):
-    def __init__(self, generic_webhook_config_file: str, refresh_period: float) -> None:
-        """A class to reload a webhook configuration in a separate thread
-
-        Args:
-            generic_webhook_config_file (str): The file that contains the
-            configuration of the webhook
-            refresh_period (float): The time it waits to refresh again the
-            configuration
-        """
-        super().__init__()
-        self.generic_webhook_config_file = generic_webhook_config_file
-        self.refresh_period = refresh_period
-        self.manifest: GenericWebhookConfigManifest | None = None
-        self.lock = threading.Lock()
-        self._reload_manifest()
-        self.stop_flag = False
-        self.cond = threading.Condition()
-        self.stop_event = threading.Event()
-
-    def _reload_manifest(self) -> None:
-        with open(self.generic_webhook_config_file, "r", encoding="utf-8") as f:
-            raw_manifest = yaml.safe_load(f)
-        with self.lock:
-            self.manifest = GenericWebhookConfigManifest(raw_manifest)
-
-    def run(self) -> None:
-        while not self.stop_event.wait(self.refresh_period):
-            try:
-                self._reload_manifest()
-            except Exception as e:  # pylint: disable=broad-exception-caught
-                logging.error(e, exc_info=True)
-
-    def get_webhooks(self) -> list[Webhook]:
-        with self.lock:
-            return self.manifest.list_webhook_config
-
-    def stop(self) -> None:
-        self.stop_event.set()
+from generic_k8s_webhook.admission import AdmissionProcessor, HttpResponse
+from generic_k8s_webhook.async_server import AsyncioHTTPServer
+from generic_k8s_webhook.coalescing import RequestCoalescer
+from generic_k8s_webhook.config_loader import ConfigLoader
+from generic_k8s_webhook.control_server import ControlServer
+from generic_k8s_webhook.decision_cache import DEFAULT_IGNORED_FIELDS, DecisionCache, DecisionKeys
+from generic_k8s_webhook.http2 import ALPN_PROTOCOL
+from generic_k8s_webhook.limiter import AdaptiveConcurrencyLimiter
+from generic_k8s_webhook.logs import AccessLogger
+from generic_k8s_webhook.metrics import MetricsRegistry
+from generic_k8s_webhook.tls import TlsContextReloader
+from generic_k8s_webhook.unix_socket import bind_unix_socket, get_client_address, remove_unix_socket
 
 
 class BaseHandler(http.server.BaseHTTPRequestHandler):
-    CONFIG_LOADER: ConfigLoader | None = None
-    HEALTHZ = "/healthz"
+    PROCESSOR: AdmissionProcessor | None = None
+    # Persistent connections, so the clients don't need a new TCP connection and TLS handshake per request
+    protocol_version = "HTTP/1.1"
+    # Max time, in seconds, that a client can take to send a request once the connection is established
+    timeout = 30
+    # Max time, in seconds, that a connection can stay idle waiting for the next request
+    KEEP_ALIVE_TIMEOUT: float = 15
+    # After this number of requests, the server closes the connection
+    MAX_REQUESTS_PER_CONNECTION = 1000
+    # How often an idle connection checks if it must give its thread to another connection
+    IDLE_POLL_INTERVAL = 0.05
+    # Min time, in seconds, that a connection stays open after answering a request, even if other connections
+    # are waiting for its thread. The client may have already sent its next request through it, and closing
+    # the connection at the same time makes that request fail, since a POST isn't retried
+    IDLE_GRACE_PERIOD: float = 1
+    # The bodies up to this size, in bytes, are read into a buffer of the worker thread, which is reused
+    # by its next requests. The bigger ones get a buffer of their own, released after answering the request
+    BODY_BUFFER_SIZE = 1 << 20
+    _local = threading.local()
+    # The headers and the body are written with a single call, and sent without delay
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def setup(self) -> None:
+        super().setup()
+        self.requests_handled = 0
+
+    def handle(self) -> None:
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection and self._wait_for_next_request():
+            self.handle_one_request()
+
+    def _wait_for_next_request(self) -> bool:
+        """Waits until the client sends a new request through the current connection.
+        A connection that is waiting keeps its thread busy, so it gives up (and the connection is closed)
+        when there are other connections waiting for a free thread, once it has been idle for IDLE_GRACE_PERIOD.
+
+        Returns:
+            bool: True if there's a new request to read. False if the connection must be closed.
+        """
+        idle_since = time.monotonic()
+        deadline = idle_since + self.KEEP_ALIVE_TIMEOUT
+        while not self._has_buffered_data():
+            if self.server.closing:
+                return False
+            if time.monotonic() - idle_since >= self.IDLE_GRACE_PERIOD and not self.server.is_idle_connection_allowed():
+                return False
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            readable, _, _ = select.select([self.connection], [], [], min(remaining, self.IDLE_POLL_INTERVAL))
+            if readable:
+                return True
+        return True
+
+    def _has_buffered_data(self) -> bool:
+        """True if the next request has already been read from the socket, but not consumed yet"""
+        if isinstance(self.connection, ssl.SSLSocket) and self.connection.pending() > 0:
+            return True
+        # The peek doesn't block if there's buffered data. Otherwise, it tries to read from the socket
+        # and, since it's non-blocking, it returns immediately if there's nothing to read
+        self.connection.setblocking(False)
+        try:
+            return len(self.rfile.peek(1)) > 0
+        except (ssl.SSLWantReadError, BlockingIOError):
+            return False
+        finally:
+            self.connection.settimeout(self.timeout)
 
     def do_GET(self):
         try:
-            self._do_get()
+            self._send_response(self.PROCESSOR.process_get(urlparse(self.path).path))
         except Exception as e:  # pylint: disable=broad-exception-caught
+            self.close_connection = True  # pylint: disable=attribute-defined-outside-init
             logging.error(e, exc_info=True)
 
-    def _do_get(self):
-        if self._get_path() == self.HEALTHZ:
-            self._healthz()
-        else:
-            self.send_response(400)
-            self.end_headers()
-
     def do_POST(self):
         try:
             self._do_post()
         except Exception as e:  # pylint: disable=broad-exception-caught
+            self.close_connection = True  # pylint: disable=attribute-defined-outside-init
             logging.error(e, exc_info=True)
 
     def _do_post(self):
-        logging.info(f"Processing request from {self.address_string()}")
-        webhook_paths = [webhook.path for webhook in self.CONFIG_LOADER.get_webhooks()]
-
-        # The path in the url is not defined in this server
-        if self._get_path() not in webhook_paths:
-            self.send_response(400)
-            self.end_headers()
-            logging.error(f"Wrong path {self.path} Not defined")
+        error_response = self.PROCESSOR.check_body_length(
+            self.headers.get("Content-Length"), "Transfer-Encoding" in self.headers
+        )
+        if error_response:
+            # The body hasn't been read, so the connection can't be used for the next request
+            self.close_connection = True  # pylint: disable=attribute-defined-outside-init
+            self._send_response(error_response)
             return
-
-        request = self._get_body_request()
-        uid = request["uid"]
-        # Calling in order all the webhooks that have the target path. They all must set accept=True to
-        # accept the request. The patches are concatenated and applied for the next call to "process_manifest"
-        final_patch = jsonpatch.JsonPatch([])
-        for webhook in self.CONFIG_LOADER.get_webhooks():
-            if self._get_path() == webhook.path:
-                # The call to the current webhook needs a json object that has been updated by the previous patches
-                patched_object = final_patch.apply(request["object"])
-                accept, patch = webhook.process_manifest(patched_object)
-                final_patch = jsonpatch.JsonPatch(list(final_patch) + list(patch))
-                if not accept:
-                    break
-
-        response = self._generate_response(uid, accept, final_patch)
-        self.send_response(200)
-        self.end_headers()
-        self.wfile.write(json.dumps(response).encode("utf-8"))
-
-    def _generate_response(self, uid: str, accept: bool, patch: jsonpatch.JsonPatch) -> dict:
-        response = {
-            "apiVersion": "admission.k8s.io/v1",
-            "kind": "AdmissionReview",
-            "response": {"uid": uid, "allowed": accept},
-        }
-        if patch:
-            response["response"]["patchType"] = "JSONPatch"
-            response["response"]["patch"] = base64.b64encode(patch.to_string().encode("utf-8")).decode("utf-8")
-        return response
-
-    def _healthz(self) -> None:
-        self.send_response(200)
+        content_length = int(self.headers["Content-Length"])
+        own_buffer = content_length > self.BODY_BUFFER_SIZE
+        if own_buffer:
+            buffer = bytearray(content_length)
+            self.PROCESSOR.body_buffer_bytes.inc(amount=content_length)
+        else:
+            buffer = self._get_thread_buffer(content_length)
+        try:
+            raw_body = self._read_body(buffer, content_length)
+            parsed_url = urlparse(self.path)
+            response = self.PROCESSOR.process_post(parsed_url.path, raw_body, self.address_string(), parsed_url.query)
+        finally:
+            if own_buffer:
+                self.PROCESSOR.body_buffer_bytes.dec(amount=content_length)
+        self._send_response(response)
+
+    def _get_thread_buffer(self, size: int) -> bytearray:
+        """Returns the buffer of the current thread, which is reused by all the requests it processes.
+        It grows up to `BODY_BUFFER_SIZE` when a request doesn't fit in it
+        """
+        buffer = getattr(self._local, "body_buffer", bytearray())
+        if len(buffer) < size:
+            # The size is rounded up to a power of two, so it doesn't grow with every bigger request
+            new_size = min(self.BODY_BUFFER_SIZE, max(4096, 1 << (size - 1).bit_length()))
+            self.PROCESSOR.body_buffer_bytes.inc(amount=new_size - len(buffer))
+            buffer = bytearray(new_size)
+            self._local.body_buffer = buffer
+        return buffer
+
+    def _read_body(self, buffer: bytearray, content_length: int) -> memoryview:
+        """Reads the body of the request directly into `buffer`, without any intermediate copy
+
+        Returns:
+            memoryview: The part of `buffer` that contains the body
+        """
+        body = memoryview(buffer)[:content_length]
+        n_read = 0
+        while n_read < content_length:
+            n_bytes = self.rfile.readinto(body[n_read:])
+            if not n_bytes:
+                raise ConnectionError(f"The connection was closed after receiving {n_read} bytes of the body")
+            n_read += n_bytes
+        return body
+
+    def _send_response(self, response: HttpResponse) -> None:
+        self.requests_handled += 1
+        self.send_response(response.status)
+        for name, value in response.headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(response.body)))
+        if self.requests_handled >= self.MAX_REQUESTS_PER_CONNECTION or self.server.closing or self.close_connection:
+            # This also sets `self.close_connection`. While the server is draining, the clients
+            # must open new connections, which go to other replicas. The connection is also closed
+            # when the client asked for it or its body wasn't read
+            self.send_header("Connection", "close")
         self.end_headers()
-        self.wfile.write("I'm alive\n".encode("utf-8"))
+        self.wfile.write(response.body)
 
-    def _get_path(self) -> str:
-        parsed_url = urlparse(self.path)
-        return parsed_url.path
+    def log_request(self, code="-", size="-") -> None:
+        # Each admission request is already logged by the access log of the AdmissionProcessor
+        pass
 
-    def _get_body_request(self) -> dict:
-        """Returns the "request" field of the body of the current request"""
-        content_length = int(self.headers["Content-Length"])
-        raw_body = self.rfile.read(content_length)
-        body = json.loads(raw_body)
-        request = body["request"]
-        return request
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        # By default, it's written directly to stderr, bypassing the logging configuration
+        logging.info(f"{self.address_string()} - {format % args}")
 
 
-class Server:
+class ThreadPoolHTTPServer(http.server.HTTPServer):  # pylint: disable=too-many-instance-attributes
     def __init__(  # pylint: disable=too-many-arguments
-        self, port: int, certfile: str, keyfile: str, generic_webhook_config_file: str, config_refresh_period: float = 5
+        self,
+        server_address: tuple[str, int] | str,
+        handler_class: type[http.server.BaseHTTPRequestHandler],
+        max_workers: int,
+        max_queue_size: int,
+        reuse_port: bool = False,
+        drain_timeout: float | None = None,
+        unix_socket_mode: int = 0o660,
+    ) -> None:
+        """An http server that accepts the connections in the thread that calls `serve_forever` and
+        processes them in a bounded pool of worker threads. The accepted connections wait in a bounded
+        queue until a worker is free. If this queue is full, new connections are closed immediately,
+        so the server never accumulates an unbounded amount of work.
+
+        Args:
+            server_address (tuple[str, int] | str): The address and port where the server listens to,
+            or the path of a Unix domain socket
+            handler_class (type[http.server.BaseHTTPRequestHandler]): The class that processes each request
+            max_workers (int): Number of worker threads that process the requests concurrently
+            max_queue_size (int): Max number of accepted connections waiting for a free worker
+            reuse_port (bool, optional): Sets SO_REUSEPORT, so several processes can listen
+            to the same port. Defaults to False.
+            drain_timeout (float | None, optional): Max time, in seconds, that `server_close` waits for
+            the connections being processed. If None, there's no limit. Defaults to None.
+            unix_socket_mode (int, optional): The permissions of the Unix domain socket, when `server_address`
+            is a path. Defaults to 0o660.
+        """
+        if max_workers < 1:
+            raise ValueError(f"The number of workers must be at least 1, but got {max_workers}")
+        if max_queue_size < 0:
+            raise ValueError(f"The max queue size cannot be negative, but got {max_queue_size}")
+        self.allow_reuse_port = reuse_port
+        self.closing = False
+        if isinstance(server_address, str):
+            self.address_family = socket.AF_UNIX
+        self.unix_socket_mode = unix_socket_mode
+        # The path of the Unix domain socket once it's bound, so it's only removed by the server that created it
+        self.unix_socket: str | None = None
+        self.max_queue_size = max_queue_size
+        self.drain_timeout = drain_timeout
+        # A queue.Queue with maxsize=0 is unbounded, so we need at least one slot
+        self.requests_queue: queue.Queue = queue.Queue(maxsize=max(max_queue_size, 1))
+        # `server_close` is also called when the socket can't be bound, before starting the workers
+        self.workers: list[threading.Thread] = []
+        super().__init__(server_address, handler_class)
+        self.workers = [
+            threading.Thread(target=self._process_queued_requests, name=f"http-worker-{i}", daemon=True)
+            for i in range(max_workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def server_bind(self) -> None:
+        if self.address_family == socket.AF_UNIX:
+            # `http.server.HTTPServer` expects an address with a host and a port
+            bind_unix_socket(self.socket, self.server_address, self.unix_socket_mode)
+            self.unix_socket = self.server_address
+        else:
+            super().server_bind()
+
+    def get_request(self) -> tuple[socket.socket, tuple]:
+        request, client_address = super().get_request()
+        if self.address_family == socket.AF_UNIX:
+            client_address = get_client_address(self.server_address)
+        return request, client_address
+
+    def process_request(self, request: socket.socket, client_address: tuple) -> None:
+        try:
+            self.requests_queue.put_nowait((request, client_address))
+        except queue.Full:
+            logging.warning(f"Too many queued requests. Closing the connection from {client_address}")
+            self.shutdown_request(request)
+
+    def _process_queued_requests(self) -> None:
+        while True:
+            item = self.requests_queue.get()
+            # A None element means that the server is closing and the worker must finish
+            if item is None:
+                return
+            request, client_address = item
+            try:
+                # The TLS handshake is done in the worker, so a slow client cannot block
+                # the thread that accepts new connections
+                request.settimeout(self.RequestHandlerClass.timeout)
+                if isinstance(request, ssl.SSLSocket):
+                    request.do_handshake()
+                self.finish_request(request, client_address)
+            except Exception:  # pylint: disable=broad-exception-caught
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def handle_error(self, request: socket.socket, client_address: tuple) -> None:
+        logging.error(f"Error when processing the request from {client_address}", exc_info=True)
+
+    def get_queue_depth(self) -> int:
+        """Number of connections waiting for a free worker"""
+        return self.requests_queue.qsize()
+
+    def is_idle_connection_allowed(self) -> bool:
+        """An idle connection can keep its worker only if no other connection is waiting for one"""
+        return not self.closing and self.requests_queue.empty()
+
+    def start_draining(self) -> None:
+        """From now on, the connections are closed after answering their current request"""
+        self.closing = True
+
+    def server_close(self) -> None:
+        self.closing = True
+        super().server_close()
+        if self.unix_socket:
+            remove_unix_socket(self.unix_socket)
+        # The connections already queued are processed before the workers get the None element
+        for _ in self.workers:
+            self.requests_queue.put(None)
+        deadline = None if self.drain_timeout is None else time.monotonic() + self.drain_timeout
+        for worker in self.workers:
+            # The workers are daemon threads, so the ones still running don't prevent the process from exiting
+            worker.join(None if deadline is None else max(0, deadline - time.monotonic()))
+
+
+class Server:  # pylint: disable=too-many-instance-attributes
+    ENGINES = ["threads", "asyncio"]
+
+    def __init__(  # pylint: disable=too-many-arguments,too-many-locals
+        self,
+        port: int,
+        certfile: str,
+        keyfile: str,
+        generic_webhook_config_file: str,
+        config_refresh_period: float = 5,
+        max_workers: int = 8,
+        max_queue_size: int = 128,
+        engine: str = "threads",
+        reuse_port: bool = False,
+        keep_alive_timeout: float = 15,
+        max_requests_per_connection: int = 1000,
+        cert_refresh_period: float = 5,
+        default_timeout: float | None = None,
+        on_deadline: str = "fail-open",
+        max_concurrency: int = 0,
+        latency_target: float = 0.1,
+        control_port: int | None = None,
+        access_log_sample_rate: float = 1.0,
+        access_log_rate_limit: float = 0,
+        drain_delay: float = 0,
+        drain_timeout: float = 25,
+        projected_decoding: bool = False,
+        max_body_bytes: int | None = None,
+        http2: bool = False,
+        max_concurrent_streams: int = 100,
+        unix_socket: str | None = None,
+        unix_socket_mode: int = 0o660,
+        decision_cache_size: int = 0,
+        decision_cache_ttl: float = 60,
+        decision_cache_ignored_fields: tuple[str, ...] = DEFAULT_IGNORED_FIELDS,
+        coalesce_requests: bool = False,
+        skip_unchanged_updates: bool = False,
+        config_watch: bool = False,
+        config_cache_dir: str | None = None,
     ) -> None:
         """Validating/Mutating webhook server. It listens to requests made at port <port>
         and sends the corresponding answer according to the configuration from
@@ -160,31 +366,270 @@ class Server:
             that the system waits before reading again the webhook config file.
             This enables changing the configuration without restarting the server.
             Defaults to 5.
-        """
-        self.port = port
-        self.config_loader = ConfigLoader(generic_webhook_config_file, config_refresh_period)
 
-        # The Handler is created and destroyed for each request processed
-        class Handler(BaseHandler):
-            CONFIG_LOADER = self.config_loader
+            max_workers (int, optional): Number of threads that process the requests
+            concurrently. Defaults to 8.
+
+            max_queue_size (int, optional): Max number of connections (for the "threads" engine)
+            or requests (for the "asyncio" engine) waiting for a free thread. When this limit is
+            reached, new connections are closed or new requests are rejected with a 503. Defaults to 128.
 
-        self.httpd = http.server.HTTPServer(("0.0.0.0", self.port), Handler)
+            engine (str, optional): How the server handles the connections. "threads" uses
+            a pool of threads that process one connection each. "asyncio" handles all the
+            connections in an event loop and only uses the pool of threads to evaluate the
+            webhooks. Defaults to "threads".
+
+            reuse_port (bool, optional): Allows several processes to listen to the same port
+            at the same time, so the kernel distributes the connections between them. Defaults to False.
+
+            keep_alive_timeout (float, optional): Max time, in seconds, that a connection can stay
+            idle waiting for the next request. Defaults to 15.
+
+            max_requests_per_connection (int, optional): The server closes a connection after
+            answering this number of requests. Defaults to 1000.
+
+            cert_refresh_period (float, optional): This is the time, in seconds, that the
+            system waits before checking again if the certificate or key files have changed.
+            The new connections use the new certificate, while the established ones are not
+            affected. Defaults to 5.
+
+            default_timeout (float | None, optional): Max time, in seconds, to evaluate a request
+            when the apiserver doesn't send its own timeout. If None, there's no limit. Defaults to None.
+
+            on_deadline (str, optional): What to answer when a request exceeds its deadline.
+            "fail-open" accepts it without any patch and "fail-closed" rejects it. Defaults to "fail-open".
+
+            max_concurrency (int, optional): If greater than 0, the max number of requests evaluated
+            at the same time. The actual limit adapts to the latency of the requests and the ones
+            over it are rejected with a 503. Defaults to 0.
+
+            latency_target (float, optional): When `max_concurrency` is set, the time, in seconds, that
+            a request can take before the concurrency limit is reduced. Defaults to 0.1.
+
+            control_port (int | None, optional): If set, a second http server listens to this port
+            for the liveness (/livez, /healthz) and readiness (/readyz) probes, the metrics and some
+            diagnostic endpoints. It has its own thread, so it keeps answering while the admission requests
+            are backed up. Defaults to None.
+
+            access_log_sample_rate (float, optional): Fraction of the allowed requests that are written
+            to the access log. The denied and failed ones are always written. Defaults to 1.0.
+
+            access_log_rate_limit (float, optional): If greater than 0, max number of records per second
+            written to the access log. The ones over the limit are dropped. Defaults to 0.
+
+            drain_delay (float, optional): When the server is stopped, time, in seconds, that it keeps
+            accepting new connections after failing the readiness probe, so the clients stop sending
+            requests to it. Defaults to 0.
+
+            drain_timeout (float, optional): When the server is stopped, max time, in seconds, that
+            it waits for the requests in flight before shutting down. Defaults to 25.
+
+            projected_decoding (bool, optional): Only decode the fields of the admission requests that
+            the webhooks can read or patch, which saves CPU and memory with big objects. Defaults to False.
+
+            max_body_bytes (int | None, optional): Max size, in bytes, of the body of an admission request.
+            The bigger ones are rejected with a 413 without reading them. If None, there's no limit. Defaults to None.
+
+            http2 (bool, optional): Accepts HTTP/2 connections, so the apiserver can send several requests at
+            the same time through a single connection. It's only supported by the "asyncio" engine and needs
+            the `h2` package. Defaults to False.
+
+            max_concurrent_streams (int, optional): With `http2`, max number of requests that a client can
+            send at the same time through a single connection. Defaults to 100.
+
+            unix_socket (str | None, optional): If set, the server listens on a Unix domain socket created at
+            this path instead of on `port`. It's removed when the server stops. Defaults to None.
+
+            unix_socket_mode (int, optional): The permissions of `unix_socket`. Defaults to 0o660.
+
+            decision_cache_size (int, optional): If greater than 0, max number of decisions cached, so an
+            object that is sent again isn't evaluated again while the config doesn't change. Defaults to 0.
+
+            decision_cache_ttl (float, optional): Time, in seconds, that a decision is cached. Defaults to 60.
+
+            decision_cache_ignored_fields (tuple[str, ...], optional): Fields of the objects that don't change
+            the cached decisions when the webhooks can't be analysed, like the `metadata.resourceVersion`.
+            Defaults to DEFAULT_IGNORED_FIELDS.
+
+            coalesce_requests (bool, optional): The identical requests processed at the same time, like the
+            ones of the pods of a Deployment that scales up, share a single evaluation. Defaults to False.
+
+            skip_unchanged_updates (bool, optional): The UPDATE requests that don't change any field read or
+            patched by the webhooks, like the ones that only change the `status`, are allowed without evaluating
+            them. Defaults to False.
+
+            config_watch (bool, optional): Reload the config as soon as its file changes, using inotify, instead
+            of checking it every `config_refresh_period`, which is still used if inotify isn't available.
+            Defaults to False.
+
+            config_cache_dir (str | None, optional): Directory where the compiled configs are cached, so a server
+            that starts with a config that has already been parsed loads it without parsing it again. It must only
+            be writable by the user of the server. If None, the configs aren't cached. Defaults to None.
+        """
+        self.port = port
+        self.unix_socket = unix_socket
+        self.drain_delay = drain_delay
+        self.drain_timeout = drain_timeout
+        self.draining = False
+        # Each server has its own metrics, exposed at the /metrics path
+        self.metrics = MetricsRegistry()
+        self.config_loader = ConfigLoader(
+            generic_webhook_config_file, config_refresh_period, self.metrics, config_watch, config_cache_dir
+        )
+        limiter = None
+        if max_concurrency > 0:
+            limiter = AdaptiveConcurrencyLimiter(max_concurrency, latency_target, metrics=self.metrics)
+        access_logger = AccessLogger(access_log_sample_rate, access_log_rate_limit, self.metrics)
+        decision_cache = None
+        if decision_cache_size > 0:
+            decision_cache = DecisionCache(
+                decision_cache_size, decision_cache_ttl, decision_cache_ignored_fields, self.metrics
+            )
+        coalescer = None
+        if coalesce_requests:
+            # Both use the same keys, so they are only computed once for each request
+            keys = decision_cache.keys if decision_cache else DecisionKeys(decision_cache_ignored_fields)
+            coalescer = RequestCoalescer(keys, self.metrics)
+        self.processor = AdmissionProcessor(
+            self.config_loader,
+            self.metrics,
+            default_timeout,
+            on_deadline,
+            limiter,
+            access_logger,
+            projected_decoding,
+            max_body_bytes,
+            decision_cache,
+            coalescer,
+            skip_unchanged_updates,
+        )
+
+        if unix_socket and reuse_port:
+            raise ValueError("Several processes cannot listen on the same Unix domain socket")
+        if http2 and engine != "asyncio":
+            raise ValueError(f"HTTP/2 is only supported by the asyncio engine, not by {engine}")
+        self.tls_reloader = None
+        context = None
         if certfile and keyfile:
-            context = ssl.SSLContext(ssl.PROTOCOL_TLSv1_2)
-            context.load_cert_chain(certfile, keyfile)
-            self.httpd.socket = context.wrap_socket(self.httpd.socket, server_side=True)
+            # With HTTP/2, the clients that don't support it still use HTTP/1.1
+            alpn_protocols = [ALPN_PROTOCOL, "http/1.1"] if http2 else None
+            self.tls_reloader = TlsContextReloader(certfile, keyfile, cert_refresh_period, alpn_protocols)
+            context = self.tls_reloader.listening_context
+
+        server_address = unix_socket or ("0.0.0.0", self.port)
+        if engine == "threads":
+            # The Handler is created and destroyed for each connection processed
+            class Handler(BaseHandler):
+                PROCESSOR = self.processor
+                KEEP_ALIVE_TIMEOUT = keep_alive_timeout
+                MAX_REQUESTS_PER_CONNECTION = max_requests_per_connection
+                # The Unix domain sockets don't have a Nagle algorithm to disable
+                disable_nagle_algorithm = unix_socket is None
+
+            self.httpd = ThreadPoolHTTPServer(
+                server_address, Handler, max_workers, max_queue_size, reuse_port, drain_timeout, unix_socket_mode
+            )
+            if context:
+                self.httpd.socket = context.wrap_socket(
+                    self.httpd.socket, server_side=True, do_handshake_on_connect=False
+                )
+        elif engine == "asyncio":
+            self.httpd = AsyncioHTTPServer(
+                server_address,
+                self.processor,
+                context,
+                max_workers,
+                reuse_port,
+                keep_alive_timeout,
+                max_requests_per_connection,
+                max_queue_size,
+                drain_timeout,
+                http2,
+                max_concurrent_streams,
+                unix_socket_mode,
+            )
+        else:
+            raise ValueError(f"Invalid server engine {engine}. Must be one of {self.ENGINES}")
+        self.metrics.gauge(
+            "generic_webhook_queue_depth",
+            "Number of connections (threads engine) or requests (asyncio engine) waiting for a free thread",
+            callback=self.httpd.get_queue_depth,
+        )
+        self.metrics.gauge(
+            "generic_webhook_draining",
+            "1 while the server is waiting for the requests in flight before shutting down",
+            callback=lambda: int(self.draining),
+        )
+
+        self.control_server = None
+        if control_port is not None:
+            self.control_server = ControlServer(
+                control_port, self.config_loader, self.metrics, self.get_not_ready_reasons, reuse_port
+            )
+
+    def get_not_ready_reasons(self) -> list[str]:
+        """Returns why the server shouldn't receive new admission requests. An empty list means it's ready"""
+        reasons = []
+        if self.draining:
+            reasons.append("The server is shutting down")
+        if not self.config_loader.is_last_load_ok():
+            reasons.append(f"The last attempt to load the config failed: {self.config_loader.last_load_error}")
+        queue_depth = self.httpd.get_queue_depth()
+        if queue_depth >= max(self.httpd.max_queue_size, 1):
+            reasons.append(f"The queue is full: {queue_depth} waiting for a free thread")
+        return reasons
 
     def start(self) -> None:
-        logging.info(f"Starting server that listens of port {self.port}")
+        logging.info(f"Starting server that listens on {self.unix_socket or f'port {self.port}'}")
+        if self.control_server:
+            self.control_server.start()
         self.config_loader.start()
+        if self.tls_reloader:
+            self.tls_reloader.start()
         self.httpd.serve_forever()
         logging.info("Closing server...")
         self.httpd.server_close()
         self.config_loader.join()
+        if self.tls_reloader:
+            self.tls_reloader.join()
+        if self.control_server:
+            self.control_server.join()
         logging.info("Server stopped")
 
+    def get_requests_in_flight(self) -> int:
+        """Number of requests being processed or waiting for a free thread"""
+        return int(self.processor.requests_in_flight.get()) + self.httpd.get_queue_depth()
+
     def stop(self) -> None:
-        logging.info("The server must stop")
+        """Drains the server before shutting it down, so the requests in flight are answered instead of
+        being retried by the apiserver: the readiness probe fails first and, after `drain_delay`, the server
+        stops accepting new connections and waits up to `drain_timeout` for the requests in flight
+        """
+        self.draining = True
+        self.httpd.start_draining()
+        logging.info(f"The server must stop. Draining {self.get_requests_in_flight()} requests in flight")
+        if self.drain_delay > 0:
+            time.sleep(self.drain_delay)
         self.config_loader.stop()
+        if self.tls_reloader:
+            self.tls_reloader.stop()
         self.httpd.shutdown()
+        logging.info(f"Stopped accepting new connections. {self.get_requests_in_flight()} requests in flight")
+        if self._wait_for_requests_in_flight():
+            logging.info("All the requests in flight have been answered")
+        else:
+            logging.warning(
+                f"Drain timeout exceeded. Shutting down with {self.get_requests_in_flight()} requests in flight"
+            )
+        if self.control_server:
+            self.control_server.stop()
         logging.info("Shutdown completed")
+
+    def _wait_for_requests_in_flight(self) -> bool:
+        """Returns False if there are still requests in flight after `drain_timeout`"""
+        deadline = time.monotonic() + self.drain_timeout
+        while self.get_requests_in_flight() > 0:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
@@ -0,0 +1,150 @@
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import sys
+import threading
+import time
+
+# The events of a directory that can mean that one of its files has changed. A file that is replaced,
+# like the `..data` symlink of a ConfigMap, is moved to its final name
+WATCH_MASK = (
+    0x00000002  # IN_MODIFY
+    | 0x00000004  # IN_ATTRIB
+    | 0x00000008  # IN_CLOSE_WRITE
+    | 0x00000040  # IN_MOVED_FROM
+    | 0x00000080  # IN_MOVED_TO
+    | 0x00000100  # IN_CREATE
+    | 0x00000200  # IN_DELETE
+    | 0x00000400  # IN_DELETE_SELF
+    | 0x00000800  # IN_MOVE_SELF
+    | 0x01000000  # IN_ONLYDIR
+)
+# Max time, in seconds, that a burst of events can delay the notification
+MAX_DEBOUNCE_DELAY = 1
+
+
+def _load_libc() -> ctypes.CDLL | None:
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    except OSError:
+        return None
+    if not all(hasattr(libc, name) for name in ["inotify_init1", "inotify_add_watch", "inotify_rm_watch"]):
+        return None
+    return libc
+
+
+_libc = _load_libc()
+
+
+def is_available() -> bool:
+    """inotify is only available on Linux"""
+    return _libc is not None
+
+
+class FileWatcher:
+    def __init__(self, path: str) -> None:
+        """Waits for the changes of a file using inotify, without polling it. The directory of the file is
+        watched instead of the file itself, since a file is usually replaced rather than modified. For example,
+        the files of a ConfigMap mounted in a pod are symlinks to a directory that is replaced by a new one
+        when the ConfigMap is updated. The directory that the symlinks resolve to is watched too.
+
+        Args:
+            path (str): The file to watch
+
+        Raises:
+            OSError: if inotify isn't available or the directory of the file can't be watched
+        """
+        if _libc is None:
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        self.path = path
+        self._fd = _libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), f"Cannot initialize inotify: {os.strerror(ctypes.get_errno())}")
+        # A pipe that wakes up the thread blocked in `wait`
+        self._interrupt_read, self._interrupt_write = os.pipe()
+        self._closed = False
+        self._lock = threading.Lock()
+        # directory -> watch descriptor
+        self._watches: dict[str, int] = {}
+        try:
+            self._add_watch(os.path.dirname(os.path.abspath(path)))
+            self._update_watches()
+        except OSError:
+            self.close()
+            raise
+
+    def wait(self, debounce_delay: float) -> bool:
+        """Blocks until the file may have changed. A change usually generates several events, so it waits
+        until there are no more events for `debounce_delay` seconds, but never more than MAX_DEBOUNCE_DELAY
+
+        Returns:
+            bool: False if it has been interrupted by `interrupt`
+        """
+        if not self._wait_for_events(None):
+            return False
+        max_time = time.monotonic() + MAX_DEBOUNCE_DELAY
+        while True:
+            self._drain_events()
+            timeout = min(debounce_delay, max_time - time.monotonic())
+            if timeout <= 0:
+                break
+            if not self._wait_for_events(timeout):
+                if self._is_interrupted():
+                    return False
+                break
+        # The file may resolve to a different directory now
+        self._update_watches()
+        return True
+
+    def interrupt(self) -> None:
+        """Wakes up the thread blocked in `wait`. It can be called from any thread"""
+        with self._lock:
+            if not self._closed:
+                os.write(self._interrupt_write, b"\0")
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            for fd in [self._fd, self._interrupt_read, self._interrupt_write]:
+                os.close(fd)
+
+    def _wait_for_events(self, timeout: float | None) -> bool:
+        """Returns whether there are events to read. False if it timed out or it was interrupted"""
+        readable, _, _ = select.select([self._fd, self._interrupt_read], [], [], timeout)
+        return self._fd in readable and self._interrupt_read not in readable
+
+    def _is_interrupted(self) -> bool:
+        readable, _, _ = select.select([self._interrupt_read], [], [], 0)
+        return bool(readable)
+
+    def _drain_events(self) -> None:
+        # The events aren't parsed. Any of them makes the owner check the file, which is cheap
+        try:
+            while os.read(self._fd, 65536):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _update_watches(self) -> None:
+        directories = {os.path.dirname(os.path.abspath(self.path)), os.path.dirname(os.path.realpath(self.path))}
+        for directory in directories - self._watches.keys():
+            try:
+                self._add_watch(directory)
+            except OSError as e:
+                # It's added again after the next event
+                logging.warning(e)
+        for directory in self._watches.keys() - directories:
+            # The kernel has already removed the watch if the directory was deleted, so the error is ignored
+            _libc.inotify_rm_watch(self._fd, self._watches.pop(directory))
+
+    def _add_watch(self, directory: str) -> None:
+        watch_descriptor = _libc.inotify_add_watch(self._fd, os.fsencode(directory), WATCH_MASK)
+        if watch_descriptor < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, f"Cannot watch {directory}: {os.strerror(error)}")
+        self._watches[directory] = watch_descriptor
@@ -4,6 +4,7 @@ from typing import Any, Union
 import jsonpatch
 
 from generic_k8s_webhook import operators
+from generic_k8s_webhook.deadline import check_deadline
 from generic_k8s_webhook.utils import to_number
 
 
@@ -187,6 +188,7 @@ class JsonPatchForEach(JsonPatchOperator):
     def generate_patch(self, contexts: list[Union[list, dict]], prefix: list[str] = None) -> jsonpatch.JsonPatch:
         list_raw_patch = []
         for payload, path in self.op_with_ref.get_value_with_ref(contexts):
+            check_deadline()
             for jsonpatch_op in self.list_jsonpatch_op:
                 patch_obj = jsonpatch_op.generate_patch(contexts + [payload], path)
                 list_raw_patch.extend(patch_obj.patch)
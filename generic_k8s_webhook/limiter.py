@@ -0,0 +1,78 @@
+import threading
+
+from generic_k8s_webhook.metrics import MetricsRegistry
+
+
+class AdaptiveConcurrencyLimiter:
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        max_limit: int,
+        latency_target: float,
+        min_limit: int = 1,
+        backoff_ratio: float = 0.9,
+        metrics: MetricsRegistry | None = None,
+    ) -> None:
+        """Limits the number of requests processed at the same time. The limit adapts to the observed
+        latency following an AIMD (additive increase, multiplicative decrease) algorithm: it's increased
+        by one after each request that finishes within `latency_target` while the limit is being used,
+        and multiplied by `backoff_ratio` after each request that is slower or exceeds its deadline.
+
+        The evaluation of the webhooks is CPU bound, so having more requests in flight doesn't increase
+        the throughput, it only makes all of them slower. Rejecting the requests over the limit
+        keeps the latency of the accepted ones low.
+
+        Args:
+            max_limit (int): The max number of concurrent requests. It's also the initial limit
+            latency_target (float): Time, in seconds, that a request can take before the limit is reduced
+            min_limit (int, optional): The limit is never reduced below this value. Defaults to 1.
+            backoff_ratio (float, optional): How much the limit is reduced after a slow request. Defaults to 0.9.
+            metrics (MetricsRegistry | None, optional): Where the state of the limiter is exported.
+            Defaults to None.
+        """
+        if min_limit < 1 or max_limit < min_limit:
+            raise ValueError(f"Invalid concurrency limits. Expected 1 <= {min_limit} <= {max_limit}")
+        if not 0 < backoff_ratio < 1:
+            raise ValueError(f"The backoff ratio must be between 0 and 1, but got {backoff_ratio}")
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.latency_target = latency_target
+        self.backoff_ratio = backoff_ratio
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self.lock = threading.Lock()
+        if metrics:
+            metrics.gauge(
+                "generic_webhook_concurrency_limit",
+                "Current max number of admission requests processed at the same time",
+                callback=lambda: int(self.limit),
+            )
+
+    def try_acquire(self) -> bool:
+        """Reserves a slot for a new request
+
+        Returns:
+            bool: False if the limit has been reached. In that case, the request must be rejected
+            and `release` must not be called
+        """
+        with self.lock:
+            if self.in_flight >= int(self.limit):
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self, latency: float, dropped: bool = False) -> None:
+        """Frees the slot of a request and adapts the limit according to its latency
+
+        Args:
+            latency (float): The time, in seconds, it took to process the request
+            dropped (bool, optional): The request didn't finish in time (for example, it exceeded
+            its deadline), so the limit must be reduced regardless of the latency. Defaults to False.
+        """
+        with self.lock:
+            if dropped or latency > self.latency_target:
+                self.limit = max(self.min_limit, self.limit * self.backoff_ratio)
+            elif self.in_flight * 2 >= self.limit:
+                # Only increase the limit if it's being used, otherwise it could grow indefinitely
+                # while the load is low and it wouldn't protect us when the load increases
+                self.limit = min(self.max_limit, self.limit + 1)
+            self.in_flight -= 1
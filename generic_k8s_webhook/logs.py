@@ -0,0 +1,165 @@
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import threading
+import time
+from typing import Any
+
+from generic_k8s_webhook import codec
+from generic_k8s_webhook.metrics import MetricsRegistry
+
+LOG_FORMAT = "%(asctime)s,%(msecs)03d %(levelname)-8s [%(filename)s:%(lineno)d] %(message)s"
+# Logger of the structured access log. Its records are a json object per line, written to stdout
+ACCESS_LOGGER = "generic_k8s_webhook.access"
+
+
+class RateLimiter:
+    def __init__(self, rate: float, burst: float | None = None) -> None:
+        """Token bucket that allows, on average, `rate` events per second
+
+        Args:
+            rate (float): Number of events allowed per second
+            burst (float | None, optional): Max number of events allowed at once, after a period
+            without events. If None, it's the same as `rate`. Defaults to None.
+        """
+        if rate <= 0:
+            raise ValueError(f"The rate must be greater than 0, but got {rate}")
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate, 1)
+        self.tokens = self.burst
+        self.last_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Consumes a token if there's any left
+
+        Returns:
+            bool: True if the event is allowed
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last_time) * self.rate)
+            self.last_time = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class RateLimitFilter(logging.Filter):
+    def __init__(self, rate: float) -> None:
+        """Drops the log records over `rate` records per second, so a misbehaving config (for example,
+        one that fails for every request) can't flood the output. The next record that goes through
+        says how many were dropped.
+        """
+        super().__init__()
+        self.rate_limiter = RateLimiter(rate)
+        self.dropped = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not self.rate_limiter.allow():
+            self.dropped += 1
+            return False
+        if self.dropped:
+            record.msg = f"{record.getMessage()} ({self.dropped} previous log records were dropped by the rate limit)"
+            record.args = None
+            self.dropped = 0
+        return True
+
+
+class BackgroundQueueHandler(logging.handlers.QueueHandler):
+    """Puts the records in a queue that is consumed by another thread. Unlike the standard QueueHandler,
+    it doesn't format the exceptions in the thread that logs them. That's also done by the other thread.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The queue is never shared with other processes, so the record doesn't need to be pickled.
+        # Only the message is resolved, because its arguments could be modified after this call
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class AccessLogger:
+    def __init__(self, sample_rate: float = 1.0, rate_limit: float = 0, metrics: MetricsRegistry | None = None) -> None:
+        """Emits a structured (json) record for each admission request
+
+        Args:
+            sample_rate (float, optional): Fraction of the allowed requests that are logged. The requests
+            that are denied or fail are always logged. Defaults to 1.0.
+            rate_limit (float, optional): If greater than 0, max number of records per second.
+            The ones over the limit are dropped. Defaults to 0.
+            metrics (MetricsRegistry | None, optional): Where the dropped records are counted. Defaults to None.
+        """
+        if not 0 <= sample_rate <= 1:
+            raise ValueError(f"The sample rate must be between 0 and 1, but got {sample_rate}")
+        self.logger = logging.getLogger(ACCESS_LOGGER)
+        self.sample_rate = sample_rate
+        self.rate_limiter = RateLimiter(rate_limit) if rate_limit > 0 else None
+        self.dropped = None
+        if metrics:
+            self.dropped = metrics.counter(
+                "generic_webhook_access_log_dropped_total",
+                "Number of access log records dropped because of the rate limit",
+            )
+
+    def log(self, access_record: dict[str, Any]) -> None:
+        """Logs the record of a request, unless it's discarded by the sampling or the rate limit"""
+        if not self.logger.isEnabledFor(logging.INFO):
+            return
+        if access_record.get("decision") == "allowed" and random.random() >= self.sample_rate:
+            return
+        if self.rate_limiter and not self.rate_limiter.allow():
+            if self.dropped:
+                self.dropped.inc()
+            return
+        self.logger.info(codec.dumps({"time": time.time(), **access_record}).decode("utf-8"))
+
+
+def configure_logging(verbose: int = 0, access_log: bool = False, rate_limit: float = 0) -> None:
+    """Configures the logs of the application: the messages of all the modules go to stderr
+    and the access log goes to stdout
+
+    Args:
+        verbose (int, optional): If greater than 0, the info messages are also logged. Defaults to 0.
+        access_log (bool, optional): Enables the access log. It's also enabled with `verbose`. Defaults to False.
+        rate_limit (float, optional): If greater than 0, max number of records per second logged by the
+        modules. The ones over the limit are dropped. Defaults to 0.
+    """
+    logging.basicConfig(format=LOG_FORMAT, level=logging.INFO if verbose > 0 else logging.WARNING)
+    if rate_limit > 0:
+        # The modules of this package use the root logger
+        logging.getLogger().addFilter(RateLimitFilter(rate_limit))
+
+    access_logger = logging.getLogger(ACCESS_LOGGER)
+    access_logger.setLevel(logging.INFO if access_log or verbose > 0 else logging.WARNING)
+    access_logger.propagate = False
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    access_logger.addHandler(handler)
+
+
+def start_background_logging() -> list[logging.handlers.QueueListener]:
+    """Moves the handlers of the root and the access loggers to background threads, so the threads
+    that process the requests never block writing the logs. It must be called after forking the
+    worker processes, since the threads don't survive a fork.
+
+    Returns:
+        list[logging.handlers.QueueListener]: The background threads. They must be stopped before
+        exiting, so the queued records are written
+    """
+    listeners = []
+    for logger in [logging.getLogger(), logging.getLogger(ACCESS_LOGGER)]:
+        handlers = list(logger.handlers)
+        if not handlers:
+            continue
+        log_queue = queue.SimpleQueue()
+        listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        for handler in handlers:
+            logger.removeHandler(handler)
+        logger.addHandler(BackgroundQueueHandler(log_queue))
+        listener.start()
+        listeners.append(listener)
+    return listeners
@@ -8,8 +8,13 @@ import threading
 import yaml
 
 from generic_k8s_webhook import __version__
+from generic_k8s_webhook.admission import AdmissionProcessor
 from generic_k8s_webhook.config_parser.entrypoint import GenericWebhookConfigManifest
+from generic_k8s_webhook.decision_cache import DEFAULT_IGNORED_FIELDS
 from generic_k8s_webhook.http_server import Server
+from generic_k8s_webhook.logs import configure_logging, start_background_logging
+from generic_k8s_webhook.prefork import Supervisor
+from generic_k8s_webhook.unix_socket import parse_listen_address
 
 
 def cli(args):
@@ -41,7 +46,49 @@ def cli(args):
 
 
 def start_server(args):
-    server = Server(args.port, args.cert_file, args.key_file, args.config)
+    if args.workers > 1:
+        # Each worker creates its own server, which listens to the same port thanks to SO_REUSEPORT
+        supervisor = Supervisor(args.workers, lambda: run_server(args))
+        sys.exit(supervisor.run())
+    run_server(args)
+
+
+def run_server(args):
+    server = Server(
+        args.port,
+        args.cert_file,
+        args.key_file,
+        args.config,
+        max_workers=args.threads,
+        max_queue_size=args.max_queue_size,
+        engine=args.engine,
+        reuse_port=args.workers > 1,
+        keep_alive_timeout=args.keep_alive_timeout,
+        max_requests_per_connection=args.max_requests_per_connection,
+        cert_refresh_period=args.cert_refresh_period,
+        default_timeout=args.default_timeout,
+        on_deadline=args.on_deadline,
+        max_concurrency=args.max_concurrency,
+        latency_target=args.latency_target,
+        control_port=args.control_port,
+        access_log_sample_rate=args.access_log_sample_rate,
+        access_log_rate_limit=args.log_rate_limit,
+        drain_delay=args.drain_delay,
+        drain_timeout=args.drain_timeout,
+        projected_decoding=args.projected_decoding,
+        max_body_bytes=args.max_body_bytes or None,
+        http2=args.http2,
+        max_concurrent_streams=args.max_concurrent_streams,
+        unix_socket=args.listen,
+        unix_socket_mode=args.socket_mode,
+        decision_cache_size=args.decision_cache_size,
+        decision_cache_ttl=args.decision_cache_ttl,
+        decision_cache_ignored_fields=tuple(field for field in args.decision_cache_ignored_fields.split(",") if field),
+        coalesce_requests=args.coalesce_requests,
+        skip_unchanged_updates=args.skip_unchanged_updates,
+        config_watch=args.config_watch,
+        config_cache_dir=args.config_cache_dir,
+    )
 
     def stop_server(*args):  # pylint: disable=unused-argument
         threading.Thread(target=server.stop).start()
@@ -49,7 +96,13 @@ def start_server(args):
     signal.signal(signal.SIGINT, stop_server)
     signal.signal(signal.SIGTERM, stop_server)
 
-    server.start()
+    # The threads that write the logs are created here, since they don't survive the fork of the workers
+    listeners = start_background_logging()
+    try:
+        server.start()
+    finally:
+        for listener in listeners:
+            listener.stop()
 
 
 def parse_args() -> argparse.ArgumentParser:
@@ -61,7 +114,20 @@ def parse_args() -> argparse.ArgumentParser:
     parser.add_argument("--verbose", "-v", action="count", default=0)
 
     server_subparser = subparser.add_parser("server", help="Create an http server")
-    server_subparser.add_argument("--port", type=int, required=True, help="Port where the server will listen")
+    address_group = server_subparser.add_mutually_exclusive_group(required=True)
+    address_group.add_argument("--port", type=int, help="Port where the server will listen")
+    address_group.add_argument(
+        "--listen",
+        type=parse_listen_address,
+        help="Listen on a Unix domain socket instead of a port, like unix:/run/webhook.sock. "
+        + "It's useful when a sidecar in the same pod already terminates the TLS connections",
+    )
+    server_subparser.add_argument(
+        "--socket-mode",
+        type=lambda mode: int(mode, 8),
+        default=0o660,
+        help="Permissions, in octal, of the Unix domain socket of --listen. Default 660",
+    )
     server_subparser.add_argument(
         "--cert-file",
         type=str,
@@ -72,6 +138,186 @@ def parse_args() -> argparse.ArgumentParser:
         type=str,
         help="Private key file for the TLS connection. If not provided, the server will be a standard http one",
     )
+    server_subparser.add_argument(
+        "--cert-refresh-period",
+        type=float,
+        default=5,
+        help="Time, in seconds, between checks for changes in the certificate and key files. "
+        + "When they change, they are used for the new connections without restarting the server",
+    )
+    server_subparser.add_argument(
+        "--engine",
+        choices=Server.ENGINES,
+        default="threads",
+        help="'threads' processes each connection in a pool of threads. 'asyncio' handles all the connections "
+        + "in an event loop and only uses the pool of threads to evaluate the webhooks",
+    )
+    server_subparser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes that serve the requests. Each one listens to the same port using SO_REUSEPORT. "
+        + "When it's greater than 1, a supervisor process restarts the workers that die",
+    )
+    server_subparser.add_argument(
+        "--threads", type=int, default=8, help="Number of threads that process the requests concurrently"
+    )
+    server_subparser.add_argument(
+        "--max-queue-size",
+        type=int,
+        default=128,
+        help="Max number of connections (threads engine) or requests (asyncio engine) waiting for a free thread. "
+        + "New connections are closed or new requests are rejected with a 503 when it's full",
+    )
+    server_subparser.add_argument(
+        "--keep-alive-timeout",
+        type=float,
+        default=15,
+        help="Max time, in seconds, that a connection can stay idle waiting for the next request",
+    )
+    server_subparser.add_argument(
+        "--max-requests-per-connection",
+        type=int,
+        default=1000,
+        help="The server closes a connection after answering this number of requests",
+    )
+    server_subparser.add_argument(
+        "--default-timeout",
+        type=float,
+        default=None,
+        help="Max time, in seconds, to evaluate a request when the K8S API server doesn't send its own timeout. "
+        + "By default, there's no limit",
+    )
+    server_subparser.add_argument(
+        "--on-deadline",
+        choices=AdmissionProcessor.DEADLINE_POLICIES,
+        default="fail-open",
+        help="What to answer when the evaluation of a request exceeds its deadline. 'fail-open' accepts it "
+        + "without any patch and 'fail-closed' rejects it",
+    )
+    server_subparser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=0,
+        help="Max number of requests evaluated at the same time. The actual limit adapts to the latency of the "
+        + "requests and the ones over it are rejected with a 503. By default, there's no limit",
+    )
+    server_subparser.add_argument(
+        "--latency-target",
+        type=float,
+        default=0.1,
+        help="Time, in seconds, that a request can take before the concurrency limit is reduced. "
+        + "Only used with --max-concurrency",
+    )
+    server_subparser.add_argument(
+        "--control-port",
+        type=int,
+        default=None,
+        help="Port for the liveness (/livez) and readiness (/readyz) probes, the metrics and the diagnostic "
+        + "endpoints. It's served by its own thread, so it keeps answering when the admission requests are backed up",
+    )
+    server_subparser.add_argument(
+        "--access-log",
+        action="store_true",
+        help="Write a json record to stdout for each admission request, with its path, webhooks, decision, "
+        + "latency and patch size. It's also enabled with --verbose",
+    )
+    server_subparser.add_argument(
+        "--access-log-sample-rate",
+        type=float,
+        default=1.0,
+        help="Fraction (between 0 and 1) of the allowed requests written to the access log. "
+        + "The denied and failed requests are always written",
+    )
+    server_subparser.add_argument(
+        "--log-rate-limit",
+        type=float,
+        default=100,
+        help="Max number of log records per second, for the access log and for the rest of the logs separately. "
+        + "The records over the limit are dropped. 0 disables the limit",
+    )
+    server_subparser.add_argument(
+        "--drain-delay",
+        type=float,
+        default=0,
+        help="After a SIGTERM, time, in seconds, that the server keeps accepting new connections "
+        + "while its readiness probe fails, so it's removed from the endpoints of the service",
+    )
+    server_subparser.add_argument(
+        "--drain-timeout",
+        type=float,
+        default=25,
+        help="After a SIGTERM, max time, in seconds, that the server waits for the requests in flight "
+        + "once it stops accepting new connections",
+    )
+    server_subparser.add_argument(
+        "--projected-decoding",
+        action="store_true",
+        help="Only decode the fields of the admission requests that the webhooks can read or patch. "
+        + "It saves CPU and memory when the objects are big, like ConfigMaps or Secrets with a lot of data",
+    )
+    server_subparser.add_argument(
+        "--max-body-bytes",
+        type=int,
+        default=8 * 1024 * 1024,
+        help="Max size, in bytes, of the body of an admission request. The bigger ones are rejected with a 413 "
+        + "before reading them. The default fits the biggest objects accepted by the apiserver, plus their "
+        + "old version in the updates. 0 disables the limit",
+    )
+    server_subparser.add_argument(
+        "--http2",
+        action="store_true",
+        help="Accept HTTP/2 connections, so the apiserver can send several requests at the same time through "
+        + "a single connection. It needs the asyncio engine and the h2 package",
+    )
+    server_subparser.add_argument(
+        "--max-concurrent-streams",
+        type=int,
+        default=100,
+        help="With --http2, max number of requests that a client can send at the same time through a connection",
+    )
+    server_subparser.add_argument(
+        "--decision-cache-size",
+        type=int,
+        default=0,
+        help="Max number of decisions cached, so an object that is sent again isn't evaluated again while the "
+        + "config doesn't change. By default, the decisions aren't cached",
+    )
+    server_subparser.add_argument(
+        "--decision-cache-ttl",
+        type=float,
+        default=60,
+        help="Time, in seconds, that a decision is cached. Only used with --decision-cache-size",
+    )
+    server_subparser.add_argument(
+        "--decision-cache-ignored-fields",
+        type=str,
+        default=",".join(DEFAULT_IGNORED_FIELDS),
+        help="Comma separated fields of the objects, in dot notation, that don't change the cached decisions. "
+        + "Only used when the fields read by the webhooks can't be analysed",
+    )
+    server_subparser.add_argument(
+        "--coalesce-requests",
+        action="store_true",
+        help="The identical requests processed at the same time share a single evaluation",
+    )
+    server_subparser.add_argument(
+        "--skip-unchanged-updates",
+        action="store_true",
+        help="Allow the UPDATE requests without evaluating the webhooks when they don't change any field that "
+        + "the webhooks read or patch, since the old object was already admitted by them",
+    )
+    server_subparser.add_argument(
+        "--config-watch",
+        action="store_true",
+        help="Reload the config as soon as its file changes, using inotify, instead of checking it periodically",
+    )
+    server_subparser.add_argument(
+        "--config-cache-dir",
+        type=str,
+        help="Directory where the compiled configs are cached, so a new server doesn't parse again a config that "
+        + "has already been parsed. It must only be writable by the user of the server. Disabled by default",
+    )
     server_subparser.set_defaults(func=start_server)
 
     cli_subparser = subparser.add_parser("cli", help="Use the program as a cli utility")
@@ -92,17 +338,14 @@ def parse_args() -> argparse.ArgumentParser:
     cli_subparser.set_defaults(func=cli)
 
     args = parser.parse_args()
+    if getattr(args, "func", None) is start_server and args.listen and args.workers > 1:
+        server_subparser.error("--listen can't be used with more than one worker")
     return args
 
 
 def main():
     args = parse_args()
-    if args.verbose > 0:
-        logging.basicConfig(
-            format="%(asctime)s,%(msecs)03d %(levelname)-8s [%(filename)s:%(lineno)d] %(message)s", level=logging.INFO
-        )
-    else:
-        logging.basicConfig(format="%(asctime)s,%(msecs)03d %(levelname)-8s [%(filename)s:%(lineno)d] %(message)s")
+    configure_logging(args.verbose, getattr(args, "access_log", False), getattr(args, "log_rate_limit", 0))
     args.func(args)
 
 
@@ -0,0 +1,265 @@
+import bisect
+import math
+import threading
+from typing import Callable
+
+# In seconds. From half a millisecond to several seconds, since the apiserver waits 10 seconds by default
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# In bytes. From a small patch to a very big manifest
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class Metric:
+    TYPE = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> None:
+        """Base class for all the metrics. To avoid any contention between the threads that update a metric,
+        each thread writes to its own shard, and the shards are only aggregated when the metrics are rendered.
+        The lock is only used the first time a thread updates the metric and when the metrics are rendered.
+
+        Args:
+            name (str): The name of the metric
+            documentation (str): A description of what the metric measures
+            labelnames (tuple[str, ...], optional): The names of the labels. When updating the metric,
+            the values of the labels must be passed in the same order. Defaults to ().
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards: list[dict] = []
+        self._shards_lock = threading.Lock()
+
+    def _get_shard(self) -> dict:
+        """Returns the shard of the current thread. Only the current thread writes to it"""
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard: dict = {}
+            with self._shards_lock:
+                self._shards.append(shard)
+            self._local.shard = shard
+            return shard
+
+    def _get_shards(self) -> list[dict]:
+        """Returns a copy of all the shards. They can be updated by other threads in the meantime,
+        so the copy is done with `dict(...)`, which never fails if another thread adds a new item
+        """
+        with self._shards_lock:
+            shards = list(self._shards)
+        return [dict(shard) for shard in shards]
+
+    def _format_labels(self, labelvalues: tuple, extra: str = "") -> str:
+        labels = [f'{name}="{_escape(str(value))}"' for name, value in zip(self.labelnames, labelvalues)]
+        if extra:
+            labels.append(extra)
+        if not labels:
+            return ""
+        return "{" + ",".join(labels) + "}"
+
+    def render(self) -> list[str]:
+        """Returns the lines that represent this metric in the Prometheus text format"""
+        lines = [
+            f"# HELP {self.name} {_escape(self.documentation, quotes=False)}",
+            f"# TYPE {self.name} {self.TYPE}",
+        ]
+        lines += self._render_samples()
+        return lines
+
+    def _add(self, labelvalues: tuple, amount: float) -> None:
+        shard = self._get_shard()
+        shard[labelvalues] = shard.get(labelvalues, 0) + amount
+
+    def _get_value(self, labelvalues: tuple) -> float:
+        """The current value, aggregated from all the threads"""
+        return sum(shard.get(labelvalues, 0) for shard in self._get_shards())
+
+    def _aggregate(self) -> dict:
+        total: dict[tuple, float] = {}
+        for shard in self._get_shards():
+            for labelvalues, value in shard.items():
+                total[labelvalues] = total.get(labelvalues, 0) + value
+        # Without labels, the metric is known before being updated, so it's exposed from the beginning
+        if not self.labelnames and not total:
+            total[()] = 0
+        return total
+
+    def _render_samples(self) -> list[str]:
+        return [
+            f"{self.name}{self._format_labels(labelvalues)} {_format_value(value)}"
+            for labelvalues, value in sorted(self._aggregate().items())
+        ]
+
+
+class Counter(Metric):
+    TYPE = "counter"
+
+    def inc(self, labelvalues: tuple = (), amount: float = 1) -> None:
+        self._add(labelvalues, amount)
+
+    def get(self, labelvalues: tuple = ()) -> float:
+        return self._get_value(labelvalues)
+
+
+class Gauge(Metric):
+    TYPE = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        callback: Callable[[], float] | None = None,
+    ) -> None:
+        """A value that can go up and down. It's either updated with `inc` and `dec`, which
+        can be called from any thread, or it's calculated by `callback` each time it's rendered.
+
+        Args:
+            name (str): The name of the metric
+            documentation (str): A description of what the metric measures
+            labelnames (tuple[str, ...], optional): The names of the labels. Defaults to ().
+            callback (Callable[[], float] | None, optional): If set, the value of the gauge is
+            the result of calling this function. Only valid without labels. Defaults to None.
+        """
+        if callback and labelnames:
+            raise ValueError(f"The gauge {name} cannot have labels and a callback at the same time")
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def inc(self, labelvalues: tuple = (), amount: float = 1) -> None:
+        self._add(labelvalues, amount)
+
+    def dec(self, labelvalues: tuple = (), amount: float = 1) -> None:
+        self._add(labelvalues, -amount)
+
+    def get(self, labelvalues: tuple = ()) -> float:
+        if self.callback:
+            return self.callback()
+        return self._get_value(labelvalues)
+
+    def _aggregate(self) -> dict:
+        if self.callback:
+            return {(): self.callback()}
+        return super()._aggregate()
+
+
+class Histogram(Metric):
+    TYPE = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        """Counts the observed values in buckets, so we can calculate quantiles from them
+
+        Args:
+            name (str): The name of the metric
+            documentation (str): A description of what the metric measures
+            labelnames (tuple[str, ...], optional): The names of the labels. Defaults to ().
+            buckets (tuple[float, ...], optional): The upper bounds of the buckets, in increasing
+            order. The +Inf bucket is always added. Defaults to DEFAULT_BUCKETS.
+        """
+        if list(buckets) != sorted(buckets):
+            raise ValueError(f"The buckets of the histogram {name} must be sorted")
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, labelvalues: tuple = ()) -> None:
+        shard = self._get_shard()
+        series = shard.get(labelvalues)
+        if series is None:
+            # The counts are not cumulative here, they are accumulated when rendered.
+            # The last position is the +Inf bucket
+            series = [[0] * (len(self.buckets) + 1), 0.0]
+            shard[labelvalues] = series
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def get_count(self, labelvalues: tuple = ()) -> int:
+        """The number of observed values, aggregated from all the threads"""
+        return sum(sum(shard[labelvalues][0]) for shard in self._get_shards() if labelvalues in shard)
+
+    def _aggregate(self) -> dict:
+        total: dict[tuple, tuple[list[int], float]] = {}
+        for shard in self._get_shards():
+            for labelvalues, (counts, value_sum) in shard.items():
+                total_counts, total_sum = total.get(labelvalues, ([0] * len(counts), 0.0))
+                total[labelvalues] = ([a + b for a, b in zip(total_counts, counts)], total_sum + value_sum)
+        if not self.labelnames and not total:
+            total[()] = ([0] * (len(self.buckets) + 1), 0.0)
+        return total
+
+    def _render_samples(self) -> list[str]:
+        lines = []
+        for labelvalues, (counts, value_sum) in sorted(self._aggregate().items()):
+            cumulative = 0
+            for upper_bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = f'le="{_format_value(upper_bound)}"'
+                lines.append(f"{self.name}_bucket{self._format_labels(labelvalues, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{self._format_labels(labelvalues)} {_format_value(value_sum)}")
+            lines.append(f"{self.name}_count{self._format_labels(labelvalues)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self) -> None:
+        """A collection of metrics that are exposed together in the Prometheus text format"""
+        self.metrics: dict[str, Metric] = {}
+        self.lock = threading.Lock()
+
+    def counter(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        callback: Callable[[], float] | None = None,
+    ) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames, callback))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def _register(self, metric: Metric) -> Metric:
+        with self.lock:
+            if metric.name in self.metrics:
+                raise ValueError(f"The metric {metric.name} is already registered")
+            self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str, quotes: bool = True) -> str:
+    value = value.replace("\\", "\\\\").replace("\n", "\\n")
+    if quotes:
+        value = value.replace('"', '\\"')
+    return value
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
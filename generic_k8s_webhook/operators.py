@@ -2,6 +2,7 @@ import abc
 from numbers import Number
 from typing import Any, Union, get_args, get_origin
 
+from generic_k8s_webhook.deadline import check_deadline
 from generic_k8s_webhook.utils import to_number
 
 # Make Number callable, so it can convert, for example, a string into an int or float
@@ -294,6 +295,7 @@ class ForEach(Operator):
 
         result_list = []
         for elem in elements:
+            check_deadline()
             mapped_elem = self.op.get_value(contexts + [elem])
             result_list.append(mapped_elem)
         return result_list
@@ -317,6 +319,7 @@ class Filter(Operator):
 
         result_list = []
         for elem in elements:
+            check_deadline()
             mapped_elem = self.op.get_value(contexts + [elem])
             if mapped_elem:
                 result_list.append(elem)
@@ -337,6 +340,7 @@ class Contain(Operator):
     def get_value(self, contexts: list):
         target_elem = self.elem.get_value(contexts)
         for elem in self.elements.get_value(contexts):
+            check_deadline()
             if target_elem == elem:
                 return True
         return False
@@ -411,6 +415,7 @@ class GetValue(OperatorWithRef):
             raise RuntimeError(f"Expected list when evaluating '*', but got {data}")
         l = []
         for i, elem in enumerate(data):
+            check_deadline()
             sublist = self._get_value_from_json(elem, path[1:], formated_path + [i])
             if isinstance(sublist, list):
                 l.extend(sublist)
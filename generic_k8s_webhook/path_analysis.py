@@ -0,0 +1,389 @@
+import re
+from typing import Any, Iterable
+
+from generic_k8s_webhook import codec, jsonpatch_helpers, operators
+from generic_k8s_webhook.webhook import Webhook
+
+# Matches any key of a dict or any element of a list
+WILDCARD = "*"
+
+# The decoding works on the raw bytes of the document, so it's never copied into a python str
+_WHITESPACE = re.compile(rb"[ \t\n\r]*")
+_SCALAR = re.compile(rb"-?[0-9][0-9.eE+-]*|true|false|null")
+# The tokens that `_skip_value` skips with a single regex, which is much faster than a python loop: the chars
+# outside a string, the short strings without escaped chars and the dicts or lists with up to 2 levels
+# of nesting made of these tokens. For example, the items of the `env` of a container.
+# The possessive quantifiers (`++`, `*+`) never backtrack, so a failed match is cheap
+_SHORT_STRING = r'"[^"\\]{0,256}+"'
+_FLAT_CONTAINER = rf"[{{\[](?:[^\"{{}}\[\]]++|{_SHORT_STRING})*+[}}\]]"
+_NESTED_CONTAINER = rf"[{{\[](?:[^\"{{}}\[\]]++|{_SHORT_STRING}|{_FLAT_CONTAINER})*+[}}\]]"
+_SKIPPABLE = re.compile(rf"(?:[^\"{{}}\[\]]++|{_SHORT_STRING}|{_NESTED_CONTAINER})*+".encode("ascii"))
+_QUOTE = ord('"')
+# memoryviews don't have a `find` method, so they are searched in chunks of up to this size
+_MAX_CHUNK_SIZE = 65536
+_BACKSLASH = ord("\\")
+
+
+class UnsupportedOperator(Exception):
+    pass
+
+
+class PathTrie:
+    def __init__(self) -> None:
+        """A set of paths within a json document, stored as a trie. A path includes everything below it,
+        so if a path is added, any other path that starts with it is redundant.
+        """
+        self.children: dict[str, PathTrie] = {}
+        # The whole subtree below this node is referenced
+        self.full = False
+        self._child_cache: dict[str, PathTrie | None] = {}
+        self._element_child: PathTrie | None = None
+        self._element_child_computed = False
+
+    def add(self, path: Iterable[str]) -> None:
+        node = self
+        for key in path:
+            if node.full:
+                return
+            node = node.children.setdefault(str(key), PathTrie())
+        node.full = True
+        node.children = {}
+
+    def merge(self, other: "PathTrie") -> "PathTrie":
+        """Returns a new trie with the paths of both tries"""
+        result = PathTrie()
+        if self.full or other.full:
+            result.full = True
+            return result
+        for key in self.children.keys() | other.children.keys():
+            if key in self.children and key in other.children:
+                result.children[key] = self.children[key].merge(other.children[key])
+            else:
+                result.children[key] = self.children.get(key) or other.children[key]
+        return result
+
+    def get_child(self, key: str) -> "PathTrie | None":
+        """The paths below the key `key` of a dict. None if nothing below it is referenced"""
+        if key not in self._child_cache:
+            child = self.children.get(key)
+            wildcard = self.children.get(WILDCARD)
+            if child is not None and wildcard is not None:
+                child = child.merge(wildcard)
+            self._child_cache[key] = child if child is not None else wildcard
+        return self._child_cache[key]
+
+    def get_element_child(self) -> "PathTrie | None":
+        """The paths below any element of a list. All the elements are kept, so their indexes don't change.
+        None if the paths can't refer to the elements of a list, so they are kept whole
+        """
+        if not self._element_child_computed:
+            element_child = None
+            for key, child in self.children.items():
+                # Other keys can't refer to an element of a list
+                if key != WILDCARD and not key.isdigit():
+                    continue
+                element_child = child if element_child is None else element_child.merge(child)
+            self._element_child = element_child
+            self._element_child_computed = True
+        return self._element_child
+
+    def get_paths(self) -> list[str]:
+        """Returns the paths of the trie in the dot notation used by the config. For example, `.metadata.name`"""
+        if self.full:
+            return ["."]
+        paths = []
+        for key, child in sorted(self.children.items()):
+            escaped_key = key.replace(".", "\\.")
+            paths += [f".{escaped_key}" + (path if path != "." else "") for path in child.get_paths()]
+        return paths
+
+    def project(self, data: Any) -> Any:
+        """Returns a copy of `data` that only contains the referenced paths"""
+        if self.full:
+            return data
+        if isinstance(data, dict):
+            projected = {}
+            for key, value in data.items():
+                child = self.get_child(key)
+                if child is not None:
+                    projected[key] = child.project(value)
+            return projected
+        if isinstance(data, list):
+            element_child = self.get_element_child()
+            if element_child is None:
+                return data
+            return [element_child.project(elem) for elem in data]
+        return data
+
+    def decode(self, raw: bytes | memoryview | str) -> Any:
+        """Decodes the json document `raw`, but only the referenced paths. The rest of the document
+        is skipped without creating any python object
+
+        Raises:
+            ValueError: if `raw` is not a valid json document
+        """
+        if isinstance(raw, str):
+            raw = raw.encode("utf-8")
+        try:
+            value, end = _decode_value(raw, _WHITESPACE.match(raw, 0).end(), self)
+        except IndexError as e:
+            raise ValueError("Unexpected end of the json document") from e
+        if _WHITESPACE.match(raw, end).end() != len(raw):
+            raise ValueError(f"Extra data at position {end} of the json document")
+        return value
+
+
+def _decode_value(raw: bytes | memoryview, idx: int, node: PathTrie) -> tuple[Any, int]:
+    char = raw[idx]
+    if not node.full:
+        if char == ord("{"):
+            return _decode_dict(raw, idx, node)
+        if char == ord("["):
+            element_child = node.get_element_child()
+            if element_child is not None:
+                return _decode_list(raw, idx, element_child)
+    # The whole value is referenced, so it's decoded by the codec
+    end = _skip_value(raw, idx)
+    return codec.loads(raw[idx:end]), end
+
+
+def _decode_dict(raw: bytes | memoryview, idx: int, node: PathTrie) -> tuple[dict, int]:
+    result = {}
+    idx = _WHITESPACE.match(raw, idx + 1).end()
+    if raw[idx] == ord("}"):
+        return result, idx + 1
+    while True:
+        if raw[idx] != _QUOTE:
+            raise ValueError(f"Expected a key at position {idx} of the json document")
+        key_end = _skip_string(raw, idx)
+        raw_key = raw[idx + 1 : key_end - 1]
+        key = codec.loads(raw[idx:key_end]) if _BACKSLASH in raw_key else str(raw_key, "utf-8")
+        idx = _WHITESPACE.match(raw, key_end).end()
+        if raw[idx] != ord(":"):
+            raise ValueError(f"Expected ':' at position {idx} of the json document")
+        idx = _WHITESPACE.match(raw, idx + 1).end()
+        child = node.get_child(key)
+        if child is None:
+            idx = _skip_value(raw, idx)
+        else:
+            result[key], idx = _decode_value(raw, idx, child)
+        idx = _WHITESPACE.match(raw, idx).end()
+        if raw[idx] == ord("}"):
+            return result, idx + 1
+        if raw[idx] != ord(","):
+            raise ValueError(f"Expected ',' or '}}' at position {idx} of the json document")
+        idx = _WHITESPACE.match(raw, idx + 1).end()
+
+
+def _decode_list(raw: bytes | memoryview, idx: int, element_node: PathTrie) -> tuple[list, int]:
+    result = []
+    idx = _WHITESPACE.match(raw, idx + 1).end()
+    if raw[idx] == ord("]"):
+        return result, idx + 1
+    while True:
+        value, idx = _decode_value(raw, idx, element_node)
+        result.append(value)
+        idx = _WHITESPACE.match(raw, idx).end()
+        if raw[idx] == ord("]"):
+            return result, idx + 1
+        if raw[idx] != ord(","):
+            raise ValueError(f"Expected ',' or ']' at position {idx} of the json document")
+        idx = _WHITESPACE.match(raw, idx + 1).end()
+
+
+def _skip_value(raw: bytes | memoryview, idx: int) -> int:
+    """Returns the position right after the json value that starts at `idx`. The content of
+    the value is not validated
+    """
+    char = raw[idx]
+    if char == _QUOTE:
+        return _skip_string(raw, idx)
+    if char not in b"{[":
+        match = _SCALAR.match(raw, idx)
+        if match is None:
+            raise ValueError(f"Invalid value at position {idx} of the json document")
+        return match.end()
+    depth = 0
+    while True:
+        char = raw[idx]
+        if char == _QUOTE:
+            idx = _skip_string(raw, idx)
+        else:
+            depth += 1 if char in b"{[" else -1
+            idx += 1
+            if depth == 0:
+                return idx
+        idx = _SKIPPABLE.match(raw, idx).end()
+
+
+def _skip_string(raw: bytes | memoryview, idx: int) -> int:
+    """Returns the position right after the string that starts at `idx`. It searches the quotes with
+    `bytes.find`, which is much faster than a regex for the long strings, like the data of a ConfigMap
+    """
+    end = idx
+    while True:
+        end = _find_quote(raw, end + 1)
+        if end == -1:
+            raise ValueError(f"Unterminated string at position {idx} of the json document")
+        # The quote is escaped if it's preceded by an odd number of backslashes
+        n_backslashes = 0
+        while raw[end - 1 - n_backslashes] == _BACKSLASH:
+            n_backslashes += 1
+        if n_backslashes % 2 == 0:
+            return end + 1
+
+
+def _find_quote(raw: bytes | memoryview, start: int) -> int:
+    """Returns the position of the first quote from `start`, or -1 if there's none"""
+    if not isinstance(raw, memoryview):
+        return raw.find(b'"', start)
+    # Most of the strings are short, so the first chunks are small
+    chunk_size = 256
+    while start < len(raw):
+        pos = raw[start : start + chunk_size].tobytes().find(b'"')
+        if pos != -1:
+            return start + pos
+        start += chunk_size
+        chunk_size = min(chunk_size * 4, _MAX_CHUNK_SIZE)
+    return -1
+
+
+def get_referenced_paths(webhooks: Iterable[Webhook]) -> PathTrie | None:
+    """Returns the paths of the object under review that the webhooks can read or patch
+
+    Returns:
+        PathTrie | None: The referenced paths. None if some operator can't be analysed,
+        so the whole object must be considered as referenced
+    """
+    trie = PathTrie()
+    try:
+        for webhook in webhooks:
+            for action in webhook.list_actions:
+                _analyse_operator(action.condition, [[()]], trie)
+                for jsonpatch_op in action.list_jpatch_op:
+                    _analyse_jsonpatch(jsonpatch_op, [[()]], [()], trie)
+    except UnsupportedOperator:
+        return None
+    return trie
+
+
+def get_admission_review_paths(webhooks: Iterable[Webhook], include_old_object: bool = False) -> PathTrie:
+    """Returns the paths of an AdmissionReview that must be decoded to process it with `webhooks`:
+    the uid of the request and the paths of the object that the webhooks reference
+
+    Args:
+        webhooks (Iterable[Webhook]): The webhooks that process the request
+        include_old_object (bool, optional): Also decode the operation and the same paths of the `oldObject`,
+        so they can be compared with the ones of the object. Defaults to False.
+    """
+    trie = PathTrie()
+    trie.add(("request", "uid"))
+    object_paths = get_referenced_paths(webhooks)
+    if object_paths is None:
+        trie.add(("request", "object"))
+        return trie
+    trie.children["request"].children["object"] = object_paths
+    if include_old_object:
+        trie.add(("request", "operation"))
+        trie.children["request"].children["oldObject"] = object_paths
+    return trie
+
+
+def _get_elements_paths(paths: list[tuple]) -> list[tuple]:
+    """The paths of the elements obtained when iterating the values found at `paths`. A value can be a list,
+    whose elements are iterated, or a single value that was already extracted from a list by a wildcard
+    """
+    return paths + [path + (WILDCARD,) for path in paths]
+
+
+def _analyse_operator(  # pylint: disable=too-many-return-statements
+    op: operators.Operator, contexts: list[list[tuple]], trie: PathTrie
+) -> list[tuple]:
+    """Adds to `trie` the paths read by `op`
+
+    Args:
+        op (operators.Operator): The operator to analyse
+        contexts (list[list[tuple]]): For each context used to evaluate the operator, the paths
+        in the object where it can come from
+        trie (PathTrie): Where the paths are added
+
+    Returns:
+        list[tuple]: The paths in the object where the value returned by `op` can come from
+    """
+    # A subclass defined somewhere else could read the contexts in a different way
+    if type(op).__module__ != operators.__name__:
+        raise UnsupportedOperator(f"Cannot analyse the operator {type(op).__name__}")
+    if isinstance(op, operators.GetValue):
+        relative_path = []
+        for key in op.path:
+            # An empty key (".") refers to the whole element
+            if key == "":
+                break
+            relative_path.append(key)
+        paths = [base_path + tuple(relative_path) for base_path in contexts[op.context_id]]
+        for path in paths:
+            trie.add(path)
+        return paths
+    if isinstance(op, operators.Const):
+        return []
+    if isinstance(op, operators.BinaryOp):
+        _analyse_operator(op.args, contexts, trie)
+        return []
+    if isinstance(op, operators.UnaryOp):
+        _analyse_operator(op.arg, contexts, trie)
+        return []
+    if isinstance(op, operators.List):
+        paths = []
+        for sub_op in op.list_op:
+            paths += _analyse_operator(sub_op, contexts, trie)
+        return paths
+    if isinstance(op, (operators.ForEach, operators.Filter)):
+        elements_paths = _get_elements_paths(_analyse_operator(op.elements, contexts, trie))
+        paths = _analyse_operator(op.op, contexts + [elements_paths], trie)
+        return paths if isinstance(op, operators.ForEach) else elements_paths
+    if isinstance(op, operators.Contain):
+        _analyse_operator(op.elements, contexts, trie)
+        _analyse_operator(op.elem, contexts, trie)
+        return []
+    raise UnsupportedOperator(f"Cannot analyse the operator {type(op).__name__}")
+
+
+def _analyse_jsonpatch(
+    jsonpatch_op: jsonpatch_helpers.JsonPatchOperator,
+    contexts: list[list[tuple]],
+    prefixes: list[tuple],
+    trie: PathTrie,
+) -> None:
+    """Adds to `trie` the paths read or modified by `jsonpatch_op`. Its paths are relative to `prefixes`"""
+    if type(jsonpatch_op).__module__ != jsonpatch_helpers.__name__:
+        raise UnsupportedOperator(f"Cannot analyse the patch operation {type(jsonpatch_op).__name__}")
+    if isinstance(jsonpatch_op, jsonpatch_helpers.JsonPatchForEach):
+        elements_paths = _get_elements_paths(_analyse_operator(jsonpatch_op.op_with_ref, contexts, trie))
+        for sub_op in jsonpatch_op.list_jsonpatch_op:
+            _analyse_jsonpatch(sub_op, contexts + [elements_paths], elements_paths, trie)
+        return
+    if not isinstance(
+        jsonpatch_op,
+        (
+            jsonpatch_helpers.JsonPatchAdd,
+            jsonpatch_helpers.JsonPatchRemove,
+            jsonpatch_helpers.JsonPatchReplace,
+            jsonpatch_helpers.JsonPatchCopy,
+            jsonpatch_helpers.JsonPatchMove,
+            jsonpatch_helpers.JsonPatchTest,
+            jsonpatch_helpers.JsonPatchExpr,
+        ),
+    ):
+        raise UnsupportedOperator(f"Cannot analyse the patch operation {type(jsonpatch_op).__name__}")
+
+    patch_paths = [jsonpatch_op.path]
+    if isinstance(jsonpatch_op, (jsonpatch_helpers.JsonPatchCopy, jsonpatch_helpers.JsonPatchMove)):
+        patch_paths.append(jsonpatch_op.fromm)
+    for path in patch_paths:
+        if path and path[0] == "$":
+            trie.add(path[1:])
+            continue
+        for prefix in prefixes:
+            trie.add(prefix + tuple(path))
+    if isinstance(jsonpatch_op, jsonpatch_helpers.JsonPatchExpr):
+        _analyse_operator(jsonpatch_op.value, contexts, trie)
@@ -0,0 +1,97 @@
+import logging
+import os
+import signal
+import time
+from typing import Callable
+
+
+class Supervisor:
+    def __init__(self, n_workers: int, run_worker: Callable[[], None], min_worker_uptime: float = 1) -> None:
+        """Forks `n_workers` processes that execute `run_worker` and keeps them running until
+        the supervisor receives a SIGTERM or SIGINT. In that case, it forwards a SIGTERM to all the
+        workers and waits for them to finish. If a worker dies for any other reason, it's replaced
+        by a new one.
+
+        The supervisor doesn't do any work apart from managing the workers, so it doesn't create
+        any thread before forking. Each worker must create its own resources (server, config loader, etc.).
+
+        Args:
+            n_workers (int): The number of worker processes
+            run_worker (Callable[[], None]): The function executed by each worker. The worker
+            process finishes when this function returns
+            min_worker_uptime (float, optional): If a worker dies before running this amount
+            of seconds, the supervisor waits the same amount of time before replacing it, so
+            a worker that crashes at startup doesn't turn into a busy loop. Defaults to 1.
+        """
+        if n_workers < 1:
+            raise ValueError(f"The number of workers must be at least 1, but got {n_workers}")
+        self.n_workers = n_workers
+        self.run_worker = run_worker
+        self.min_worker_uptime = min_worker_uptime
+        # pid -> time when the worker was started
+        self.workers: dict[int, float] = {}
+        self.stopping = False
+
+    def run(self) -> int:
+        """Starts the workers and supervises them until all of them finish after a SIGTERM or SIGINT
+
+        Returns:
+            int: The exit code for the supervisor process
+        """
+        signal.signal(signal.SIGTERM, self._stop_workers)
+        signal.signal(signal.SIGINT, self._stop_workers)
+
+        for _ in range(self.n_workers):
+            self._spawn_worker()
+
+        while self.workers:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            start_time = self.workers.pop(pid, None)
+            if start_time is None or self.stopping:
+                continue
+
+            logging.error(f"Worker {pid} finished unexpectedly with status {os.waitstatus_to_exitcode(status)}")
+            if time.monotonic() - start_time < self.min_worker_uptime:
+                time.sleep(self.min_worker_uptime)
+            # A signal may have arrived while sleeping
+            if not self.stopping:
+                self._spawn_worker()
+
+        logging.info("All the workers have finished")
+        return 0
+
+    def _spawn_worker(self) -> None:
+        # Block the signals while forking, so the supervisor doesn't miss the new worker when it
+        # forwards them and the worker doesn't execute the signal handlers of the supervisor
+        stop_signals = {signal.SIGTERM, signal.SIGINT}
+        signal.pthread_sigmask(signal.SIG_BLOCK, stop_signals)
+        pid = os.fork()
+        if pid == 0:
+            # This is the worker process. It never returns from this function
+            exit_code = 0
+            try:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+                signal.pthread_sigmask(signal.SIG_UNBLOCK, stop_signals)
+                self.run_worker()
+            except BaseException:  # pylint: disable=broad-exception-caught
+                logging.error("Worker failed", exc_info=True)
+                exit_code = 1
+            finally:
+                os._exit(exit_code)  # pylint: disable=protected-access
+
+        self.workers[pid] = time.monotonic()
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, stop_signals)
+        logging.info(f"Started worker {pid}")
+
+    def _stop_workers(self, *args) -> None:  # pylint: disable=unused-argument
+        logging.info("Stopping all the workers")
+        self.stopping = True
+        for pid in self.workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
@@ -0,0 +1,95 @@
+import logging
+import os
+import ssl
+import threading
+
+
+def create_ssl_context(certfile: str, keyfile: str, alpn_protocols: list[str] | None = None) -> ssl.SSLContext:
+    """Creates the TLS configuration for the server. It negotiates TLS 1.3 when the client supports it
+    (falling back to TLS 1.2) and issues session tickets, so the clients can resume a previous session
+    instead of doing a full handshake. If `alpn_protocols` is set, the application protocol (like "h2"
+    for HTTP/2) is negotiated during the handshake.
+    """
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    # Number of TLS 1.3 session tickets sent to the client after each handshake. For TLS 1.2,
+    # the tickets are enabled by default
+    context.num_tickets = 2
+    context.load_cert_chain(certfile, keyfile)
+    if alpn_protocols:
+        context.set_alpn_protocols(alpn_protocols)
+    return context
+
+
+class TlsContextReloader(threading.Thread):  # pylint: disable=too-many-instance-attributes
+    def __init__(
+        self, certfile: str, keyfile: str, refresh_period: float, alpn_protocols: list[str] | None = None
+    ) -> None:
+        """A class that reloads the certificate and key files in a separate thread when they change,
+        so they can be rotated without restarting the server.
+
+        The server must use `listening_context` to accept the connections. During each handshake, this
+        context is swapped by the most recent one. The connections already established keep using the
+        context they were created with, so nothing is dropped when the certificate changes. The session
+        tickets are always handled by `listening_context`, so the sessions can be resumed even after a
+        certificate rotation.
+
+        Args:
+            certfile (str): The certificate file for the TLS connection
+            keyfile (str): The private key file for the TLS connection
+            refresh_period (float): The time it waits to check again if the files have changed
+            alpn_protocols (list[str] | None, optional): The application protocols offered to the clients,
+            in order of preference. Defaults to None.
+        """
+        super().__init__(name="tls-reloader", daemon=True)
+        self.certfile = certfile
+        self.keyfile = keyfile
+        self.refresh_period = refresh_period
+        self.alpn_protocols = alpn_protocols
+        self.files_signature = self._get_files_signature()
+        self.context = create_ssl_context(certfile, keyfile, alpn_protocols)
+        self.listening_context = create_ssl_context(certfile, keyfile, alpn_protocols)
+        self.listening_context.sni_callback = self._select_context
+        self.stop_event = threading.Event()
+
+    def _select_context(
+        self, ssl_socket: ssl.SSLObject | ssl.SSLSocket, _server_name: str | None, _context: ssl.SSLContext
+    ) -> None:
+        # It's called during the handshake, even if the client doesn't use SNI
+        ssl_socket.context = self.context
+
+    def _get_files_signature(self) -> tuple:
+        """A value that changes when any of the files is modified. `os.stat` follows the symlinks,
+        so it also detects when a mounted secret swaps the files it points to
+        """
+        signature = []
+        for file in [self.certfile, self.keyfile]:
+            stat = os.stat(file)
+            signature.append((stat.st_ino, stat.st_size, stat.st_mtime_ns))
+        return tuple(signature)
+
+    def reload_if_changed(self) -> bool:
+        """Creates a new context if the certificate or key files have changed
+
+        Returns:
+            bool: True if the context has been replaced
+        """
+        files_signature = self._get_files_signature()
+        if files_signature == self.files_signature:
+            return False
+        # If the load fails (for example, we've read the new certificate, but the old key), the
+        # signature is not updated, so it's tried again in the next iteration
+        self.context = create_ssl_context(self.certfile, self.keyfile, self.alpn_protocols)
+        self.files_signature = files_signature
+        logging.info(f"Reloaded the TLS certificate {self.certfile}")
+        return True
+
+    def run(self) -> None:
+        while not self.stop_event.wait(self.refresh_period):
+            try:
+                self.reload_if_changed()
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                logging.error(e, exc_info=True)
+
+    def stop(self) -> None:
+        self.stop_event.set()
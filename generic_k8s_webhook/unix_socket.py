@@ -0,0 +1,62 @@
+import errno
+import logging
+import os
+import socket
+import stat
+
+# Prefix of the addresses of `--listen` that are a Unix domain socket
+UNIX_PREFIX = "unix:"
+
+
+def parse_listen_address(address: str) -> str:
+    """Returns the path of the Unix domain socket from an address like "unix:/run/webhook.sock" """
+    if not address.startswith(UNIX_PREFIX) or len(address) == len(UNIX_PREFIX):
+        raise ValueError(f"Invalid address {address}. It must be like {UNIX_PREFIX}/path/to/file.sock")
+    return address[len(UNIX_PREFIX) :]
+
+
+def bind_unix_socket(sock: socket.socket, path: str, mode: int) -> None:
+    """Binds `sock` to the Unix domain socket file `path`, with the permissions `mode`. A socket file left
+    behind by a previous server that didn't stop cleanly is replaced, but not one that is still in use
+
+    Args:
+        sock (socket.socket): An AF_UNIX socket that isn't listening yet
+        path (str): Where the socket file is created
+        mode (int): The permissions of the socket file. A client needs write permission to connect
+    """
+    try:
+        file_mode = os.lstat(path).st_mode
+    except FileNotFoundError:
+        pass
+    else:
+        if not stat.S_ISSOCK(file_mode):
+            raise ValueError(f"Cannot listen on {path}, since it already exists and it's not a socket")
+        if _is_in_use(path):
+            raise OSError(errno.EADDRINUSE, f"Another server is already listening on {path}")
+        logging.warning(f"Removing the socket {path} left behind by a previous server")
+        os.unlink(path)
+    sock.bind(path)
+    # The socket isn't listening yet, so no client can connect before it has the right permissions
+    os.chmod(path, mode)
+
+
+def remove_unix_socket(path: str) -> None:
+    """Removes the socket file once the server has stopped listening on it"""
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def get_client_address(path: str) -> tuple[str]:
+    """The clients of a Unix domain socket don't have an address, so they are identified by the socket"""
+    return (f"{UNIX_PREFIX}{path}",)
+
+
+def _is_in_use(path: str) -> bool:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            return False
+    return True
@@ -1,5 +1,6 @@
 import jsonpatch
 
+from generic_k8s_webhook.deadline import check_deadline, deadline
 from generic_k8s_webhook.jsonpatch_helpers import JsonPatchOperator
 from generic_k8s_webhook.operators import Operator
 
@@ -18,25 +19,32 @@ class Action:
         # 2. Update the json_payload based on that patch
         # 3. Extract the raw patch, so we can merge later all the patches into a single JsonPatch object
         list_raw_patches = []
-        for jpatch_op in self.list_jpatch_op:
+        for i, jpatch_op in enumerate(self.list_jpatch_op):
+            check_deadline()
             jpatch = jpatch_op.generate_patch([json_payload])
-            json_payload = jpatch.apply(json_payload)
+            # Applying the patch copies the whole payload, so it's only done if there's another patch after it
+            if i < len(self.list_jpatch_op) - 1:
+                json_payload = jpatch.apply(json_payload)
             list_raw_patches.extend(jpatch.patch)
 
         return jsonpatch.JsonPatch(list_raw_patches)
 
 
 class Webhook:
-    def __init__(self, name: str, path: str, list_actions: list[Action]) -> None:
+    def __init__(self, name: str, path: str, list_actions: list[Action], timeout: float | None = None) -> None:
         self.name = name
         self.path = path
         self.list_actions = list_actions
+        # Max time, in seconds, to evaluate this webhook. If it's exceeded, `process_manifest` raises DeadlineExceeded
+        self.timeout = timeout
 
     def process_manifest(self, manifest: dict) -> tuple[bool, jsonpatch.JsonPatch | None]:
-        for action in self.list_actions:
-            if action.check_condition(manifest):
-                patches = action.get_patches(manifest)
-                return action.accept, patches
+        with deadline(self.timeout):
+            for action in self.list_actions:
+                check_deadline()
+                if action.check_condition(manifest):
+                    patches = action.get_patches(manifest)
+                    return action.accept, patches
 
         # If no condition is met, we'll accept the manifest without any patch
         return True, jsonpatch.JsonPatch([])
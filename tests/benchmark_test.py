@@ -0,0 +1,225 @@
+import base64
+import http.client
+import json
+import logging
+import os
+import ssl
+import threading
+import time
+import tracemalloc
+
+import jsonpatch
+import pytest
+import yaml
+from test_utils import get_free_port, load_test_case, wait_for_server_ready
+
+from generic_k8s_webhook import codec
+from generic_k8s_webhook.admission import AdmissionProcessor
+from generic_k8s_webhook.config_loader import ConfigLoader
+from generic_k8s_webhook.http_server import Server
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+HTTP_SERVER_TEST_DATA_DIR = os.path.join(SCRIPT_DIR, "http_server_test_data")
+CERT_FILE = os.path.join(SCRIPT_DIR, "tls", "cert.pem")
+KEY_FILE = os.path.join(SCRIPT_DIR, "tls", "key.pem")
+
+N_REQUESTS = 100
+
+
+def get_client_ssl_context() -> ssl.SSLContext:
+    # The test certificate is self-signed
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+def measure_requests_per_second(port: int, req: dict, expected_response: dict, reuse_conn: bool) -> float:
+    context = get_client_ssl_context()
+    body = json.dumps(req["body"])
+    conn = None
+    start = time.perf_counter()
+    for _ in range(N_REQUESTS):
+        if conn is None:
+            conn = http.client.HTTPSConnection("localhost", port, context=context, timeout=1)
+        conn.request("POST", req["path"], body=body, headers={"Content-Type": "application/json"})
+        assert json.loads(conn.getresponse().read()) == expected_response
+        if not reuse_conn:
+            conn.close()
+            conn = None
+    elapsed = time.perf_counter() - start
+    if conn:
+        conn.close()
+    return N_REQUESTS / elapsed
+
+
+@pytest.mark.parametrize("engine", Server.ENGINES)
+def test_benchmark_keep_alive(engine, tmp_path):
+    list_cases = load_test_case(os.path.join(HTTP_SERVER_TEST_DATA_DIR, "test_case_1.yaml"))
+    webhook_config_file = tmp_path / "webhook_config.yaml"
+
+    _, req, webhook_config, expected_response = list_cases[0]
+    with open(webhook_config_file, "w") as f:
+        yaml.safe_dump(webhook_config, f)
+
+    port = get_free_port()
+    server = Server(port, CERT_FILE, KEY_FILE, webhook_config_file, engine=engine)
+    t = threading.Thread(target=server.start)
+    t.start()
+    wait_for_server_ready(port, tls=True)
+
+    rps_new_conn = measure_requests_per_second(port, req, expected_response, reuse_conn=False)
+    rps_reused_conn = measure_requests_per_second(port, req, expected_response, reuse_conn=True)
+    # Reusing the connection avoids a TLS handshake per request. The numbers are only logged, since
+    # comparing wall-clock times is flaky on a loaded machine
+    logging.info(
+        f"{engine} engine: {rps_new_conn:.1f} requests/s with a new connection per request, "
+        + f"{rps_reused_conn:.1f} requests/s reusing the connection"
+    )
+
+    server.stop()
+    t.join()
+
+
+def get_big_admission_request() -> dict:
+    """An admission request for a pod with many containers, like the ones that dominate the processing time"""
+    containers = [
+        {
+            "name": f"container-{i}",
+            "image": f"registry.example.com/image-{i}:1.0.0",
+            "env": [{"name": f"VAR_{j}", "value": f"value-{j}" * 4} for j in range(50)],
+            "resources": {"requests": {"cpu": "100m", "memory": "128Mi"}},
+        }
+        for i in range(50)
+    ]
+    pod = {"apiVersion": "v1", "kind": "Pod", "metadata": {"name": "big-pod"}, "spec": {"containers": containers}}
+    return {"apiVersion": "admission.k8s.io/v1", "kind": "AdmissionReview", "request": {"uid": "1234", "object": pod}}
+
+
+def measure_seconds_per_call(func, n_calls: int = 50) -> float:
+    start = time.perf_counter()
+    for _ in range(n_calls):
+        func()
+    return (time.perf_counter() - start) / n_calls
+
+
+def measure_peak_memory(func) -> int:
+    """The max number of bytes allocated while running `func`"""
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def test_benchmark_codec(monkeypatch, tmp_path):
+    webhook_config_file = tmp_path / "webhook_config.yaml"
+    webhook_config = {
+        "apiVersion": "generic-webhook/v1beta1",
+        "kind": "GenericWebhookConfig",
+        "webhooks": [
+            {
+                "name": "add-label",
+                "path": "/add-label",
+                "actions": [{"patch": [{"op": "add", "path": ".metadata.labels.mutated", "value": "true"}]}],
+            }
+        ],
+    }
+    with open(webhook_config_file, "w") as f:
+        yaml.safe_dump(webhook_config, f)
+    processor = AdmissionProcessor(ConfigLoader(webhook_config_file, 1))
+    raw_body = json.dumps(get_big_admission_request()).encode("utf-8")
+
+    # Generating the response from a template vs building a dict and encoding it with the standard library
+    patch = jsonpatch.JsonPatch([{"op": "add", "path": "/metadata/labels", "value": {"mutated": "true"}}])
+
+    def generate_response_from_dict():
+        response = {
+            "apiVersion": "admission.k8s.io/v1",
+            "kind": "AdmissionReview",
+            "response": {"uid": "1234", "allowed": True},
+        }
+        response["response"]["patchType"] = "JSONPatch"
+        response["response"]["patch"] = base64.b64encode(patch.to_string().encode("utf-8")).decode("utf-8")
+        return json.dumps(response).encode("utf-8")
+
+    def generate_response_from_template():
+        # pylint: disable=protected-access
+        return processor._generate_response("1234", True, codec.dumps(patch.patch))
+
+    def decode_response(raw_response: bytes) -> dict:
+        response = json.loads(raw_response)
+        response["response"]["patch"] = json.loads(base64.b64decode(response["response"]["patch"]))
+        return response
+
+    assert decode_response(generate_response_from_dict()) == decode_response(generate_response_from_template())
+    dict_seconds = measure_seconds_per_call(generate_response_from_dict, 5000)
+    template_seconds = measure_seconds_per_call(generate_response_from_template, 5000)
+    # Only logged, since comparing wall-clock times is flaky on a loaded machine
+    logging.info(f"Response from a dict: {dict_seconds * 1e6:.1f} us, from a template: {template_seconds * 1e6:.1f} us")
+
+    # The whole processing of a big request, with the fastest JSON library installed vs the standard library.
+    # The difference depends on the library installed, so it's only logged
+    default_seconds = measure_seconds_per_call(lambda: processor.process_post("/add-label", raw_body, "client"))
+    monkeypatch.setattr(codec, "orjson", None)
+    json_seconds = measure_seconds_per_call(lambda: processor.process_post("/add-label", raw_body, "client"))
+    logging.info(
+        f"Request of {len(raw_body)} bytes: {default_seconds * 1e3:.2f} ms with {codec.BACKEND}, "
+        + f"{json_seconds * 1e3:.2f} ms with json"
+    )
+
+
+def test_benchmark_projected_decoding(tmp_path):
+    webhook_config_file = tmp_path / "webhook_config.yaml"
+    webhook_config = {
+        "apiVersion": "generic-webhook/v1beta1",
+        "kind": "GenericWebhookConfig",
+        "webhooks": [
+            {
+                "name": "label-configmaps",
+                "path": "/label-configmaps",
+                "actions": [
+                    {
+                        "condition": '.kind == "ConfigMap" && .metadata.namespace != "kube-system"',
+                        "patch": [{"op": "add", "path": ".metadata.labels.checked", "value": "true"}],
+                    }
+                ],
+            }
+        ],
+    }
+    with open(webhook_config_file, "w") as f:
+        yaml.safe_dump(webhook_config, f)
+    config_loader = ConfigLoader(webhook_config_file, 1)
+    processor = AdmissionProcessor(config_loader)
+    projected_processor = AdmissionProcessor(config_loader, projected_decoding=True)
+
+    # A ConfigMap with 1MB of data, which the webhook never reads
+    config_map = {
+        "apiVersion": "v1",
+        "kind": "ConfigMap",
+        "metadata": {"name": "big", "namespace": "default", "labels": {"app": "big"}},
+        "data": {f"file-{i}.json": json.dumps({"key": "value" * 2000}) for i in range(100)},
+    }
+    raw_body = json.dumps(
+        {
+            "apiVersion": "admission.k8s.io/v1",
+            "kind": "AdmissionReview",
+            "request": {"uid": "1234", "object": config_map},
+        }
+    ).encode("utf-8")
+
+    def process(admission_processor: AdmissionProcessor) -> bytes:
+        return admission_processor.process_post("/label-configmaps", raw_body, "client").body
+
+    assert process(projected_processor) == process(processor)
+    default_seconds = measure_seconds_per_call(lambda: process(processor))
+    projected_seconds = measure_seconds_per_call(lambda: process(projected_processor))
+    default_memory = measure_peak_memory(lambda: process(processor))
+    projected_memory = measure_peak_memory(lambda: process(projected_processor))
+    logging.info(
+        f"Request of {len(raw_body)} bytes: {default_seconds * 1e3:.2f} ms and {default_memory} bytes of peak memory "
+        + f"with {codec.BACKEND}, {projected_seconds * 1e3:.2f} ms and {projected_memory} bytes with the projection"
+    )
+    # The body itself is always in memory, but none of the data of the ConfigMap is decoded
+    assert projected_memory < default_memory
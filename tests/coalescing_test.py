@@ -0,0 +1,102 @@
+import threading
+import time
+
+import pytest
+
+from generic_k8s_webhook.coalescing import RequestCoalescer
+from generic_k8s_webhook.deadline import deadline
+from generic_k8s_webhook.decision_cache import DecisionKeys
+from generic_k8s_webhook.metrics import MetricsRegistry
+
+KEY = (1, "/path", b"digest")
+DECISION = (True, b"", ["webhook"])
+
+
+def _start_followers(coalescer: RequestCoalescer, func, n_followers: int, timeout: float | None = None):
+    """Starts the requests that arrive while the leader is being evaluated. Returns their threads and decisions"""
+    decisions = []
+
+    def follower():
+        with deadline(timeout):
+            decisions.append(coalescer.evaluate(KEY, func))
+
+    threads = [threading.Thread(target=follower) for _ in range(n_followers)]
+    for t in threads:
+        t.start()
+    return threads, decisions
+
+
+def test_identical_requests_share_the_evaluation():
+    metrics = MetricsRegistry()
+    coalescer = RequestCoalescer(DecisionKeys(), metrics)
+    leader_started, release_leader = threading.Event(), threading.Event()
+    calls = []
+
+    def evaluate():
+        calls.append(1)
+        leader_started.set()
+        release_leader.wait()
+        return DECISION
+
+    leader, leader_decisions = _start_followers(coalescer, evaluate, 1)
+    leader_started.wait()
+    followers, decisions = _start_followers(coalescer, evaluate, 4)
+    # Give the followers time to start waiting for the leader
+    time.sleep(0.1)
+    release_leader.set()
+    for t in leader + followers:
+        t.join()
+
+    assert len(calls) == 1
+    assert leader_decisions + decisions == [DECISION] * 5
+    # Once the leader has finished, the next request is evaluated again
+    assert coalescer.evaluate(KEY, lambda: (False, b"", [])) == (False, b"", [])
+    rendered = metrics.render()
+    assert 'generic_webhook_request_coalescing_total{result="leader"} 2' in rendered
+    assert 'generic_webhook_request_coalescing_total{result="coalesced"} 4' in rendered
+
+
+def test_followers_evaluate_on_their_own_when_the_leader_fails():
+    metrics = MetricsRegistry()
+    coalescer = RequestCoalescer(DecisionKeys(), metrics)
+    leader_started, release_leader = threading.Event(), threading.Event()
+
+    def failing_evaluation():
+        leader_started.set()
+        release_leader.wait()
+        raise RuntimeError("failed")
+
+    def leader():
+        with pytest.raises(RuntimeError):
+            coalescer.evaluate(KEY, failing_evaluation)
+
+    t = threading.Thread(target=leader)
+    t.start()
+    leader_started.wait()
+    followers, decisions = _start_followers(coalescer, lambda: DECISION, 2)
+    time.sleep(0.1)
+    release_leader.set()
+    for thread in [t] + followers:
+        thread.join()
+
+    assert decisions == [DECISION] * 2
+    assert 'generic_webhook_request_coalescing_total{result="fallback"} 2' in metrics.render()
+
+
+def test_followers_do_not_wait_longer_than_their_deadline():
+    coalescer = RequestCoalescer(DecisionKeys())
+    leader_started, release_leader = threading.Event(), threading.Event()
+
+    def slow_evaluation():
+        leader_started.set()
+        release_leader.wait()
+        return DECISION
+
+    leader, _ = _start_followers(coalescer, slow_evaluation, 1)
+    leader_started.wait()
+    followers, decisions = _start_followers(coalescer, lambda: (False, b"", []), 1, timeout=0.05)
+    followers[0].join(timeout=5)
+    # The follower gave up on the leader, which is still being evaluated
+    assert decisions == [(False, b"", [])]
+    release_leader.set()
+    leader[0].join()
@@ -0,0 +1,54 @@
+import json
+
+import pytest
+
+from generic_k8s_webhook import codec
+
+
+@pytest.fixture(params=["default", "json"])
+def backend(request, monkeypatch):
+    # "default" uses the fastest library installed and "json" forces the fallback to the standard library
+    if request.param == "json":
+        monkeypatch.setattr(codec, "orjson", None)
+    return request.param
+
+
+@pytest.mark.parametrize(
+    "obj",
+    [
+        {"kind": "Pod", "metadata": {"name": "my-pod", "labels": {"app": "ñ"}}, "spec": {"replicas": 3}},
+        [{"op": "add", "path": "/metadata/labels/a~1b", "value": [1, 2.5, True, None]}],
+        # Bigger than 64 bits, which orjson decodes as floats
+        {"value": 2**70 + 1, "negative": -(2**70) - 1},
+        {"value": 9223372036854775807, "string": "digits 12345678901234567890 in a string"},
+    ],
+)
+def test_roundtrip(obj, backend):
+    encoded = codec.dumps(obj)
+    assert isinstance(encoded, bytes)
+    assert b": " not in encoded and b", " not in encoded
+    assert json.loads(encoded) == obj
+    assert codec.loads(encoded) == obj
+    assert codec.loads(encoded.decode("utf-8")) == obj
+
+
+def test_non_string_keys(backend):
+    assert json.loads(codec.dumps({1: "a"})) == {"1": "a"}
+
+
+def test_sort_keys(backend):
+    obj = {"spec": {"b": 1, "a": [{"y": 1, "x": 2}]}, "kind": "Pod"}
+    reordered = {"kind": "Pod", "spec": {"a": [{"x": 2, "y": 1}], "b": 1}}
+    assert codec.dumps(obj, sort_keys=True) == codec.dumps(reordered, sort_keys=True)
+    assert json.loads(codec.dumps(obj, sort_keys=True)) == obj
+
+
+def test_invalid_json(backend):
+    with pytest.raises(ValueError):
+        codec.loads(b"{invalid")
+
+
+def test_long_number_split_between_chunks(backend, monkeypatch):
+    monkeypatch.setattr(codec, "_CHUNK_SIZE", 16)
+    raw = b'{"padding": "xxx", "value": ' + str(2**70 + 1).encode("ascii") + b"}"
+    assert codec.loads(memoryview(raw))["value"] == 2**70 + 1
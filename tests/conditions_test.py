@@ -1,3 +1,4 @@
+import json
 import os
 
 import pytest
@@ -5,6 +6,7 @@ import yaml
 from test_utils import expand_schemas
 
 from generic_k8s_webhook.config_parser.entrypoint import GenericWebhookConfigManifest
+from generic_k8s_webhook.path_analysis import get_referenced_paths
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 CONDITIONS_YAML = os.path.join(SCRIPT_DIR, "conditions_test.yaml")
@@ -42,3 +44,20 @@ def test_all(name, schema, condition, context, expected_result):
     action = gwcm.list_webhook_config[0].list_actions[0]
     result = action.condition.get_value(context)
     assert result == expected_result
+
+
+@pytest.mark.parametrize(("name", "schema", "condition", "context", "expected_result"), _parse_tests())
+def test_projected_context(name, schema, condition, context, expected_result):
+    """The result of the condition must be the same when the context only has the referenced paths"""
+    raw_config = {
+        "apiVersion": f"generic-webhook/{schema}",
+        "kind": "GenericWebhookConfig",
+        "webhooks": [{"name": "test-webhook", "path": "test-path", "actions": [{"condition": condition}]}],
+    }
+    gwcm = GenericWebhookConfigManifest(raw_config)
+    referenced_paths = get_referenced_paths(gwcm.list_webhook_config)
+    assert referenced_paths is not None
+    # The referenced paths are relative to the object under review, which is the first context
+    projected_context = [referenced_paths.decode(json.dumps(context[0]))] + context[1:]
+    action = gwcm.list_webhook_config[0].list_actions[0]
+    assert action.condition.get_value(projected_context) == expected_result
@@ -0,0 +1,101 @@
+import os
+
+import pytest
+from test_utils import write_configmap_version
+
+from generic_k8s_webhook import config_cache
+from generic_k8s_webhook.config_cache import CompiledConfigCache
+from generic_k8s_webhook.config_loader import ConfigLoader
+from generic_k8s_webhook.metrics import MetricsRegistry
+
+
+def _load_config(config_dir, cache_dir):
+    """Starts a new server, from the point of view of the config. Returns its config loader and its metrics"""
+    metrics = MetricsRegistry()
+    config_loader = ConfigLoader(str(config_dir / "webhook_config.yaml"), 1, metrics, cache_dir=str(cache_dir))
+    return config_loader, metrics.render()
+
+
+def _get_cache_entries(cache_dir):
+    return sorted(name for name in os.listdir(cache_dir) if name.endswith(config_cache.ENTRY_SUFFIX))
+
+
+def test_servers_share_the_compiled_config(tmp_path):
+    write_configmap_version(tmp_path, "..version_1", "first")
+    cache_dir = tmp_path / "cache"
+
+    _, rendered = _load_config(tmp_path, cache_dir)
+    assert 'generic_webhook_config_cache_lookups_total{result="miss"} 1' in rendered
+    assert 'generic_webhook_config_webhooks_loaded_total{result="parsed"} 1' in rendered
+    assert len(_get_cache_entries(cache_dir)) == 1
+
+    config_loader, rendered = _load_config(tmp_path, cache_dir)
+    assert 'generic_webhook_config_cache_lookups_total{result="hit"} 1' in rendered
+    assert "generic_webhook_config_webhooks_loaded_total{" not in rendered
+    [webhook] = config_loader.get_routes()["/path"]
+    assert webhook.name == "first"
+    allowed, _ = webhook.process_manifest({})
+    assert allowed
+
+    # A different config is another entry
+    write_configmap_version(tmp_path, "..version_2", "second")
+    config_loader, rendered = _load_config(tmp_path, cache_dir)
+    assert 'generic_webhook_config_cache_lookups_total{result="miss"} 1' in rendered
+    assert [webhook.name for webhook in config_loader.get_routes()["/path"]] == ["second"]
+    assert len(_get_cache_entries(cache_dir)) == 2
+
+
+@pytest.mark.parametrize(
+    "corrupt",
+    [
+        lambda data: data[: len(data) // 2],
+        lambda data: data[:-1] + bytes([data[-1] ^ 1]),
+        lambda data: b"",
+        lambda data: b"not a compiled config",
+    ],
+)
+def test_corrupt_entries_are_ignored(corrupt, tmp_path):
+    write_configmap_version(tmp_path, "..version_1", "first")
+    cache_dir = tmp_path / "cache"
+    _load_config(tmp_path, cache_dir)
+    [entry] = _get_cache_entries(cache_dir)
+    with open(cache_dir / entry, "rb") as f:
+        data = f.read()
+    with open(cache_dir / entry, "wb") as f:
+        f.write(corrupt(data))
+
+    config_loader, rendered = _load_config(tmp_path, cache_dir)
+    assert 'generic_webhook_config_cache_lookups_total{result="invalid"} 1' in rendered
+    assert [webhook.name for webhook in config_loader.get_routes()["/path"]] == ["first"]
+    # The config was parsed again and its entry replaced
+    with open(cache_dir / entry, "rb") as f:
+        assert f.read() == data
+    _, rendered = _load_config(tmp_path, cache_dir)
+    assert 'generic_webhook_config_cache_lookups_total{result="hit"} 1' in rendered
+
+
+def test_other_versions_are_not_loaded(tmp_path, monkeypatch):
+    write_configmap_version(tmp_path, "..version_1", "first")
+    cache_dir = tmp_path / "cache"
+    _load_config(tmp_path, cache_dir)
+
+    monkeypatch.setattr(config_cache, "get_code_fingerprint", lambda: "another version")
+    _, rendered = _load_config(tmp_path, cache_dir)
+    assert 'generic_webhook_config_cache_lookups_total{result="miss"} 1' in rendered
+    assert len(_get_cache_entries(cache_dir)) == 2
+
+
+def test_only_the_most_recent_entries_are_kept(tmp_path, monkeypatch):
+    monkeypatch.setattr(config_cache, "MAX_ENTRIES", 2)
+    cache = CompiledConfigCache(str(tmp_path))
+    write_configmap_version(tmp_path, "..version_1", "first")
+    manifest = ConfigLoader(str(tmp_path / "webhook_config.yaml"), 1).get_snapshot().manifest
+    for i in range(3):
+        cache.put(f"config {i}".encode(), manifest)
+        # The entries are sorted by their modification time
+        entry = cache._get_path(f"config {i}".encode())  # pylint: disable=protected-access
+        os.utime(entry, ns=(i * 10**9, i * 10**9))
+
+    assert cache.get(b"config 0") is None
+    assert cache.get(b"config 1") is not None
+    assert cache.get(b"config 2") is not None
@@ -29,3 +29,36 @@ def test_valid_config():
 
     action = webhook.list_actions[0]
     assert action.accept == True
+
+
+def test_unchanged_webhooks_are_reused():
+    def get_raw_config(api_version: str, second_kind: str) -> dict:
+        # Both api versions accept the conditions in this format
+        def is_kind(kind: str) -> dict:
+            return {"equal": [{"getValue": ".kind"}, {"const": kind}]}
+
+        return {
+            "apiVersion": f"generic-webhook/{api_version}",
+            "kind": "GenericWebhookConfig",
+            "webhooks": [
+                {"name": "first", "path": "/first", "actions": [{"condition": is_kind("Pod"), "accept": False}]},
+                {
+                    "name": "second",
+                    "path": "/second",
+                    "actions": [{"condition": is_kind(second_kind), "accept": False}],
+                },
+            ],
+        }
+
+    config = GenericWebhookConfigManifest(get_raw_config("v1beta1", "Service"))
+    assert (config.n_reused_webhooks, config.n_parsed_webhooks) == (0, 2)
+
+    # Only the webhook that has changed is parsed again
+    new_config = GenericWebhookConfigManifest(get_raw_config("v1beta1", "Secret"), config)
+    assert (new_config.n_reused_webhooks, new_config.n_parsed_webhooks) == (1, 1)
+    assert new_config.list_webhook_config[0] is config.list_webhook_config[0]
+    assert new_config.list_webhook_config[1].list_actions[0].check_condition({"kind": "Secret"})
+
+    # A webhook can only be reused with the same api version, which is parsed differently
+    other_version = GenericWebhookConfigManifest(get_raw_config("v1alpha1", "Secret"), new_config)
+    assert (other_version.n_reused_webhooks, other_version.n_parsed_webhooks) == (0, 2)
@@ -0,0 +1,43 @@
+import time
+
+import pytest
+
+from generic_k8s_webhook.deadline import DeadlineExceeded, check_deadline, deadline, parse_duration
+
+
+@pytest.mark.parametrize(
+    ("duration", "expected_seconds"),
+    [("10s", 10), ("1m0s", 60), ("1h2m3s", 3723), ("1.5s", 1.5), ("250ms", 0.25), ("30us", 30e-6)],
+)
+def test_parse_duration(duration, expected_seconds):
+    assert parse_duration(duration) == pytest.approx(expected_seconds)
+
+
+@pytest.mark.parametrize("duration", ["", "10", "s", "10x", "-1s", "10s foo"])
+def test_parse_invalid_duration(duration):
+    with pytest.raises(ValueError):
+        parse_duration(duration)
+
+
+def test_deadline():
+    # Without a deadline, the check never fails
+    check_deadline()
+    with deadline(None):
+        check_deadline()
+
+    with deadline(10):
+        check_deadline()
+        # An inner deadline can reduce the time left
+        with deadline(0.01):
+            time.sleep(0.02)
+            with pytest.raises(DeadlineExceeded):
+                check_deadline()
+        # But the outer deadline is restored when the inner context finishes
+        check_deadline()
+
+    with deadline(0.01):
+        # An inner deadline cannot extend the time left
+        with deadline(10):
+            time.sleep(0.02)
+            with pytest.raises(DeadlineExceeded):
+                check_deadline()
@@ -0,0 +1,107 @@
+import os
+import time
+
+import pytest
+import yaml
+
+from generic_k8s_webhook import operators
+from generic_k8s_webhook.config_parser.entrypoint import GenericWebhookConfigManifest
+from generic_k8s_webhook.decision_cache import DecisionCache
+from generic_k8s_webhook.metrics import MetricsRegistry
+from generic_k8s_webhook.webhook import Action, Webhook
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+EXAMPLES_DIR = os.path.join(SCRIPT_DIR, "../examples")
+
+
+def _load_webhooks(config_file: str) -> list[Webhook]:
+    with open(os.path.join(EXAMPLES_DIR, config_file), "r", encoding="utf-8") as f:
+        return GenericWebhookConfigManifest(yaml.safe_load(f)).list_webhook_config
+
+
+def _service_account(namespace: str, resource_version: str) -> dict:
+    return {
+        "kind": "ServiceAccount",
+        "metadata": {"name": "sa", "namespace": namespace, "resourceVersion": resource_version},
+    }
+
+
+def test_key_only_covers_the_referenced_paths():
+    cache = DecisionCache(10, 60)
+    webhooks = _load_webhooks("check-namespace-sa.yaml")
+    key = cache.get_key(1, "/check-namespace-sa", webhooks, _service_account("default", "1"))
+
+    # The webhook only reads the kind and the namespace
+    other = _service_account("default", "2")
+    other["metadata"]["labels"] = {"app": "test"}
+    assert cache.get_key(1, "/check-namespace-sa", webhooks, other) == key
+    assert cache.get_key(1, "/check-namespace-sa", webhooks, _service_account("kube-system", "1")) != key
+    # The same object with another config or in another path
+    assert cache.get_key(2, "/check-namespace-sa", webhooks, _service_account("default", "1")) != key
+    assert cache.get_key(2, "/other", webhooks, _service_account("default", "1")) != key
+
+
+def test_key_ignores_fields_when_the_webhooks_cannot_be_analysed():
+    class CustomOperator(operators.Const):
+        pass
+
+    webhooks = [Webhook("custom", "/custom", [Action(operators.Not(CustomOperator(True)), [], True)])]
+    cache = DecisionCache(10, 60, ignored_fields=["metadata.resourceVersion"])
+    obj = _service_account("default", "1")
+    key = cache.get_key(1, "/custom", webhooks, obj)
+    assert cache.get_key(1, "/custom", webhooks, _service_account("default", "2")) == key
+    assert cache.get_key(1, "/custom", webhooks, _service_account("kube-system", "1")) != key
+    # The object itself isn't modified
+    assert obj["metadata"]["resourceVersion"] == "1"
+
+
+def test_lru_and_ttl(monkeypatch):
+    metrics = MetricsRegistry()
+    cache = DecisionCache(2, 10, metrics=metrics)
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now)
+    keys = [(1, "/path", bytes([i])) for i in range(3)]
+
+    assert cache.get(keys[0]) is None
+    cache.put(keys[0], (True, b"", ["a"]))
+    cache.put(keys[1], (False, b"", ["a"]))
+    assert cache.get(keys[0]) == (True, b"", ["a"])
+    # The least recently used entry is evicted
+    cache.put(keys[2], (True, b"[]", ["a"]))
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None
+
+    monkeypatch.setattr(time, "monotonic", lambda: now + 11)
+    assert cache.get(keys[0]) is None
+
+    rendered = metrics.render()
+    assert 'generic_webhook_decision_cache_lookups_total{result="hit"} 2' in rendered
+    assert 'generic_webhook_decision_cache_lookups_total{result="miss"} 3' in rendered
+    assert 'generic_webhook_decision_cache_evictions_total{reason="capacity"} 1' in rendered
+    assert 'generic_webhook_decision_cache_evictions_total{reason="expired"} 1' in rendered
+    assert "generic_webhook_decision_cache_entries 1" in rendered
+
+
+def test_new_config_generation_invalidates_the_cache():
+    metrics = MetricsRegistry()
+    cache = DecisionCache(10, 60, metrics=metrics)
+    webhooks = _load_webhooks("check-namespace-sa.yaml")
+    obj = _service_account("default", "1")
+    key = cache.get_key(1, "/check-namespace-sa", webhooks, obj)
+    cache.put(key, (True, b"", ["check-namespace-sa"]))
+    assert cache.get(key) is not None
+
+    new_key = cache.get_key(2, "/check-namespace-sa", webhooks, obj)
+    assert cache.get(key) is None
+    assert cache.get(new_key) is None
+    # A decision computed with the old config isn't stored
+    cache.put(key, (True, b"", ["check-namespace-sa"]))
+    assert cache.get(key) is None
+    assert 'generic_webhook_decision_cache_evictions_total{reason="config_reload"} 1' in metrics.render()
+
+
+def test_invalid_parameters():
+    with pytest.raises(ValueError):
+        DecisionCache(0, 60)
+    with pytest.raises(ValueError):
+        DecisionCache(10, 0)
@@ -19,11 +19,13 @@ MAIN_PY = os.path.join(SCRIPT_DIR, "../generic_k8s_webhook/main.py")
 
 
 class ServerShell:
-    def __init__(self, webhook_config_file: str, port: int, tls: bool) -> None:
+    def __init__(self, webhook_config_file: str, port: int, tls: bool, extra_args: str = "") -> None:
         tls_args = ""
         if tls:
             tls_args = f"--cert-file {CERT_FILE} --key-file {KEY_FILE}"
-        self.cmd = f"poetry run python3 {MAIN_PY} --config {webhook_config_file} server --port {port} {tls_args}"
+        self.cmd = (
+            f"poetry run python3 {MAIN_PY} --config {webhook_config_file} server --port {port} {tls_args} {extra_args}"
+        )
         self.process: subprocess.Popen
 
     def start(self):
@@ -71,6 +73,31 @@ def test_http_server_e2e(name_test, req, webhook_config, expected_response, tls,
     t.join()
 
 
+def test_http_server_e2e_multiple_workers(tmp_path):
+    list_cases = load_test_case(os.path.join(HTTP_SERVER_TEST_DATA_DIR, "test_case_1.yaml"))
+    webhook_config_file = tmp_path / "webhook_config.yaml"
+
+    _, _, webhook_config, _ = list_cases[0]
+    with open(webhook_config_file, "w") as f:
+        yaml.safe_dump(webhook_config, f)
+
+    port = get_free_port()
+    server_shell = ServerShell(webhook_config_file, port, tls=False, extra_args="--workers 2")
+    t = threading.Thread(target=server_shell.start)
+    t.start()
+    wait_for_server_ready(port)
+
+    # Send several requests, so (most likely) both workers answer some of them
+    for _, req, _, expected_response in list_cases * 5:
+        url = f"http://localhost:{port}{req['path']}"
+        response = requests.post(url, json=req["body"], timeout=1)
+        assert json.loads(response.content.decode("utf-8")) == expected_response
+
+    server_shell.stop()
+    server_shell.wait_to_finish()
+    t.join()
+
+
 def test_cli_program_version():
     cmd = f"poetry run python3 {MAIN_PY} --version"
     subprocess.run(cmd, shell=True, check=True)
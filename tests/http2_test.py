@@ -0,0 +1,175 @@
+import json
+import os
+import socket
+import ssl
+import threading
+import time
+
+import pytest
+import yaml
+from test_utils import get_free_port, load_test_case, wait_for_server_ready
+
+from generic_k8s_webhook.http_server import Server
+
+h2_config = pytest.importorskip("h2.config")
+h2_connection = pytest.importorskip("h2.connection")
+h2_errors = pytest.importorskip("h2.errors")
+h2_events = pytest.importorskip("h2.events")
+h2_settings = pytest.importorskip("h2.settings")
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+HTTP_SERVER_TEST_DATA_DIR = os.path.join(SCRIPT_DIR, "http_server_test_data")
+CERT_FILE = os.path.join(SCRIPT_DIR, "tls", "cert.pem")
+KEY_FILE = os.path.join(SCRIPT_DIR, "tls", "key.pem")
+
+
+class Http2Client:
+    def __init__(self, sock: socket.socket, settings: dict | None = None) -> None:
+        """A minimal HTTP/2 client that sends several requests at the same time through `sock`"""
+        self.sock = sock
+        self.conn = h2_connection.H2Connection(h2_config.H2Configuration(client_side=True, header_encoding="utf-8"))
+        self.conn.initiate_connection()
+        if settings:
+            self.conn.update_settings(settings)
+        self.sock.sendall(self.conn.data_to_send())
+        # The error code of each stream reset by the server
+        self.reset_streams: dict[int, int] = {}
+
+    def post(self, requests: list[tuple[str, bytes, dict]]) -> list[tuple[dict, bytes]]:
+        """Sends all the requests (path, body and extra headers) before reading any response
+
+        Returns:
+            list[tuple[dict, bytes]]: The headers and the body of each response, in the same order
+        """
+        stream_ids = []
+        for path, body, extra_headers in requests:
+            stream_id = self.conn.get_next_available_stream_id()
+            headers = [(":method", "POST"), (":path", path), (":scheme", "https"), (":authority", "localhost")]
+            self.conn.send_headers(stream_id, headers + list(extra_headers.items()))
+            self.conn.send_data(stream_id, body, end_stream=True)
+            stream_ids.append(stream_id)
+        self.sock.sendall(self.conn.data_to_send())
+
+        responses = {stream_id: [{}, b""] for stream_id in stream_ids}
+        pending = set(stream_ids)
+        while pending:
+            data = self.sock.recv(65536)
+            assert data, "The server closed the connection"
+            for event in self.conn.receive_data(data):
+                if isinstance(event, h2_events.ResponseReceived):
+                    responses[event.stream_id][0] = dict(event.headers)
+                elif isinstance(event, h2_events.DataReceived):
+                    responses[event.stream_id][1] += event.data
+                    self.conn.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+                elif isinstance(event, h2_events.StreamEnded):
+                    pending.discard(event.stream_id)
+                elif isinstance(event, h2_events.StreamReset):
+                    self.reset_streams[event.stream_id] = event.error_code
+                    pending.discard(event.stream_id)
+            self.sock.sendall(self.conn.data_to_send())
+        return [tuple(responses[stream_id]) for stream_id in stream_ids]
+
+
+@pytest.fixture
+def start_server(tmp_path):
+    """Starts HTTP/2 servers with the given options and stops them at the end of the test, even if it fails"""
+    list_cases = load_test_case(os.path.join(HTTP_SERVER_TEST_DATA_DIR, "test_case_1.yaml"))
+    webhook_config_file = tmp_path / "webhook_config.yaml"
+    with open(webhook_config_file, "w") as f:
+        yaml.safe_dump(list_cases[0][2], f)
+    servers = []
+
+    def _start_server(**kwargs) -> tuple[Server, list[tuple]]:
+        server = Server(
+            get_free_port(), generic_webhook_config_file=webhook_config_file, engine="asyncio", http2=True, **kwargs
+        )
+        t = threading.Thread(target=server.start)
+        t.start()
+        servers.append((server, t))
+        wait_for_server_ready(server.port, tls=bool(kwargs.get("certfile")))
+        return server, list_cases
+
+    yield _start_server
+
+    for server, t in servers:
+        server.stop()
+        t.join()
+
+
+def test_http2_with_tls(start_server):
+    server, list_cases = start_server(certfile=CERT_FILE, keyfile=KEY_FILE, max_concurrent_streams=10)
+
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    context.set_alpn_protocols(["h2"])
+    with context.wrap_socket(socket.create_connection(("localhost", server.port), timeout=2)) as sock:
+        assert sock.selected_alpn_protocol() == "h2"
+        client = Http2Client(sock)
+        # All the requests are multiplexed in the same connection
+        responses = client.post(
+            [(req["path"], json.dumps(req["body"]).encode("utf-8"), {}) for _, req, _, _ in list_cases * 3]
+        )
+        assert client.conn.remote_settings.max_concurrent_streams == 10
+
+    for (headers, body), (_, _, _, expected_response) in zip(responses, list_cases * 3):
+        assert headers[":status"] == "200"
+        assert int(headers["content-length"]) == len(body)
+        assert json.loads(body) == expected_response
+
+
+def test_http2_flow_control_and_body_limit(start_server):
+    server, list_cases = start_server(certfile="", keyfile="", max_body_bytes=10000)
+    _, req, _, expected_response = list_cases[0]
+
+    with socket.create_connection(("localhost", server.port), timeout=2) as sock:
+        # The window is smaller than the responses, so the server must wait for the client to open it
+        client = Http2Client(sock, {h2_settings.SettingCodes.INITIAL_WINDOW_SIZE: 16})
+        body = json.dumps(req["body"]).encode("utf-8")
+        (headers, raw_response), (too_large_headers, _) = client.post(
+            [(req["path"], body, {}), (req["path"], b"{}" * 6000, {"content-length": "12000"})]
+        )
+
+    assert headers[":status"] == "200"
+    assert json.loads(raw_response) == expected_response
+    assert too_large_headers[":status"] == "413"
+
+
+def test_http2_streams_over_the_limit_are_refused(start_server):
+    server, list_cases = start_server(certfile="", keyfile="", max_concurrent_streams=2)
+    _, req, _, expected_response = list_cases[0]
+    body = json.dumps(req["body"]).encode("utf-8")
+
+    # Make the evaluation of the requests slow, so the first streams are still in flight when the rest arrive
+    process_post = server.processor._process_post
+
+    def slow_process_post(*args):
+        time.sleep(0.5)
+        return process_post(*args)
+
+    server.processor._process_post = slow_process_post
+    with socket.create_connection(("localhost", server.port), timeout=5) as sock:
+        client = Http2Client(sock)
+        # The client ignores the limit advertised by the server
+        client.conn.remote_settings = h2_settings.Settings(client=False)
+        responses = client.post([(req["path"], body, {})] * 5)
+
+        # Only the streams over the limit are refused, the rest are answered in the same connection
+        assert [headers.get(":status") for headers, _ in responses] == ["200", "200", None, None, None]
+        assert list(client.reset_streams.values()) == [h2_errors.ErrorCodes.REFUSED_STREAM] * 3
+        assert json.loads(responses[0][1]) == expected_response
+
+        # The connection can still be used to retry them
+        ((headers, raw_response),) = client.post([(req["path"], body, {})])
+        assert headers[":status"] == "200"
+        assert json.loads(raw_response) == expected_response
+
+
+def test_http2_needs_asyncio_engine(tmp_path):
+    list_cases = load_test_case(os.path.join(HTTP_SERVER_TEST_DATA_DIR, "test_case_1.yaml"))
+    webhook_config_file = tmp_path / "webhook_config.yaml"
+    with open(webhook_config_file, "w") as f:
+        yaml.safe_dump(list_cases[0][2], f)
+
+    with pytest.raises(ValueError):
+        Server(get_free_port(), "", "", webhook_config_file, engine="threads", http2=True)
@@ -1,18 +1,36 @@
 import base64
+import copy
+import http.client
 import json
+import logging
 import os
+import re
+import shutil
+import socket
+import ssl
+import stat
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 import pytest
 import requests
 import yaml
-from test_utils import get_free_port, load_test_case, wait_for_server_ready
+from test_utils import get_free_port, load_test_case, wait_for_server_ready, write_configmap_version
 
-from generic_k8s_webhook.http_server import Server
+from generic_k8s_webhook import config_loader as config_loader_module
+from generic_k8s_webhook.async_server import AsyncioHTTPServer
+from generic_k8s_webhook.config_loader import ConfigLoader
+from generic_k8s_webhook.http_server import BaseHandler, Server
+from generic_k8s_webhook.metrics import MetricsRegistry
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 HTTP_SERVER_TEST_DATA_DIR = os.path.join(SCRIPT_DIR, "http_server_test_data")
+EXAMPLES_DIR = os.path.join(SCRIPT_DIR, "../examples")
+CERT_FILE = os.path.join(SCRIPT_DIR, "tls", "cert.pem")
+KEY_FILE = os.path.join(SCRIPT_DIR, "tls", "key.pem")
+CERT_2_FILE = os.path.join(SCRIPT_DIR, "tls", "cert2.pem")
+KEY_2_FILE = os.path.join(SCRIPT_DIR, "tls", "key2.pem")
 
 
 @pytest.mark.parametrize(
@@ -21,13 +39,15 @@ HTTP_SERVER_TEST_DATA_DIR = os.path.join(SCRIPT_DIR, "http_server_test_data")
     + load_test_case(os.path.join(HTTP_SERVER_TEST_DATA_DIR, "test_case_3.yaml"))
     + load_test_case(os.path.join(HTTP_SERVER_TEST_DATA_DIR, "test_case_4.yaml")),
 )
-def test_http_server(name_test, req, webhook_config, expected_response, tmp_path):
+@pytest.mark.parametrize("engine", Server.ENGINES)
+@pytest.mark.parametrize("projected_decoding", [False, True])
+def test_http_server(name_test, req, webhook_config, expected_response, engine, projected_decoding, tmp_path):
     webhook_config_file = tmp_path / "webhook_config.yaml"
     with open(webhook_config_file, "w") as f:
         yaml.safe_dump(webhook_config, f)
 
     port = get_free_port()
-    server = Server(port, "", "", webhook_config_file)
+    server = Server(port, "", "", webhook_config_file, engine=engine, projected_decoding=projected_decoding)
     t = threading.Thread(target=server.start)
     t.start()
     wait_for_server_ready(port)
@@ -49,7 +69,8 @@ def test_http_server(name_test, req, webhook_config, expected_response, tmp_path
     t.join()
 
 
-def test_auto_reload(tmp_path):
+@pytest.mark.parametrize("engine", Server.ENGINES)
+def test_auto_reload(engine, tmp_path):
     list_cases = load_test_case(os.path.join(HTTP_SERVER_TEST_DATA_DIR, "test_case_1.yaml"))
     webhook_config_file = tmp_path / "webhook_config.yaml"
     config_refresh_period = 1
@@ -59,7 +80,7 @@ def test_auto_reload(tmp_path):
         yaml.safe_dump(webhook_config, f)
 
     port = get_free_port()
-    server = Server(port, "", "", webhook_config_file, config_refresh_period)
+    server = Server(port, "", "", webhook_config_file, config_refresh_period, engine=engine)
     t = threading.Thread(target=server.start)
     t.start()
     wait_for_server_ready(port)
@@ -81,7 +102,8 @@ def test_auto_reload(tmp_path):
     t.join()
 
 
-def test_two_webhooks_same_server(tmp_path):
+@pytest.mark.parametrize("engine", Server.ENGINES)
+def test_two_webhooks_same_server(engine, tmp_path):
     list_cases = load_test_case(os.path.join(HTTP_SERVER_TEST_DATA_DIR, "test_case_2.yaml"))
     webhook_config_file = tmp_path / "webhook_config.yaml"
     config_refresh_period = 1
@@ -91,7 +113,7 @@ def test_two_webhooks_same_server(tmp_path):
         yaml.safe_dump(webhook_config, f)
 
     port = get_free_port()
-    server = Server(port, "", "", webhook_config_file, config_refresh_period)
+    server = Server(port, "", "", webhook_config_file, config_refresh_period, engine=engine)
     t = threading.Thread(target=server.start)
     t.start()
     wait_for_server_ready(port)
@@ -106,3 +128,877 @@ def test_two_webhooks_same_server(tmp_path):
 
     server.stop()
     t.join()
+
+
+@pytest.mark.parametrize("n_clients", [1, 8])
+@pytest.mark.parametrize("engine", Server.ENGINES)
+def test_parallel_clients(n_clients, engine, tmp_path):
+    list_cases = load_test_case(os.path.join(HTTP_SERVER_TEST_DATA_DIR, "test_case_1.yaml"))
+    webhook_config_file = tmp_path / "webhook_config.yaml"
+    # A short refresh period, so the config is reloaded several times while the clients send requests
+    config_refresh_period = 0.1
+    n_requests_per_client = 25
+
+    _, _, webhook_config, _ = list_cases[0]
+    with open(webhook_config_file, "w") as f:
+        yaml.safe_dump(webhook_config, f)
+
+    port = get_free_port()
+    server = Server(port, "", "", webhook_config_file, config_refresh_period, max_workers=4, engine=engine)
+    t = threading.Thread(target=server.start)
+    t.start()
+    wait_for_server_ready(port)
+
+    def send_requests(i: int) -> None:
+        _, req, _, expected_response = list_cases[i % len(list_cases)]
+        url = f"http://localhost:{port}{req['path']}"
+        for _ in range(n_requests_per_client):
+            response = requests.post(url, json=req["body"], timeout=5)
+            assert response.status_code == 200
+            assert json.loads(response.content.decode("utf-8")) == expected_response
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=n_clients) as executor:
+        # Consume the results so any failed assert is raised here
+        list(executor.map(send_requests, range(n_clients)))
+    elapsed = time.perf_counter() - start
+    logging.info(f"{engine} engine, {n_clients} clients: {n_clients * n_requests_per_client / elapsed:.1f} requests/s")
+
+    server.stop()
+    t.join()
+
+
+@pytest.mark.parametrize("engine", Server.ENGINES)
+def test_slow_client_does_not_block_server(engine, tmp_path):
+    list_cases = load_test_case(os.path.join(HTTP_SERVER_TEST_DATA_DIR, "test_case_1.yaml"))
+    webhook_config_file = tmp_path / "webhook_config.yaml"
+
+    _, req, webhook_config, expected_response = list_cases[0]
+    with open(webhook_config_file, "w") as f:
+        yaml.safe_dump(webhook_config, f)
+
+    port = get_free_port()
+    server = Server(port, "", "", webhook_config_file, max_workers=2, engine=engine)
+    t = threading.Thread(target=server.start)
+    t.start()
+    wait_for_server_ready(port)
+
+    # This client opens a connection, but it never sends the request
+    with socket.create_connection(("localhost", port)):
+        url = f"http://localhost:{port}{req['path']}"
+        response = requests.post(url, json=req["body"], timeout=1)
+        assert json.loads(response.content.decode("utf-8")) == expected_response
+
+    server.stop()
+    t.join()
+
+
+def test_connections_closed_when_queue_is_full(tmp_path):
+    list_cases = load_test_case(os.path.join(HTTP_SERVER_TEST_DATA_DIR, "test_case_1.yaml"))
+    webhook_config_file = tmp_path / "webhook_config.yaml"
+
+    _, _, webhook_config, _ = list_cases[0]
+    with open(webhook_config_file, "w") as f:
+        yaml.safe_dump(webhook_config, f)
+
+    port = get_free_port()
+    server = Server(port, "", "", webhook_config_file, max_workers=1, max_queue_size=1)
+    t = threading.Thread(target=server.start)
+    t.start()
+    wait_for_server_ready(port)
+
+    # The first connection blocks the only worker and the second one fills the queue
+    busy_conn = socket.create_connection(("localhost", port))
+    time.sleep(0.2)
+    queued_conn = socket.create_connection(("localhost", port))
+    time.sleep(0.2)
+    with socket.create_connection(("localhost", port), timeout=2) as rejected_conn:
+        # The server closes the connection without answering
+        assert rejected_conn.recv(1) == b""
+
+    busy_conn.close()
+    queued_conn.close()
+    server.stop()
+    t.join()
+
+
+@pytest.mark.parametrize("engine", Server.ENGINES)
+def test_https_server(engine, tmp_path):
+    list_cases = load_test_case(os.path.join(HTTP_SERVER_TEST_DATA_DIR, "test_case_1.yaml"))
+    webhook_config_file = tmp_path / "webhook_config.yaml"
+
+    _, req, webhook_config, expected_response = list_cases[0]
+    with open(webhook_config_file, "w") as f:
+        yaml.safe_dump(webhook_config, f)
+
+    port = get_free_port()
+    server = Server(port, CERT_FILE, KEY_FILE, webhook_config_file, engine=engine)
+    t = threading.Thread(target=server.start)
+    t.start()
+    wait_for_server_ready(port, tls=True)
+
+    url = f"https://localhost:{port}{req['path']}"
+    response = requests.post(url, json=req["body"], verify=False, timeout=1)
+    assert json.loads(response.content.decode("utf-8")) == expected_response
+
+    server.stop()
+    t.join()
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str) -> None:
+        super().__init__("localhost", timeout=1)
+        self.path = path
+
+    def connect(self) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+@pytest.mark.parametrize("engine", Server.ENGINES)
+def test_unix_socket(engine, tmp_path):
+    list_cases = load_test_case(os.path.join(HTTP_SERVER_TEST_DATA_DIR, "test_case_1.yaml"))
+    webhook_config_file = tmp_path / "webhook_config.yaml"
+    _, req, webhook_config, expected_response = list_cases[0]
+    with open(webhook_config_file, "w") as f:
+        yaml.safe_dump(webhook_config, f)
+
+    # A socket left behind by a server that didn't stop cleanly
+    socket_path = str(tmp_path / "webhook.sock")
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as stale_socket:
+        stale_socket.bind(socket_path)
+
+    server = Server(None, "", "", webhook_config_file, engine=engine, unix_socket=socket_path, unix_socket_mode=0o600)
+    t = threading.Thread(target=server.start)
+    t.start()
+    assert stat.S_IMODE(os.stat(socket_path).st_mode) == 0o600
+
+    # Another server can't replace the socket while it's in use
+    with pytest.raises(OSError):
+        Server(None, "", "", webhook_config_file, engine=engine, unix_socket=socket_path)
+
+    conn = UnixHTTPConnection(socket_path)
+    for _ in range(2):
+        conn.request("POST", req["path"], json.dumps(req["body"]), {"Content-Type": "application/json"})
+        response = conn.getresponse()
+        assert response.status == 200
+        assert json.loads(response.read()) == expected_response
+    conn.close()
+
+    server.stop()
+    t.join()
+    assert not os.path.exists(socket_path)
+
+
+@pytest.mark.parametrize("engine", Server.ENGINES)
+def test_keep_alive(engine, tmp_path):
+    list_cases = load_test_case(os.path.join(HTTP_SERVER_TEST_DATA_DIR, "test_case_1.yaml"))
+    webhook_config_file = tmp_path / "webhook_config.yaml"
+
+    _, _, webhook_config, _ = list_cases[0]
+    with open(webhook_config_file, "w") as f:
+        yaml.safe_dump(webhook_config, f)
+
+    port = get_free_port()
+    server = Server(port, "", "", webhook_config_file, engine=engine, max_requests_per_connection=3)
+    t = threading.Thread(target=server.start)
+    t.start()
+    wait_for_server_ready(port)
+
+    conn = http.client.HTTPConnection("localhost", port, timeout=1)
+    list_sockets = []
+    for i, (_, req, _, expected_response) in enumerate(list_cases * 2):
+        conn.request("POST", req["path"], body=json.dumps(req["body"]), headers={"Content-Type": "application/json"})
+        response = conn.getresponse()
+        raw_response = response.read()
+        assert json.loads(raw_response) == expected_response
+        assert int(response.getheader("Content-Length")) == len(raw_response)
+        # The server closes the connection after the 3rd request
+        assert response.will_close == (i == 2)
+        list_sockets.append(conn.sock)
+    conn.close()
+
+    # The first 3 requests use the same connection, which is closed after the 3rd response.
+    # The 4th request needs a new connection
+    assert list_sockets[0] is list_sockets[1]
+    assert list_sockets[2] is None
+    assert list_sockets[3] is not None and list_sockets[3] is not list_sockets[0]
+
+    server.stop()
+    t.join()
+
+
+@pytest.mark.parametrize("engine", Server.ENGINES)
+def test_keep_alive_timeout(engine, tmp_path):
+    list_cases = load_test_case(os.path.join(HTTP_SERVER_TEST_DATA_DIR, "test_case_1.yaml"))
+    webhook_config_file = tmp_path / "webhook_config.yaml"
+
+    _, _, webhook_config, _ = list_cases[0]
+    with open(webhook_config_file, "w") as f:
+        yaml.safe_dump(webhook_config, f)
+
+    port = get_free_port()
+    server = Server(port, "", "", webhook_config_file, engine=engine, keep_alive_timeout=0.2)
+    t = threading.Thread(target=server.start)
+    t.start()
+    wait_for_server_ready(port)
+
+    with socket.create_connection(("localhost", port), timeout=2) as sock:
+        sock.sendall(b"GET /healthz HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        # Read the whole response and, after the keep alive timeout, the server closes the connection
+        raw_response = b""
+        while chunk := sock.recv(1024):
+            raw_response += chunk
+        assert raw_response.startswith(b"HTTP/1.1 200")
+        assert raw_response.endswith(b"I'm alive\n")
+
+    server.stop()
+    t.join()
+
+
+def test_idle_connection_releases_thread(tmp_path):
+    list_cases = load_test_case(os.path.join(HTTP_SERVER_TEST_DATA_DIR, "test_case_1.yaml"))
+    webhook_config_file = tmp_path / "webhook_config.yaml"
+
+    _, req, webhook_config, expected_response = list_cases[0]
+    with open(webhook_config_file, "w") as f:
+        yaml.safe_dump(webhook_config, f)
+
+    port = get_free_port()
+    server = Server(port, "", "", webhook_config_file, max_workers=1, keep_alive_timeout=60)
+    t = threading.Thread(target=server.start)
+    t.start()
+    wait_for_server_ready(port)
+
+    # This connection stays idle after the first request, but it doesn't keep the only thread
+    # of the server busy when another connection needs it
+    idle_conn = http.client.HTTPConnection("localhost", port, timeout=1)
+    idle_conn.request("GET", "/healthz")
+    assert idle_conn.getresponse().read() == b"I'm alive\n"
+
+    url = f"http://localhost:{port}{req['path']}"
+    # It waits for the grace period of the idle connection
+    response = requests.post(url, json=req["body"], timeout=5)
+    assert json.loads(response.content.decode("utf-8")) == expected_response
+
+    idle_conn.close()
+    server.stop()
+    t.join()
+
+
+def test_idle_connection_grace_period(tmp_path):
+    list_cases = load_test_case(os.path.join(HTTP_SERVER_TEST_DATA_DIR, "test_case_1.yaml"))
+    webhook_config_file = tmp_path / "webhook_config.yaml"
+
+    _, req, webhook_config, expected_response = list_cases[0]
+    with open(webhook_config_file, "w") as f:
+        yaml.safe_dump(webhook_config, f)
+
+    port = get_free_port()
+    server = Server(port, "", "", webhook_config_file, max_workers=1, keep_alive_timeout=60)
+    t = threading.Thread(target=server.start)
+    t.start()
+    wait_for_server_ready(port)
+
+    conn = http.client.HTTPConnection("localhost", port, timeout=5)
+    conn.request("GET", "/healthz")
+    assert conn.getresponse().read() == b"I'm alive\n"
+    # Another connection waits for the only thread, but the first one isn't closed
+    # while the client may still be sending its next request through it
+    queued_conn = http.client.HTTPConnection("localhost", port, timeout=5)
+    queued_conn.connect()
+    time.sleep(0.2)
+    conn.request("POST", req["path"], body=json.dumps(req["body"]), headers={"Content-Type": "application/json"})
+    assert json.loads(conn.getresponse().read()) == expected_response
+
+    # Once the grace period has passed, the idle connection gives its thread to the queued one
+    queued_conn.request("GET", "/healthz")
+    assert queued_conn.getresponse().read() == b"I'm alive\n"
+
+    conn.close()
+    queued_conn.close()
+    server.stop()
+    t.join()
+
+
+def get_client_ssl_context() -> ssl.SSLContext:
+    # The test certificates are self-signed
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+@pytest.mark.parametrize("engine", Server.ENGINES)
+def test_tls_session_resumption(engine, tmp_path):
+    list_cases = load_test_case(os.path.join(HTTP_SERVER_TEST_DATA_DIR, "test_case_1.yaml"))
+    webhook_config_file = tmp_path / "webhook_config.yaml"
+
+    _, _, webhook_config, _ = list_cases[0]
+    with open(webhook_config_file, "w") as f:
+        yaml.safe_dump(webhook_config, f)
+
+    port = get_free_port()
+    server = Server(port, CERT_FILE, KEY_FILE, webhook_config_file, engine=engine)
+    t = threading.Thread(target=server.start)
+    t.start()
+    wait_for_server_ready(port, tls=True)
+
+    context = get_client_ssl_context()
+    session = None
+    for i in range(2):
+        conn = http.client.HTTPSConnection("localhost", port, context=context, timeout=1)
+        conn.connect()
+        if session:
+            # http.client doesn't support sessions, so we replace its socket by one that uses the session
+            conn.sock = context.wrap_socket(
+                socket.create_connection(("localhost", port)), server_hostname="localhost", session=session
+            )
+        conn.request("GET", "/healthz")
+        assert conn.getresponse().read() == b"I'm alive\n"
+        assert conn.sock.version() == "TLSv1.3"
+        # The second connection resumes the session from the first one
+        assert conn.sock.session_reused == (i == 1)
+        session = conn.sock.session
+        conn.close()
+
+    server.stop()
+    t.join()
+
+
+@pytest.mark.parametrize("engine", Server.ENGINES)
+def test_tls_certificate_reload(engine, tmp_path):
+    list_cases = load_test_case(os.path.join(HTTP_SERVER_TEST_DATA_DIR, "test_case_1.yaml"))
+    webhook_config_file = tmp_path / "webhook_config.yaml"
+    cert_file = tmp_path / "cert.pem"
+    key_file = tmp_path / "key.pem"
+
+    _, _, webhook_config, _ = list_cases[0]
+    with open(webhook_config_file, "w") as f:
+        yaml.safe_dump(webhook_config, f)
+    shutil.copy(CERT_FILE, cert_file)
+    shutil.copy(KEY_FILE, key_file)
+
+    port = get_free_port()
+    server = Server(port, cert_file, key_file, webhook_config_file, engine=engine, cert_refresh_period=0.1)
+    t = threading.Thread(target=server.start)
+    t.start()
+    wait_for_server_ready(port, tls=True)
+
+    context = get_client_ssl_context()
+    old_conn = http.client.HTTPSConnection("localhost", port, context=context, timeout=1)
+    old_conn.request("GET", "/healthz")
+    assert old_conn.getresponse().read() == b"I'm alive\n"
+    with open(CERT_FILE, "r") as f:
+        assert old_conn.sock.getpeercert(binary_form=True) == ssl.PEM_cert_to_DER_cert(f.read())
+
+    # Rotate the certificate
+    shutil.copy(CERT_2_FILE, cert_file)
+    shutil.copy(KEY_2_FILE, key_file)
+    time.sleep(0.5)
+
+    # The new connections use the new certificate
+    new_conn = http.client.HTTPSConnection("localhost", port, context=context, timeout=1)
+    new_conn.request("GET", "/healthz")
+    assert new_conn.getresponse().read() == b"I'm alive\n"
+    with open(CERT_2_FILE, "r") as f:
+        assert new_conn.sock.getpeercert(binary_form=True) == ssl.PEM_cert_to_DER_cert(f.read())
+    new_conn.close()
+
+    # The connection established before the rotation still works
+    old_conn.request("GET", "/healthz")
+    assert old_conn.getresponse().read() == b"I'm alive\n"
+    old_conn.close()
+
+    server.stop()
+    t.join()
+
+
+def test_config_loader_routes(tmp_path):
+    webhook_config_file = tmp_path / "webhook_config.yaml"
+    webhook_config = {
+        "apiVersion": "generic-webhook/v1alpha1",
+        "kind": "GenericWebhookConfig",
+        "webhooks": [
+            {"name": "first", "path": "/path-a", "actions": [{"accept": True}]},
+            {"name": "second", "path": "/path-b", "actions": [{"accept": True}]},
+            {"name": "third", "path": "/path-a", "actions": [{"accept": False}]},
+        ],
+    }
+    with open(webhook_config_file, "w") as f:
+        yaml.safe_dump(webhook_config, f)
+
+    config_loader = ConfigLoader(webhook_config_file, 1)
+    routes = config_loader.get_routes()
+    # The webhooks that share a path keep the order of the config file
+    assert {path: [webhook.name for webhook in webhooks] for path, webhooks in routes.items()} == {
+        "/path-a": ["first", "third"],
+        "/path-b": ["second"],
+    }
+    assert routes.get("/path-c") is None
+    # The routing table can't be modified, only replaced by a new one
+    with pytest.raises(TypeError):
+        routes["/path-c"] = ()
+
+
+def test_config_snapshot(tmp_path):
+    write_configmap_version(tmp_path, "..version_1", "first")
+    metrics = MetricsRegistry()
+    config_loader = ConfigLoader(str(tmp_path / "webhook_config.yaml"), 1, metrics)
+    snapshot = config_loader.get_snapshot()
+
+    write_configmap_version(tmp_path, "..version_2", "second")
+    config_loader._reload_manifest()  # pylint: disable=protected-access
+    new_snapshot = config_loader.get_snapshot()
+    assert (snapshot.generation, new_snapshot.generation) == (1, 2)
+    # A request that got the old snapshot keeps using the old config until it finishes
+    assert [webhook.name for webhook in snapshot.routes["/path"]] == ["first"]
+    assert [webhook.name for webhook in new_snapshot.routes["/path"]] == ["second"]
+    with pytest.raises(AttributeError):
+        snapshot.generation = 3
+    assert "generic_webhook_config_generation 2" in metrics.render()
+
+
+def test_config_loader_only_reloads_changed_files(tmp_path, monkeypatch):
+    # The files are checked right after writing them, so their stat must be trusted anyway
+    monkeypatch.setattr(config_loader_module, "RACY_INTERVAL", 0)
+
+    write_configmap_version(tmp_path, "..version_1", "first")
+    metrics = MetricsRegistry()
+    config_loader = ConfigLoader(str(tmp_path / "webhook_config.yaml"), 1, metrics)
+
+    # pylint: disable=protected-access
+    config_loader._reload_manifest()
+    write_configmap_version(tmp_path, "..version_2", "first")
+    config_loader._reload_manifest()
+    assert config_loader.generation == 1
+    write_configmap_version(tmp_path, "..version_3", "second")
+    config_loader._reload_manifest()
+    assert config_loader.generation == 2
+    assert [webhook.name for webhook in config_loader.get_routes()["/path"]] == ["second"]
+
+    rendered = metrics.render()
+    # The first load counts as a reload
+    for result, count in [("unchanged", 1), ("same_content", 1), ("reloaded", 2)]:
+        assert f'generic_webhook_config_reload_checks_total{{result="{result}"}} {count}' in rendered
+    assert "generic_webhook_config_reload_duration_seconds_count 2" in rendered
+
+
+@pytest.mark.parametrize("engine", Server.ENGINES)
+def test_metrics(engine, tmp_path):
+    list_cases = load_test_case(os.path.join(HTTP_SERVER_TEST_DATA_DIR, "test_case_2.yaml"))
+    webhook_config_file = tmp_path / "webhook_config.yaml"
+    _, _, webhook_config, _ = list_cases[0]
+    with open(webhook_config_file, "w") as f:
+        yaml.safe_dump(webhook_config, f)
+
+    port = get_free_port()
+    server = Server(port, "", "", webhook_config_file, engine=engine)
+    t = threading.Thread(target=server.start)
+    t.start()
+    wait_for_server_ready(port)
+
+    for _, req, _, _ in list_cases:
+        requests.post(f"http://localhost:{port}{req['path']}", json=req["body"], timeout=1)
+    requests.post(f"http://localhost:{port}/wrong-path", json={}, timeout=1)
+
+    response = requests.get(f"http://localhost:{port}/metrics", timeout=1)
+    assert response.status_code == 200
+    assert response.headers["Content-Type"].startswith("text/plain")
+    metrics = response.text
+    assert 'generic_webhook_requests_total{path="/check-namespace-sa",decision="allowed"} 1' in metrics
+    assert 'generic_webhook_requests_total{path="/check-name-sa",decision="denied"} 1' in metrics
+    assert 'generic_webhook_requests_total{path="unknown",decision="invalid_path"} 1' in metrics
+    assert (
+        'generic_webhook_webhook_duration_seconds_count{path="/check-name-sa",webhook="check-name-sa",'
+        'decision="denied"} 1'
+    ) in metrics
+    assert "generic_webhook_requests_in_flight 0" in metrics
+    assert "generic_webhook_config_reload_duration_seconds_count 1" in metrics
+    assert "generic_webhook_config_reload_failures_total 0" in metrics
+
+    server.stop()
+    t.join()
+
+
+@pytest.mark.parametrize("engine", Server.ENGINES)
+def test_decision_cache(engine, tmp_path):
+    list_cases = load_test_case(os.path.join(HTTP_SERVER_TEST_DATA_DIR, "test_case_1.yaml"))
+    webhook_config_file = tmp_path / "webhook_config.yaml"
+    with open(webhook_config_file, "w") as f:
+        yaml.safe_dump(list_cases[0][2], f)
+
+    port = get_free_port()
+    server = Server(port, "", "", webhook_config_file, engine=engine, decision_cache_size=10)
+    t = threading.Thread(target=server.start)
+    t.start()
+    wait_for_server_ready(port)
+
+    # The same objects are sent again by other requests, which get the cached decision with their own uid
+    for uid in ["1234", "5678"]:
+        for _, req, _, expected_response in list_cases:
+            body = copy.deepcopy(req["body"])
+            body["request"]["uid"] = uid
+            body["request"]["object"]["metadata"]["resourceVersion"] = uid
+            response = requests.post(f"http://localhost:{port}{req['path']}", json=body, timeout=1)
+            assert response.json() == {**expected_response, "response": {**expected_response["response"], "uid": uid}}
+
+    metrics = requests.get(f"http://localhost:{port}/metrics", timeout=1).text
+    assert f'generic_webhook_decision_cache_lookups_total{{result="hit"}} {len(list_cases)}' in metrics
+    assert f'generic_webhook_decision_cache_lookups_total{{result="miss"}} {len(list_cases)}' in metrics
+    assert f'generic_webhook_requests_total{{path="/check-namespace-sa",decision="allowed"}}' in metrics
+
+    server.stop()
+    t.join()
+
+
+@pytest.mark.parametrize("engine", Server.ENGINES)
+def test_coalesce_requests(engine, tmp_path):
+    webhook_config_file = tmp_path / "webhook_config.yaml"
+    webhook = {
+        "name": "slow-webhook",
+        "path": "/slow",
+        "actions": [{"condition": {"any": '.spec.containers.* -> .name == "main"'}, "patch": []}],
+    }
+    webhook_config = {"apiVersion": "generic-webhook/v1beta1", "kind": "GenericWebhookConfig", "webhooks": [webhook]}
+    with open(webhook_config_file, "w") as f:
+        yaml.safe_dump(webhook_config, f)
+
+    port = get_free_port()
+    server = Server(port, "", "", webhook_config_file, engine=engine, coalesce_requests=True)
+    t = threading.Thread(target=server.start)
+    t.start()
+    wait_for_server_ready(port)
+
+    # Identical pods, like the ones created when a Deployment scales up, sent at the same time
+    containers = [{"name": f"container-{i}"} for i in range(10000)]
+    n_requests = 8
+
+    def send_request(i: int) -> None:
+        pod = {"metadata": {"name": f"pod-{i}"}, "spec": {"containers": containers}}
+        response = requests.post(
+            f"http://localhost:{port}/slow", json={"request": {"uid": str(i), "object": pod}}, timeout=10
+        )
+        # Each one gets its own uid, even if it shared the decision of another request
+        assert response.json()["response"] == {"uid": str(i), "allowed": True}
+
+    with ThreadPoolExecutor(max_workers=n_requests) as executor:
+        list(executor.map(send_request, range(n_requests)))
+    metrics = requests.get(f"http://localhost:{port}/metrics", timeout=1).text
+    counts = re.findall(r'generic_webhook_request_coalescing_total{result="\w+"} (\d+)', metrics)
+    assert sum(int(count) for count in counts) == n_requests
+
+    server.stop()
+    t.join()
+
+
+@pytest.mark.parametrize("engine", Server.ENGINES)
+@pytest.mark.parametrize("projected_decoding", [False, True])
+def test_skip_unchanged_updates(engine, projected_decoding):
+    webhook_config_file = os.path.join(EXAMPLES_DIR, "check-namespace-sa.yaml")
+    port = get_free_port()
+    server = Server(
+        port,
+        "",
+        "",
+        webhook_config_file,
+        engine=engine,
+        projected_decoding=projected_decoding,
+        skip_unchanged_updates=True,
+    )
+    t = threading.Thread(target=server.start)
+    t.start()
+    wait_for_server_ready(port)
+
+    old_sa = {"kind": "ServiceAccount", "metadata": {"name": "sa", "namespace": "kube-system"}}
+    new_sa = {**old_sa, "metadata": {**old_sa["metadata"], "labels": {"app": "test"}}, "secrets": []}
+    moved_sa = {**old_sa, "metadata": {**old_sa["metadata"], "namespace": "default"}}
+    for operation, obj, old_obj, expected_allowed in [
+        ("CREATE", old_sa, None, False),
+        # The webhook only reads the kind and the namespace, so it isn't evaluated
+        ("UPDATE", new_sa, old_sa, True),
+        ("UPDATE", old_sa, moved_sa, False),
+    ]:
+        request = {"uid": "1234", "operation": operation, "object": obj, "oldObject": old_obj}
+        response = requests.post(f"http://localhost:{port}/check-namespace-sa", json={"request": request}, timeout=1)
+        assert response.json()["response"]["allowed"] == expected_allowed
+
+    metrics = requests.get(f"http://localhost:{port}/metrics", timeout=1).text
+    assert 'generic_webhook_unchanged_updates_total{path="/check-namespace-sa"} 1' in metrics
+
+    server.stop()
+    t.join()
+
+
+@pytest.mark.parametrize(
+    ("on_deadline", "webhook_timeout", "url_params", "expected_allowed", "expected_deadline_exceeded"),
+    [
+        ("fail-open", 1e-9, "", True, True),
+        ("fail-closed", 1e-9, "", False, True),
+        ("fail-closed", None, "?timeout=1ns", False, True),
+        ("fail-closed", None, "?timeout=10s", True, False),
+    ],
+)
+@pytest.mark.parametrize("engine", Server.ENGINES)
+def test_deadline_exceeded(
+    on_deadline, webhook_timeout, url_params, expected_allowed, expected_deadline_exceeded, engine, tmp_path
+):
+    webhook_config_file = tmp_path / "webhook_config.yaml"
+    webhook = {
+        "name": "slow-webhook",
+        "path": "/slow",
+        "actions": [{"condition": {"any": '.spec.containers.* -> .name == "main"'}, "patch": []}],
+    }
+    if webhook_timeout:
+        webhook["timeoutSeconds"] = webhook_timeout
+    webhook_config = {"apiVersion": "generic-webhook/v1beta1", "kind": "GenericWebhookConfig", "webhooks": [webhook]}
+    with open(webhook_config_file, "w") as f:
+        yaml.safe_dump(webhook_config, f)
+
+    port = get_free_port()
+    server = Server(port, "", "", webhook_config_file, engine=engine, on_deadline=on_deadline)
+    t = threading.Thread(target=server.start)
+    t.start()
+    wait_for_server_ready(port)
+
+    containers = [{"name": f"container-{i}"} for i in range(1000)]
+    body = {"request": {"uid": "1234", "object": {"spec": {"containers": containers}}}}
+    response = requests.post(f"http://localhost:{port}/slow{url_params}", json=body, timeout=5)
+    assert response.json()["response"]["allowed"] == expected_allowed
+
+    metrics = requests.get(f"http://localhost:{port}/metrics", timeout=1).text
+    if expected_deadline_exceeded:
+        assert 'generic_webhook_deadline_exceeded_total{path="/slow",webhook="slow-webhook"} 1' in metrics
+    else:
+        assert "generic_webhook_deadline_exceeded_total{" not in metrics
+
+    server.stop()
+    t.join()
+
+
+@pytest.mark.parametrize("engine", Server.ENGINES)
+def test_requests_over_concurrency_limit_are_rejected(engine, tmp_path):
+    list_cases = load_test_case(os.path.join(HTTP_SERVER_TEST_DATA_DIR, "test_case_1.yaml"))
+    _, req, webhook_config, expected_response = list_cases[0]
+    webhook_config_file = tmp_path / "webhook_config.yaml"
+    with open(webhook_config_file, "w") as f:
+        yaml.safe_dump(webhook_config, f)
+
+    port = get_free_port()
+    server = Server(port, "", "", webhook_config_file, engine=engine, max_concurrency=2)
+    t = threading.Thread(target=server.start)
+    t.start()
+    wait_for_server_ready(port)
+
+    # Simulate that there are already 2 requests being processed
+    limiter = server.processor.limiter
+    assert limiter.try_acquire()
+    assert limiter.try_acquire()
+
+    url = f"http://localhost:{port}{req['path']}"
+    response = requests.post(url, json=req["body"], timeout=1)
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+
+    # Once one of them finishes, the new requests are processed again
+    limiter.release(0.001)
+    response = requests.post(url, json=req["body"], timeout=1)
+    assert response.status_code == 200
+    assert response.json() == expected_response
+
+    metrics = requests.get(f"http://localhost:{port}/metrics", timeout=1).text
+    assert 'generic_webhook_requests_rejected_total{reason="concurrency_limit"} 1' in metrics
+    assert "generic_webhook_concurrency_limit 2" in metrics
+
+    server.stop()
+    t.join()
+
+
+def test_control_server(tmp_path):
+    list_cases = load_test_case(os.path.join(HTTP_SERVER_TEST_DATA_DIR, "test_case_1.yaml"))
+    webhook_config_file = tmp_path / "webhook_config.yaml"
+    _, req, webhook_config, expected_response = list_cases[0]
+    with open(webhook_config_file, "w") as f:
+        yaml.safe_dump(webhook_config, f)
+
+    port = get_free_port()
+    control_port = get_free_port()
+    server = Server(port, "", "", webhook_config_file, 0.1, max_workers=1, max_queue_size=1, control_port=control_port)
+    t = threading.Thread(target=server.start)
+    t.start()
+    wait_for_server_ready(port)
+    control_url = f"http://localhost:{control_port}"
+
+    assert requests.get(f"{control_url}/livez", timeout=1).status_code == 200
+    assert requests.get(f"{control_url}/readyz", timeout=1).status_code == 200
+    config_status = requests.get(f"{control_url}/debug/config", timeout=1).json()
+    assert config_status["lastLoadError"] is None
+    assert config_status["routes"] == {req["path"]: [webhook_config["webhooks"][0]["name"]]}
+    assert "generic_webhook_queue_depth 0" in requests.get(f"{control_url}/metrics", timeout=1).text
+
+    # The first connection blocks the only worker and the second one fills the queue. The server
+    # is still alive, but it's not ready to receive more requests
+    busy_conn = socket.create_connection(("localhost", port))
+    time.sleep(0.2)
+    queued_conn = socket.create_connection(("localhost", port))
+    time.sleep(0.2)
+    assert requests.get(f"{control_url}/livez", timeout=1).status_code == 200
+    response = requests.get(f"{control_url}/readyz", timeout=1)
+    assert response.status_code == 503
+    assert "The queue is full" in response.text
+    busy_conn.close()
+    queued_conn.close()
+    time.sleep(0.2)
+    assert requests.get(f"{control_url}/readyz", timeout=1).status_code == 200
+
+    # An invalid config makes the server not ready, but it keeps using the last valid one
+    with open(webhook_config_file, "w") as f:
+        f.write("invalid config")
+    time.sleep(0.5)
+    response = requests.get(f"{control_url}/readyz", timeout=1)
+    assert response.status_code == 503
+    assert "The last attempt to load the config failed" in response.text
+    response = requests.post(f"http://localhost:{port}{req['path']}", json=req["body"], timeout=1)
+    assert response.json() == expected_response
+
+    server.stop()
+    t.join()
+
+
+@pytest.mark.parametrize("engine", Server.ENGINES)
+def test_graceful_drain(engine, tmp_path):
+    list_cases = load_test_case(os.path.join(HTTP_SERVER_TEST_DATA_DIR, "test_case_1.yaml"))
+    webhook_config_file = tmp_path / "webhook_config.yaml"
+    _, req, webhook_config, expected_response = list_cases[0]
+    with open(webhook_config_file, "w") as f:
+        yaml.safe_dump(webhook_config, f)
+
+    port = get_free_port()
+    control_port = get_free_port()
+    server = Server(
+        port, "", "", webhook_config_file, engine=engine, control_port=control_port, drain_delay=0.5, drain_timeout=5
+    )
+    t = threading.Thread(target=server.start)
+    t.start()
+    wait_for_server_ready(port)
+    control_url = f"http://localhost:{control_port}"
+
+    # Make the evaluation of the requests slow, so there's one in flight when the server is stopped
+    process_post = server.processor._process_post
+
+    def slow_process_post(*args):
+        time.sleep(1)
+        return process_post(*args)
+
+    server.processor._process_post = slow_process_post
+    with ThreadPoolExecutor() as executor:
+        future_response = executor.submit(
+            requests.post, f"http://localhost:{port}{req['path']}", json=req["body"], timeout=5
+        )
+        while server.get_requests_in_flight() == 0:
+            time.sleep(0.01)
+        stop_thread = threading.Thread(target=server.stop)
+        stop_thread.start()
+
+        # The readiness probe fails first, but the server is still accepting connections
+        time.sleep(0.1)
+        response = requests.get(f"{control_url}/readyz", timeout=1)
+        assert response.status_code == 503
+        assert "The server is shutting down" in response.text
+        assert "generic_webhook_draining 1" in requests.get(f"{control_url}/metrics", timeout=1).text
+        assert requests.get(f"http://localhost:{port}/healthz", timeout=1).status_code == 200
+
+        # The request in flight is answered before shutting down
+        response = future_response.result()
+        assert response.status_code == 200
+        assert response.json() == expected_response
+        stop_thread.join()
+
+    t.join()
+    with pytest.raises(requests.ConnectionError):
+        requests.get(f"http://localhost:{port}/healthz", timeout=1)
+
+
+@pytest.mark.parametrize("engine", Server.ENGINES)
+def test_max_body_bytes(engine, tmp_path, monkeypatch):
+    list_cases = load_test_case(os.path.join(HTTP_SERVER_TEST_DATA_DIR, "test_case_1.yaml"))
+    webhook_config_file = tmp_path / "webhook_config.yaml"
+    _, req, webhook_config, expected_response = list_cases[0]
+    with open(webhook_config_file, "w") as f:
+        yaml.safe_dump(webhook_config, f)
+    # The bodies bigger than this get a buffer of their own
+    monkeypatch.setattr(BaseHandler, "BODY_BUFFER_SIZE", 4096)
+    monkeypatch.setattr(AsyncioHTTPServer, "BODY_BUFFER_SIZE", 4096)
+
+    port = get_free_port()
+    server = Server(port, "", "", webhook_config_file, engine=engine, max_body_bytes=100000)
+    t = threading.Thread(target=server.start)
+    t.start()
+    wait_for_server_ready(port)
+
+    # A big request below the limit is processed
+    body = copy.deepcopy(req["body"])
+    body["request"]["object"]["metadata"]["annotations"] = {"big": "x" * 50000}
+    response = requests.post(f"http://localhost:{port}{req['path']}", json=body, timeout=1)
+    assert response.status_code == 200
+    assert response.json() == expected_response
+
+    # The requests are rejected before reading their body, and the connection is closed
+    for headers, expected_status in [
+        ("Content-Length: 100001\r\n", b"413"),
+        ("Transfer-Encoding: chunked\r\n", b"411"),
+        ("", b"411"),
+        ("Content-Length: -1\r\n", b"400"),
+    ]:
+        with socket.create_connection(("localhost", port), timeout=2) as sock:
+            sock.sendall(f"POST {req['path']} HTTP/1.1\r\nHost: localhost\r\n{headers}\r\n".encode("ascii"))
+            raw_response = b""
+            while chunk := sock.recv(1024):
+                raw_response += chunk
+            assert raw_response.startswith(b"HTTP/1.1 " + expected_status)
+            assert b"Connection: close" in raw_response
+
+    metrics = requests.get(f"http://localhost:{port}/metrics", timeout=1).text
+    assert 'generic_webhook_request_bodies_rejected_total{reason="too_large"} 1' in metrics
+    assert 'generic_webhook_request_bodies_rejected_total{reason="length_required"} 2' in metrics
+    assert 'generic_webhook_request_bodies_rejected_total{reason="invalid_length"} 1' in metrics
+    # The memory of the big request is released after answering it
+    assert "generic_webhook_request_body_buffer_bytes 0" in metrics
+
+    # The buffer of a small request is kept for the next ones
+    response = requests.post(f"http://localhost:{port}{req['path']}", json=req["body"], timeout=1)
+    assert response.json() == expected_response
+    metrics = requests.get(f"http://localhost:{port}/metrics", timeout=1).text
+    assert "generic_webhook_request_body_buffer_bytes 4096" in metrics
+
+    server.stop()
+    t.join()
+
+
+@pytest.mark.parametrize("engine", Server.ENGINES)
+def test_stop_with_idle_connections(engine, tmp_path, caplog):
+    list_cases = load_test_case(os.path.join(HTTP_SERVER_TEST_DATA_DIR, "test_case_1.yaml"))
+    webhook_config_file = tmp_path / "webhook_config.yaml"
+    _, req, webhook_config, expected_response = list_cases[0]
+    with open(webhook_config_file, "w") as f:
+        yaml.safe_dump(webhook_config, f)
+
+    port = get_free_port()
+    server = Server(port, CERT_FILE, KEY_FILE, webhook_config_file, engine=engine)
+    t = threading.Thread(target=server.start)
+    t.start()
+    wait_for_server_ready(port, tls=True)
+
+    # The apiserver keeps its connections open between requests
+    with requests.Session() as session:
+        response = session.post(f"https://localhost:{port}{req['path']}", json=req["body"], verify=False, timeout=1)
+        assert response.json() == expected_response
+
+        start_time = time.monotonic()
+        with caplog.at_level(logging.WARNING):
+            server.stop()
+            t.join()
+    # The idle connection is closed right away, without logging any error
+    assert time.monotonic() - start_time < 5
+    assert not [record for record in caplog.records if record.levelno >= logging.ERROR]
@@ -0,0 +1,55 @@
+import threading
+import time
+
+import pytest
+from test_utils import write_configmap_version
+
+from generic_k8s_webhook import inotify
+from generic_k8s_webhook.config_loader import ConfigLoader
+from generic_k8s_webhook.inotify import FileWatcher
+
+pytestmark = pytest.mark.skipif(not inotify.is_available(), reason="inotify is only available on Linux")
+
+
+def test_watcher_follows_configmap_updates(tmp_path):
+    write_configmap_version(tmp_path, "..version_1", "first")
+    watcher = FileWatcher(str(tmp_path / "webhook_config.yaml"))
+    try:
+        for version in ["..version_2", "..version_3"]:
+            result = []
+            t = threading.Thread(target=lambda: result.append(watcher.wait(0.05)))
+            t.start()
+            time.sleep(0.1)
+            write_configmap_version(tmp_path, version, version)
+            t.join(timeout=5)
+            assert result == [True]
+
+        # A thread blocked waiting for a change can be woken up
+        t = threading.Thread(target=lambda: result.append(watcher.wait(0.05)))
+        t.start()
+        watcher.interrupt()
+        t.join(timeout=5)
+        assert result == [True, False]
+    finally:
+        watcher.close()
+
+
+@pytest.mark.parametrize("inotify_available", [True, False])
+def test_config_loader_watch(inotify_available, tmp_path, monkeypatch):
+    if not inotify_available:
+        monkeypatch.setattr(inotify, "_libc", None)
+    write_configmap_version(tmp_path, "..version_1", "first")
+    # Without inotify, it falls back to checking the file periodically
+    refresh_period = 3600 if inotify_available else 0.1
+    config_loader = ConfigLoader(str(tmp_path / "webhook_config.yaml"), refresh_period, watch=True)
+    config_loader.start()
+
+    write_configmap_version(tmp_path, "..version_2", "second")
+    start_time = time.monotonic()
+    while config_loader.generation < 2 and time.monotonic() - start_time < 5:
+        time.sleep(0.01)
+    assert [webhook.name for webhook in config_loader.get_routes()["/path"]] == ["second"]
+
+    config_loader.stop()
+    config_loader.join(timeout=5)
+    assert not config_loader.is_alive()
@@ -1,3 +1,4 @@
+import json
 import os
 
 import pytest
@@ -5,6 +6,7 @@ import yaml
 from test_utils import expand_schemas
 
 from generic_k8s_webhook.config_parser.entrypoint import GenericWebhookConfigManifest
+from generic_k8s_webhook.path_analysis import get_referenced_paths
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 JSONPATCH_YAML = os.path.join(SCRIPT_DIR, "jsonpatch_test.yaml")
@@ -43,3 +45,19 @@ def test_all(name, schema, patch, payload, expected_result):
     json_patch = action.get_patches(payload)
     result = json_patch.apply(payload)
     assert result == expected_result
+
+
+@pytest.mark.parametrize(("name", "schema", "patch", "payload", "expected_result"), _parse_tests())
+def test_projected_payload(name, schema, patch, payload, expected_result):
+    """The patch generated for the payload that only has the referenced paths must be the same"""
+    raw_config = {
+        "apiVersion": f"generic-webhook/{schema}",
+        "kind": "GenericWebhookConfig",
+        "webhooks": [{"name": "test-webhook", "path": "test-path", "actions": [{"patch": [patch]}]}],
+    }
+    gwcm = GenericWebhookConfigManifest(raw_config)
+    referenced_paths = get_referenced_paths(gwcm.list_webhook_config)
+    assert referenced_paths is not None
+    projected_payload = referenced_paths.decode(json.dumps(payload))
+    action = gwcm.list_webhook_config[0].list_actions[0]
+    assert action.get_patches(projected_payload) == action.get_patches(payload)
@@ -0,0 +1,61 @@
+import pytest
+
+from generic_k8s_webhook.limiter import AdaptiveConcurrencyLimiter
+from generic_k8s_webhook.metrics import MetricsRegistry
+
+
+def test_limit_is_enforced():
+    limiter = AdaptiveConcurrencyLimiter(max_limit=2, latency_target=1)
+    assert limiter.try_acquire()
+    assert limiter.try_acquire()
+    assert not limiter.try_acquire()
+    limiter.release(0.1)
+    assert limiter.try_acquire()
+
+
+def test_limit_adapts_to_latency():
+    metrics = MetricsRegistry()
+    limiter = AdaptiveConcurrencyLimiter(
+        max_limit=10, latency_target=1, min_limit=2, backoff_ratio=0.5, metrics=metrics
+    )
+
+    # Slow requests reduce the limit, but never below the min limit
+    for expected_limit in [5, 2.5, 2, 2]:
+        assert limiter.try_acquire()
+        limiter.release(2)
+        assert limiter.limit == expected_limit
+    assert "generic_webhook_concurrency_limit 2" in metrics.render()
+
+    # A request that exceeds its deadline also reduces the limit, regardless of its latency
+    limiter.limit = 4
+    assert limiter.try_acquire()
+    limiter.release(0.1, dropped=True)
+    assert limiter.limit == 2
+
+    # Fast requests increase the limit, but only if it's being used
+    assert limiter.try_acquire()
+    limiter.release(0.1)
+    assert limiter.limit == 3
+    for _ in range(3):
+        assert limiter.try_acquire()
+    assert not limiter.try_acquire()
+    limiter.release(0.1)
+    assert limiter.limit == 4
+    limiter.release(0.1)
+    assert limiter.limit == 5
+    # Only 1 request in flight, which is less than half the limit
+    limiter.release(0.1)
+    assert limiter.limit == 5
+
+    # And never above the max limit
+    limiter.limit = 10
+    for _ in range(10):
+        assert limiter.try_acquire()
+    limiter.release(0.1)
+    assert limiter.limit == 10
+
+
+@pytest.mark.parametrize(("min_limit", "max_limit", "backoff_ratio"), [(0, 10, 0.9), (5, 4, 0.9), (1, 10, 1)])
+def test_invalid_limiter(min_limit, max_limit, backoff_ratio):
+    with pytest.raises(ValueError):
+        AdaptiveConcurrencyLimiter(max_limit, 1, min_limit, backoff_ratio)
@@ -0,0 +1,73 @@
+import json
+import logging
+import queue
+
+import pytest
+
+from generic_k8s_webhook.logs import ACCESS_LOGGER, AccessLogger, BackgroundQueueHandler, RateLimiter, RateLimitFilter
+from generic_k8s_webhook.metrics import MetricsRegistry
+
+
+def test_rate_limiter():
+    rate_limiter = RateLimiter(rate=0.001, burst=3)
+    assert [rate_limiter.allow() for _ in range(5)] == [True, True, True, False, False]
+
+    with pytest.raises(ValueError):
+        RateLimiter(rate=0)
+
+
+def test_rate_limit_filter():
+    log_filter = RateLimitFilter(rate=0.001)
+    records = [logging.LogRecord("test", logging.ERROR, __file__, 1, f"error {i}", None, None) for i in range(3)]
+    assert [log_filter.filter(record) for record in records] == [True, False, False]
+
+    # The next record that goes through reports the dropped ones
+    log_filter.rate_limiter.tokens = 1
+    record = logging.LogRecord("test", logging.ERROR, __file__, 1, "error %d", (3,), None)
+    assert log_filter.filter(record)
+    assert record.getMessage() == "error 3 (2 previous log records were dropped by the rate limit)"
+
+
+def test_access_log(caplog):
+    metrics = MetricsRegistry()
+    access_logger = AccessLogger(sample_rate=0, rate_limit=0.001, metrics=metrics)
+    access_logger.rate_limiter = RateLimiter(rate=0.001, burst=2)
+    with caplog.at_level(logging.INFO, logger=ACCESS_LOGGER):
+        # Not sampled, since the sample rate is 0
+        access_logger.log({"path": "/check", "decision": "allowed"})
+        # The denied requests are always logged, as long as they are within the rate limit
+        for _ in range(3):
+            access_logger.log({"path": "/check", "webhooks": ["deny-all"], "decision": "denied", "patchBytes": 0})
+
+    records = [json.loads(record.getMessage()) for record in caplog.records]
+    assert len(records) == 2
+    assert records[0]["decision"] == "denied"
+    assert records[0]["webhooks"] == ["deny-all"]
+    assert "time" in records[0]
+    assert "generic_webhook_access_log_dropped_total 1" in metrics.render()
+
+
+def test_access_log_disabled(caplog):
+    access_logger = AccessLogger()
+    with caplog.at_level(logging.WARNING, logger=ACCESS_LOGGER):
+        access_logger.log({"path": "/check", "decision": "denied"})
+    assert not caplog.records
+
+
+def test_background_queue_handler_keeps_exceptions_unformatted():
+    log_queue = queue.SimpleQueue()
+    logger = logging.getLogger("generic_k8s_webhook.test_background")
+    logger.addHandler(BackgroundQueueHandler(log_queue))
+    logger.propagate = False
+    try:
+        try:
+            raise ValueError("wrong value")
+        except ValueError:
+            logger.error("Failed with %s", "args", exc_info=True)
+    finally:
+        logger.handlers.clear()
+
+    record = log_queue.get_nowait()
+    assert record.msg == "Failed with args"
+    # The traceback is formatted by the thread that writes the logs
+    assert record.exc_info is not None and record.exc_text is None
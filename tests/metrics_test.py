@@ -0,0 +1,93 @@
+import threading
+
+import pytest
+
+from generic_k8s_webhook.metrics import MetricsRegistry
+
+
+def test_counter_from_several_threads():
+    registry = MetricsRegistry()
+    counter = registry.counter("test_total", "A test counter", ("path",))
+
+    def inc_counter():
+        for _ in range(1000):
+            counter.inc(("/a",))
+        counter.inc(("/b",), 2)
+
+    threads = [threading.Thread(target=inc_counter) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert counter.get(("/a",)) == 8000
+    assert counter.get(("/b",)) == 16
+    assert counter.get(("/c",)) == 0
+    assert registry.render() == (
+        "# HELP test_total A test counter\n"
+        "# TYPE test_total counter\n"
+        'test_total{path="/a"} 8000\n'
+        'test_total{path="/b"} 16\n'
+    )
+
+
+def test_gauge():
+    registry = MetricsRegistry()
+    gauge = registry.gauge("test_in_flight", "A test gauge")
+    gauge.inc()
+    gauge.inc()
+    gauge.dec()
+    callback_gauge = registry.gauge("test_callback", "A gauge with a callback", callback=lambda: 1.5)
+
+    assert gauge.get() == 1
+    assert callback_gauge.get() == 1.5
+    assert registry.render() == (
+        "# HELP test_in_flight A test gauge\n"
+        "# TYPE test_in_flight gauge\n"
+        "test_in_flight 1\n"
+        "# HELP test_callback A gauge with a callback\n"
+        "# TYPE test_callback gauge\n"
+        "test_callback 1.5\n"
+    )
+
+
+def test_histogram():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("test_seconds", "A test histogram", ("webhook",), buckets=(0.1, 1))
+    for value in [0.05, 0.1, 0.5, 3]:
+        histogram.observe(value, ('my "webhook"',))
+
+    assert histogram.get_count(('my "webhook"',)) == 4
+    assert registry.render() == (
+        "# HELP test_seconds A test histogram\n"
+        "# TYPE test_seconds histogram\n"
+        'test_seconds_bucket{webhook="my \\"webhook\\"",le="0.1"} 2\n'
+        'test_seconds_bucket{webhook="my \\"webhook\\"",le="1"} 3\n'
+        'test_seconds_bucket{webhook="my \\"webhook\\"",le="+Inf"} 4\n'
+        'test_seconds_sum{webhook="my \\"webhook\\""} 3.65\n'
+        'test_seconds_count{webhook="my \\"webhook\\""} 4\n'
+    )
+
+
+def test_duplicated_metric():
+    registry = MetricsRegistry()
+    registry.counter("test_total", "A test counter")
+    with pytest.raises(ValueError):
+        registry.gauge("test_total", "Another metric with the same name")
+
+
+def test_metrics_without_labels_are_always_exposed():
+    registry = MetricsRegistry()
+    registry.counter("test_total", "A test counter")
+    registry.histogram("test_seconds", "A test histogram", buckets=(1,))
+    assert registry.render() == (
+        "# HELP test_total A test counter\n"
+        "# TYPE test_total counter\n"
+        "test_total 0\n"
+        "# HELP test_seconds A test histogram\n"
+        "# TYPE test_seconds histogram\n"
+        'test_seconds_bucket{le="1"} 0\n'
+        'test_seconds_bucket{le="+Inf"} 0\n'
+        "test_seconds_sum 0\n"
+        "test_seconds_count 0\n"
+    )
@@ -0,0 +1,127 @@
+import json
+import os
+
+import pytest
+import yaml
+
+from generic_k8s_webhook import operators
+from generic_k8s_webhook.config_parser.entrypoint import GenericWebhookConfigManifest
+from generic_k8s_webhook.path_analysis import PathTrie, get_admission_review_paths, get_referenced_paths
+from generic_k8s_webhook.webhook import Action, Webhook
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+EXAMPLES_DIR = os.path.join(SCRIPT_DIR, "../examples")
+
+
+def _load_webhooks(config_file: str) -> list[Webhook]:
+    with open(os.path.join(EXAMPLES_DIR, config_file), "r", encoding="utf-8") as f:
+        return GenericWebhookConfigManifest(yaml.safe_load(f)).list_webhook_config
+
+
+@pytest.mark.parametrize(
+    ("config_file", "expected_paths"),
+    [
+        ("check-namespace-sa.yaml", [".kind", ".metadata.namespace"]),
+        (
+            "inject-node-affinity.yaml",
+            [
+                ".kind",
+                ".spec.affinity.nodeAffinity.preferredDuringSchedulingIgnoredDuringExecution",
+                ".spec.affinity.nodeAffinity.requiredDuringSchedulingIgnoredDuringExecution.nodeSelectorTerms.*"
+                + ".matchExpressions.*",
+            ],
+        ),
+    ],
+)
+def test_referenced_paths(config_file, expected_paths):
+    assert get_referenced_paths(_load_webhooks(config_file)).get_paths() == expected_paths
+
+
+def test_unsupported_operator():
+    class CustomOperator(operators.Const):
+        pass
+
+    webhook = Webhook("custom", "/custom", [Action(operators.Not(CustomOperator(True)), [], True)])
+    assert get_referenced_paths([webhook]) is None
+    # The whole object is decoded
+    assert get_admission_review_paths([webhook]).get_paths() == [".request.object", ".request.uid"]
+
+
+def test_admission_review_paths_with_old_object():
+    webhooks = _load_webhooks("check-namespace-sa.yaml")
+    assert get_admission_review_paths(webhooks).get_paths() == [
+        ".request.object.kind",
+        ".request.object.metadata.namespace",
+        ".request.uid",
+    ]
+    assert get_admission_review_paths(webhooks, include_old_object=True).get_paths() == [
+        ".request.object.kind",
+        ".request.object.metadata.namespace",
+        ".request.oldObject.kind",
+        ".request.oldObject.metadata.namespace",
+        ".request.operation",
+        ".request.uid",
+    ]
+
+
+def test_trie():
+    trie = PathTrie()
+    trie.add(["metadata", "labels", "app"])
+    trie.add(["spec", "containers", "*", "name"])
+    trie.add(["metadata", "labels"])
+    # Redundant, since it's below `.metadata.labels`
+    trie.add(["metadata", "labels", "team"])
+    assert trie.get_paths() == [".metadata.labels", ".spec.containers.*.name"]
+
+    other = PathTrie()
+    other.add(["spec", "containers", "0", "image"])
+    other.add(["metadata"])
+    assert trie.merge(other).get_paths() == [".metadata", ".spec.containers.*.name", ".spec.containers.0.image"]
+
+
+@pytest.mark.parametrize(
+    "document",
+    [
+        {"kind": "Pod", "metadata": {"name": "foo", "labels": {"app": "foo", "team": "bar"}}},
+        {
+            "kind": "ConfigMap",
+            "metadata": {"name": "foo", "annotations": {"a.b/c": '{"json": ["in", "a", "string"]}'}},
+            "data": {"key": 'escaped \\" quotes and brackets ]}[{' * 100, "unicode": "ñ€𝄞"},
+            "binaryData": {"nested": [[1, 2.5e-3, -3], {"deep": [{"deeper": [True, False, None]}]}]},
+        },
+        {
+            "spec": {
+                "containers": [
+                    {"name": "main", "image": "foo", "env": [{"name": "A", "value": "1"}]},
+                    {"name": "sidecar", "args": ["x" * 1000]},
+                ]
+            }
+        },
+        {"spec": {"containers": "not a list"}, "kind": None},
+    ],
+)
+def test_decode(document):
+    trie = PathTrie()
+    trie.add(["kind"])
+    trie.add(["metadata", "labels"])
+    trie.add(["metadata", "annotations", "a.b/c"])
+    trie.add(["spec", "containers", "*", "name"])
+    trie.add(["data", "unicode"])
+
+    raw_bytes = json.dumps(document, indent=2).encode("utf-8")
+    # The servers pass a view of the start of a bigger buffer
+    raw_view = memoryview(bytearray(raw_bytes + b"garbage"))[: len(raw_bytes)]
+    for raw in [json.dumps(document), raw_bytes, raw_view]:
+        decoded = trie.decode(raw)
+        assert decoded == trie.project(document)
+    # Nothing outside the referenced paths is decoded
+    assert "binaryData" not in decoded
+    assert "name" not in decoded.get("metadata", {})
+
+
+@pytest.mark.parametrize("raw", ['{"kind": "Pod"', '{"kind" "Pod"}', '{"kind": "Pod"} extra', '{"other": "x}'])
+def test_decode_invalid_document(raw):
+    trie = PathTrie()
+    trie.add(["kind"])
+    with pytest.raises(ValueError):
+        trie.decode(raw)
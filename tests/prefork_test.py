@@ -0,0 +1,59 @@
+import os
+import signal
+import subprocess
+import sys
+import time
+
+SUPERVISOR_SCRIPT = """
+import os
+import signal
+import sys
+
+from generic_k8s_webhook.prefork import Supervisor
+
+pids_dir = sys.argv[1]
+
+
+def run_worker():
+    stop = []
+    signal.signal(signal.SIGTERM, lambda *args: stop.append(True))
+    with open(os.path.join(pids_dir, str(os.getpid())), "w") as f:
+        f.write("started")
+    while not stop:
+        signal.pause()
+
+
+sys.exit(Supervisor(2, run_worker, min_worker_uptime=0).run())
+"""
+
+
+def wait_for_pids(pids_dir, n_pids: int) -> list[int]:
+    for _ in range(50):
+        pids = [int(pid) for pid in os.listdir(pids_dir)]
+        if len(pids) >= n_pids:
+            return pids
+        time.sleep(0.1)
+    raise RuntimeError(f"Expected {n_pids} workers, but got {len(pids)}")
+
+
+def is_running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    return True
+
+
+def test_supervisor_restarts_and_stops_workers(tmp_path):
+    process = subprocess.Popen([sys.executable, "-c", SUPERVISOR_SCRIPT, str(tmp_path)])
+    first_pids = wait_for_pids(tmp_path, 2)
+
+    # A dead worker is replaced by a new one
+    os.kill(first_pids[0], signal.SIGKILL)
+    all_pids = wait_for_pids(tmp_path, 3)
+
+    # The SIGTERM is forwarded to the workers and the supervisor finishes after all of them
+    process.send_signal(signal.SIGTERM)
+    assert process.wait(timeout=5) == 0
+    for pid in all_pids:
+        assert not is_running(pid)
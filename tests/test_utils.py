@@ -67,3 +67,21 @@ def expand_schemas(schemas_subsets: dict[str, list[str]], list_schemas: list[str
         for schemas_superset in schemas_subsets.get(schema, []):
             final_schemas.add(schemas_superset)
     return sorted(list(final_schemas))
+
+
+def write_configmap_version(directory, version: str, webhook_name: str) -> None:
+    """Writes the files like the kubelet: each version of a ConfigMap is written in a new directory
+    and the `..data` symlink is replaced atomically to point to it
+    """
+    os.mkdir(directory / version)
+    webhook_config = {
+        "apiVersion": "generic-webhook/v1alpha1",
+        "kind": "GenericWebhookConfig",
+        "webhooks": [{"name": webhook_name, "path": "/path", "actions": [{"accept": True}]}],
+    }
+    with open(directory / version / "webhook_config.yaml", "w") as f:
+        yaml.safe_dump(webhook_config, f)
+    os.symlink(version, directory / "..data_tmp")
+    os.replace(directory / "..data_tmp", directory / "..data")
+    if not os.path.lexists(directory / "webhook_config.yaml"):
+        os.symlink("..data/webhook_config.yaml", directory / "webhook_config.yaml")